@@ -1,11 +1,12 @@
 import os
-from flask import Flask, render_template, request, redirect, url_for, flash, send_file, Response
+from flask import Flask, render_template, request, redirect, url_for, flash, send_file, Response, jsonify, abort
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from flask_admin import Admin, AdminIndexView, expose
 from flask_admin.contrib.mongoengine import ModelView
 from flask_mongoengine import MongoEngine
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
+from itsdangerous import URLSafeTimedSerializer, BadSignature
 from datetime import datetime, timedelta
 from wtforms import PasswordField
 from pathlib import Path
@@ -13,11 +14,21 @@ import sys
 sys.path.append(str(Path(__file__).parent.parent))
 import requests
 import tempfile
+import time
 from apscheduler.schedulers.background import BackgroundScheduler
-from leaderboard.database.mongodb import db, User, Workout
+from mongoengine import NotUniqueError
+from leaderboard.database.mongodb import db, User, Workout, ensure_indexes
 from leaderboard.database.gcs_storage import GCSStorage
+from leaderboard.database.direct_upload import parse_content_range
+from leaderboard.dedup import scoring_key, find_reusable_result, reused_metrics, release_videos
+from leaderboard.rankings import (RANKED_METRICS, ALL_EXERCISES, update_rankings, remove_rankings, top_workouts,
+                                  ranking_page)
+from leaderboard.pagination import user_workouts_page, workout_json
+from leaderboard.parsing import parse_bool
+from leaderboard.user_stats import user_stats, rebuild_user_stats, record_created, record_completed, record_removed
 from leaderboard.auth.google_auth import GoogleAuth
 from leaderboard.config.settings import settings
+from src.config import exercise_settings
 
 # Environment Variables
 app = Flask(__name__)
@@ -46,6 +57,9 @@ oauth = GoogleAuth(app)
 # Initialize GCS Storage
 gcs = GCSStorage()
 
+# Signs the state of direct-to-bucket uploads handed to the browser between session creation and completion
+upload_tokens = URLSafeTimedSerializer(settings.SECRET_KEY, salt='direct-upload')
+
 class MyAdminIndexView(AdminIndexView):
     def is_accessible(self):
         return current_user.is_authenticated and current_user.is_admin
@@ -81,6 +95,15 @@ class SecureModelView(ModelView):
         if form.password.data:
             model.password_hash = generate_password_hash(form.password.data)
 
+class WorkoutModelView(SecureModelView):
+    def after_model_change(self, form, model, is_created):
+        update_rankings(model)
+        rebuild_user_stats(model.user.id)
+
+    def after_model_delete(self, model):
+        remove_rankings(model)
+        rebuild_user_stats(model.user.id)
+
 class UserModelView(SecureModelView):
     column_exclude_list = ['password_hash']
     column_searchable_list = ['username', 'email']
@@ -99,7 +122,7 @@ class UserModelView(SecureModelView):
 
 # Add model views
 admin.add_view(UserModelView(User))
-admin.add_view(SecureModelView(Workout))  # Assuming Workout is also a MongoEngine model
+admin.add_view(WorkoutModelView(Workout))  # Keeps the leaderboard rankings in sync with admin edits
 
 @login_manager.user_loader
 def load_user(user_id):
@@ -108,10 +131,23 @@ def load_user(user_id):
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in {'mp4', 'avi', 'mov'}
 
+def page_size():
+    """Returns the page size requested with ?limit=, clamped to the configured bounds."""
+    limit = request.args.get('limit', settings.LEADERBOARD_PAGE_SIZE, type=int)
+    return min(max(limit, 1), settings.LEADERBOARD_MAX_PAGE_SIZE)
+
+def leaderboard_args():
+    """Returns the exercise type and ranked metric requested with ?exercise_type= and ?sort_by=."""
+    exercise_type = request.args.get('exercise_type', 'pullups')
+    sort_by = request.args.get('sort_by', 'max_power_per_kg')
+    if sort_by not in RANKED_METRICS:
+        sort_by = 'max_power_per_kg'
+    return exercise_type, sort_by
+
 @app.route('/')
 def index():
     # Get public workouts for leaderboard
-    public_workouts = Workout.objects(is_public=True).order_by('-max_power_per_kg').limit(10)
+    public_workouts = top_workouts(ALL_EXERCISES, 'max_power_per_kg', 10)
     return render_template('index.html', workouts=public_workouts)
 
 @app.route('/auth/google')
@@ -180,24 +216,23 @@ def logout():
 @app.route('/dashboard')
 @login_required
 def dashboard():
-    # Get user's workouts ordered by creation date
-    user_workouts = Workout.objects(user=current_user.id).order_by('-created_at')
-
-    # Calculate statistics
-    total_reps = sum(workout.rep_count for workout in user_workouts)
-    best_power = max((workout.max_power_per_kg for workout in user_workouts), default=0)
+    # Get one page of the user's workouts ordered by creation date
+    try:
+        workouts, next_cursor = user_workouts_page(current_user.id, page_size(), request.args.get('cursor'))
+    except ValueError:
+        abort(400)
 
-    # Get best power per exercise type
-    exercise_powers = {}
-    for workout in user_workouts:
-        current_max = exercise_powers.get(workout.exercise_type, 0)
-        exercise_powers[workout.exercise_type] = max(current_max, workout.max_power_per_kg)
+    # Statistics over all workouts, kept up to date in the user's rollup
+    stats = user_stats(current_user.id)
 
     return render_template('dashboard.html',
-                           workouts=user_workouts,
-                           total_reps=total_reps,
-                           best_power=best_power,
-                           exercise_powers=exercise_powers)
+                           workouts=workouts,
+                           next_cursor=next_cursor,
+                           first_page=not request.args.get('cursor'),
+                           total_workouts=stats.workout_count,
+                           total_reps=stats.total_reps,
+                           best_power=stats.best_power_per_kg,
+                           exercise_powers=stats.exercise_powers)
 
 @app.route('/upload', methods=['GET', 'POST'])
 @login_required
@@ -220,15 +255,16 @@ def upload():
             filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
             file.save(filepath)
 
-            # Upload to GCS
+            # Upload to GCS, once per distinct video
             try:
-                video_url = gcs.upload_video(filepath, str(current_user.id))
+                video_url, video_hash = gcs.upload_video_deduplicated(filepath)
 
                 # Create initial workout entry with pending status
                 body_mass = float(request.form['body_mass'])
                 exercise_mass = float(request.form['exercise_mass'])
                 exercise_type = request.form['exercise_type']
                 is_public = 'is_public' in request.form
+                key = scoring_key(video_hash, exercise_type, exercise_mass)
                 
                 workout = Workout(
                     user=current_user,
@@ -242,12 +278,30 @@ def upload():
                     avg_power_per_kg=0,  
                     max_power_per_kg=0,  
                     video_path=video_url,  # Original video URL
+                    source_video_path=video_url,
+                    video_hash=video_hash,
+                    scoring_key=key,
                     is_public=is_public,
                     status="processing"  # Add status field to Workout model
                 )
-                workout.save()
-                print('Workout created in mongodb...')
-                process_video(workout.id)
+
+                # Reuse the metrics and processed video of the same clip scored the same way
+                existing = find_reusable_result(key)
+                if existing:
+                    print(f'Reusing results of workout {existing.id}')
+                    for name, value in reused_metrics(existing, body_mass).items():
+                        setattr(workout, name, value)
+                    workout.video_path = existing.video_path
+                    workout.status = "complete"
+                    workout.save()
+                    record_created(workout)
+                    record_completed(workout)
+                    update_rankings(workout)
+                else:
+                    workout.save()
+                    record_created(workout)
+                    print('Workout created in mongodb...')
+                    process_video(workout.id)
 
                 # Clean up temporary file
                 if os.path.exists(filepath):
@@ -265,12 +319,188 @@ def upload():
 
                 return redirect(url_for('dashboard'))
 
-    return render_template('upload.html')
+    return render_template('upload.html', max_bytes=settings.DIRECT_UPLOAD_MAX_BYTES)
+
+def load_upload_token(token):
+    """Returns the state of a direct upload from its signed token, or None if it is invalid or expired."""
+    try:
+        return upload_tokens.loads(token, max_age=settings.UPLOAD_SESSION_TTL)
+    except BadSignature:
+        return None
+
+@app.route('/uploads', methods=['POST'])
+@login_required
+def create_upload():
+    """
+    Starts a direct upload of a video from the browser to the bucket, bypassing this server.
+
+    Expected JSON payload:
+    {
+        "filename": "pullups.mp4",
+        "size": 104857600,  (bytes)
+        "content_type": "video/mp4",
+        "body_mass": 70.5,
+        "exercise_mass": 20.0,
+        "exercise_type": "pullups",
+        "is_public": true
+    }
+
+    Returns:
+        JSON: {"session_url": resumable upload session to PUT the video to in chunks with Content-Range headers,
+               "upload_token": token to pass to /uploads/complete, "chunk_size": bytes per chunk}
+    """
+    data = request.get_json(silent=True) or {}
+    filename = secure_filename(str(data.get('filename', '')))
+    if not allowed_file(filename):
+        return jsonify({"error": "Unsupported file type, upload an MP4, AVI or MOV video"}), 400
+    try:
+        size = int(data['size'])
+        body_mass = float(data['body_mass'])
+        exercise_mass = float(data['exercise_mass'])
+        exercise_type = str(data['exercise_type'])
+        is_public = parse_bool(data.get('is_public', False))
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({"error": f"Invalid upload request: {str(e)}"}), 400
+    if exercise_type not in exercise_settings:
+        return jsonify({"error": f"Unknown exercise type: {exercise_type}"}), 400
+    if not 0 < size <= settings.DIRECT_UPLOAD_MAX_BYTES:
+        return jsonify({"error": f"Videos must be at most {settings.DIRECT_UPLOAD_MAX_BYTES // 1024 ** 2} MB"}), 400
+
+    destination_path = gcs.direct_upload_path(current_user.id, filename)
+    state = {
+        'user_id': str(current_user.id),
+        'video_url': str(destination_path),
+        'size': size,
+        'body_mass': body_mass,
+        'exercise_mass': exercise_mass,
+        'exercise_type': exercise_type,
+        'is_public': is_public,
+    }
+    token = upload_tokens.dumps(state)
+
+    try:
+        if gcs.local:
+            session_url = url_for('local_upload', token=token, _external=True)
+        else:
+            session_url = gcs.create_upload_session(destination_path, data.get('content_type') or 'video/mp4', size,
+                                                    origin=request.host_url.rstrip('/'))
+    except Exception as e:
+        print(f'Error creating upload session: {str(e)}')
+        return jsonify({"error": f"Error creating upload session: {str(e)}"}), 500
+
+    return jsonify({"session_url": session_url, "upload_token": token, "chunk_size": settings.UPLOAD_CHUNK_SIZE})
+
+@app.route('/uploads/local/<token>', methods=['PUT'])
+def local_upload(token):
+    """
+    Stand-in for a GCS resumable upload session URI with STORAGE_BACKEND=local, for development and offline tests.
+
+    Accepts the same requests as GCS: a chunk with "Content-Range: bytes first-last/total", or an empty status
+    query with "Content-Range: bytes */total". Answers 308 with a Range header of the bytes received while the
+    upload is incomplete, and 200 once it is complete. Like a session URI, the token is the only credential.
+    """
+    state = load_upload_token(token)
+    if not gcs.local or state is None:
+        abort(404)
+    try:
+        start, _, total = parse_content_range(request.headers.get('Content-Range'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if total != state['size']:
+        return jsonify({"error": f"Upload size {total} does not match the session size {state['size']}"}), 400
+
+    session = gcs.local_upload_session(state['video_url'], state['size'])
+    received = session.received if start is None else session.write(start, request.get_data())
+    if received >= state['size']:
+        return jsonify({"size": received}), 200
+    headers = {'Range': f'bytes=0-{received - 1}'} if received else {}
+    return Response(status=308, headers=headers)
+
+@app.route('/uploads/complete', methods=['POST'])
+@login_required
+def complete_upload():
+    """
+    Creates the workout of a finished direct upload and starts processing it.
+
+    Expected JSON payload: {"upload_token": token returned by /uploads}. Calling it again for the same upload
+    returns the same workout.
+
+    Returns:
+        JSON: {"workout_id": str, "redirect_url": dashboard URL}
+    """
+    data = request.get_json(silent=True) or {}
+    state = load_upload_token(str(data.get('upload_token', '')))
+    if state is None or state['user_id'] != str(current_user.id):
+        return jsonify({"error": "Invalid or expired upload token"}), 400
+
+    existing = Workout.objects(upload_id=state['video_url']).first()
+    if existing:
+        return jsonify({"workout_id": str(existing.id), "redirect_url": url_for('dashboard')})
+
+    stored_size = gcs.stored_size(state['video_url'])
+    if stored_size != state['size']:
+        return jsonify({"error": "Upload is not complete", "stored_size": stored_size}), 409
+
+    try:
+        workout = Workout(
+            user=current_user.id,
+            body_mass=state['body_mass'],
+            exercise_mass=state['exercise_mass'],
+            exercise_type=state['exercise_type'],
+            # Will be updated after processing
+            rep_count=0,
+            avg_power=0,
+            max_power=0,
+            avg_power_per_kg=0,
+            max_power_per_kg=0,
+            video_path=state['video_url'],  # Original video URL
+            source_video_path=state['video_url'],
+            upload_id=state['video_url'],
+            is_public=state['is_public'],
+            status="processing"
+        )
+        try:
+            workout.save()
+        except NotUniqueError:
+            # A concurrent call for the same upload created the workout first
+            existing = Workout.objects(upload_id=state['video_url']).first()
+            return jsonify({"workout_id": str(existing.id), "redirect_url": url_for('dashboard')})
+        record_created(workout)
+        print('Workout created in mongodb...')
+        process_video(workout.id)
+    except Exception as e:
+        print(f'Error creating workout: {str(e)}')
+        return jsonify({"error": f"Error creating workout: {str(e)}"}), 500
+
+    return jsonify({"workout_id": str(workout.id), "redirect_url": url_for('dashboard')})
 
 # Initialize the scheduler
 scheduler = BackgroundScheduler()
 scheduler.start()
 
+def wait_for_job(job_url: str) -> dict:
+    """
+    Polls an inference job until it finishes.
+
+    Failed polls, e.g. connection errors or non-JSON responses while the inference service restarts, are
+    retried at the next poll. A job still unfinished after settings.JOB_MAX_WAIT seconds is reported as failed.
+
+    Returns:
+        dict: The last job status, with status "error" and the reason if it timed out
+    """
+    deadline = time.monotonic() + settings.JOB_MAX_WAIT
+    job = {}
+    while time.monotonic() < deadline:
+        time.sleep(settings.JOB_POLL_INTERVAL)
+        try:
+            job = requests.get(job_url, timeout=settings.JOB_REQUEST_TIMEOUT).json()
+        except (requests.RequestException, ValueError) as e:
+            print(f"Error polling {job_url}, retrying: {str(e)}")
+            continue
+        if job.get('status') not in ('queued', 'running'):
+            return job
+    return {'status': 'error', 'error': f"Processing did not finish within {settings.JOB_MAX_WAIT:.0f} seconds"}
+
 def process_video_background(workout_id):
     """Background task to process video and update workout metrics"""
     try:
@@ -282,22 +512,29 @@ def process_video_background(workout_id):
         # Prepare json data for inference service
         inference_request_data = {
             "workout_id": str(workout.id),
-            "video_url": str(workout.video_path),
+            # The original upload: video_path holds the processed video once a job completed
+            "video_url": str(workout.source_video_path or workout.video_path),
             "body_mass": workout.body_mass,
             "exercise_mass": workout.exercise_mass,
-            "exercise_type": workout.exercise_type
+            "exercise_type": workout.exercise_type,
+            "video_hash": workout.video_hash
         }
         
-        # Make request to inference service
+        # Submit job to inference service and poll until it finishes
         response = requests.post(
-            f"{settings.INFERENCE_URL}/process_workout", 
-            json=inference_request_data
+            f"{settings.INFERENCE_URL}/jobs", 
+            json=inference_request_data,
+            timeout=settings.JOB_REQUEST_TIMEOUT
         )
+        if response.status_code != 202:
+            workout.update(status="error", error_message=response.json().get('error', 'Unknown error'))
+            return
 
-        results = response.json()
+        job = wait_for_job(f"{settings.INFERENCE_URL}/jobs/{response.json()['job_id']}")
+        results = job.get('result') or {'error': job.get('error', 'Unknown error')}
 
-        if response.status_code == 200:
-            # Update workout with processed metrics
+        if job.get('status') == 'complete':
+            # Update workout with processed metrics, keeping the original video if none was rendered
             workout.update(
                 status="complete",
                 error_message="",
@@ -306,8 +543,16 @@ def process_video_background(workout_id):
                 max_power=results['metrics']['max_power'],
                 avg_power_per_kg=results['metrics']['avg_power_per_kg'],
                 max_power_per_kg=results['metrics']['max_power_per_kg'],
-                video_path=results['processed_video_url']
+                video_path=results.get('processed_video_url') or workout.video_path,
+                video_hash=results.get('video_hash') or workout.video_hash
             )
+            if results.get('video_hash') and not workout.scoring_key:
+                # Direct uploads are hashed while processing, make their results reusable from now on
+                workout.update(scoring_key=scoring_key(results['video_hash'], workout.exercise_type,
+                                                       workout.exercise_mass))
+            workout.reload()
+            update_rankings(workout)
+            record_completed(workout)
         else:
             # If inference service fails, set status to error
             error_msg = results.get('error', 'Unknown error')
@@ -325,8 +570,10 @@ def process_video(workout_id):
             flash('Workout not found')
             return redirect(url_for('dashboard'))
 
-        # Update status to processing
+        # Update status to processing, which takes it off the leaderboards until it completes again
         workout.update(status="processing")
+        remove_rankings(workout)
+        record_removed(workout, deleted=False)
         
         # Schedule background task
         scheduler.add_job(
@@ -347,17 +594,68 @@ def process_video(workout_id):
 
 @app.route('/leaderboard')
 def leaderboard():
-    exercise_type = request.args.get('exercise_type', 'pullups')
-    sort_by = request.args.get('sort_by', 'max_power_per_kg')
+    exercise_type, sort_by = leaderboard_args()
 
-    # Get public workouts for specified exercise type
-    workouts = Workout.objects(is_public=True, exercise_type=exercise_type).order_by(f'-{sort_by}')
+    # Get one page of public workouts for specified exercise type from its materialized ranking
+    try:
+        workouts, first_rank, next_cursor = ranking_page(exercise_type, sort_by, page_size(),
+                                                         request.args.get('cursor'))
+    except ValueError:
+        abort(400)
 
     return render_template('leaderboard.html',
                            workouts=workouts,
+                           first_rank=first_rank,
+                           next_cursor=next_cursor,
                            exercise_type=exercise_type,
                            sort_by=sort_by)
 
+@app.route('/api/leaderboard')
+def api_leaderboard():
+    """
+    JSON variant of /leaderboard.
+
+    Query parameters: exercise_type, sort_by, limit, and cursor, the next_cursor of the previous page.
+
+    Returns:
+        JSON: {"workouts": [{"rank", "id", "username", ...}], "next_cursor": str or null}
+    """
+    exercise_type, sort_by = leaderboard_args()
+    try:
+        workouts, first_rank, next_cursor = ranking_page(exercise_type, sort_by, page_size(),
+                                                         request.args.get('cursor'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return jsonify({
+        "exercise_type": exercise_type,
+        "sort_by": sort_by,
+        "workouts": [dict(workout_json(workout), rank=rank)
+                     for rank, workout in enumerate(workouts, start=first_rank)],
+        "next_cursor": next_cursor
+    })
+
+@app.route('/api/workouts')
+@login_required
+def api_workouts():
+    """
+    JSON variant of the workout list of /dashboard, newest first.
+
+    Query parameters: limit, and cursor, the next_cursor of the previous page.
+
+    Returns:
+        JSON: {"workouts": [{"id", "status", "is_public", ...}], "next_cursor": str or null}
+    """
+    try:
+        workouts, next_cursor = user_workouts_page(current_user.id, page_size(), request.args.get('cursor'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return jsonify({
+        "workouts": [workout_json(workout, owner=True) for workout in workouts],
+        "next_cursor": next_cursor
+    })
+
 @app.route('/toggle_visibility/<workout_id>', methods=['POST'])  
 @login_required
 def toggle_visibility(workout_id):
@@ -369,6 +667,7 @@ def toggle_visibility(workout_id):
 
     workout.is_public = not workout.is_public
     workout.save()
+    update_rankings(workout)
 
     visibility_status = "public" if workout.is_public else "private"
     flash(f'Workout is now {visibility_status}')
@@ -383,14 +682,15 @@ def delete_workout(workout_id):
         flash('You do not have permission to delete this workout')
         return redirect(url_for('dashboard'))
 
-    # Delete video from GCS if exists
-    if workout.video_path:
-        try:
-            gcs.delete_video(workout.video_path)
-        except Exception as e:
-            app.logger.error(f"Error deleting video from GCS: {e}")
+    # Delete videos from GCS unless other workouts of the same clip still use them
+    try:
+        release_videos(workout, gcs)
+    except Exception as e:
+        app.logger.error(f"Error deleting video from GCS: {e}")
     
+    remove_rankings(workout)
     workout.delete()
+    record_removed(workout)
     flash('Workout deleted successfully')
     return redirect(url_for('dashboard'))
 
@@ -409,6 +709,13 @@ def download_video(workout_id):
         return redirect(url_for('dashboard'))
 
     try:
+        if gcs.cache:
+            # Serve the cached copy, downloading it from GCS only the first time
+            return send_file(gcs.cached_video(video_path),
+                             mimetype='video/mp4',
+                             as_attachment=True,
+                             download_name=f'workout_{workout_id}.mp4')
+
         # Create temporary file to download from GCS
         with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False) as temp_file:
             temp_path = temp_file.name
@@ -452,6 +759,7 @@ def create_admin_user():
 
 if __name__ == '__main__':
     with app.app_context():
+        ensure_indexes()
         create_admin_user()
 
     # Use PORT environment variable if available
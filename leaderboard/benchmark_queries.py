@@ -0,0 +1,213 @@
+"""
+Latency and query plans of the route queries on a large synthetic dataset, without and with indexes.
+
+Fills a scratch database with synthetic users and workouts, then times every hot route query and records its
+explain() plan twice: with only the _id indexes, and after ensure_indexes(). Runs against a local MongoDB, or
+against mongomock with --mongomock, which has no query planner, so it only reports latencies there.
+
+Usage:
+    python leaderboard/benchmark_queries.py                         # local MongoDB at mongodb://localhost:27017
+    python leaderboard/benchmark_queries.py --workouts 500000 --users 5000
+    python leaderboard/benchmark_queries.py --mongomock --workouts 20000
+
+The scratch database is dropped afterwards unless --keep is given. Never point it at a production database.
+"""
+import argparse
+import json
+import os
+import random
+import time
+from datetime import datetime, timedelta
+import numpy as np
+from bson import ObjectId
+from mongoengine import Q, connect, disconnect
+from pathlib import Path
+import sys
+sys.path.append(str(Path(__file__).parent.parent))
+from leaderboard.database.mongodb import User, Workout, LeaderboardEntry, UserStats, ensure_indexes
+from leaderboard.rankings import rebuild_rankings, ALL_EXERCISES, RANKED_METRICS
+
+DEFAULT_REPORT = Path(__file__).parent.parent / "benchmark/queries.json"
+EXERCISES = ('pullups', 'pushups', 'squats')
+
+
+def fill(users: int, workouts: int, seed: int = 0) -> dict:
+    """
+    Inserts synthetic users, workouts and their rankings.
+
+    Returns:
+        dict: Sample keys for the queries: a heavy user, a username, a google_id, a scoring key and a video URL
+    """
+    rng = random.Random(seed)
+    user_docs = [{'_id': ObjectId(), 'username': f'athlete{i}', 'email': f'athlete{i}@example.com',
+                  'google_id': str(10 ** 20 + i), 'is_admin': False, 'created_at': datetime(2024, 1, 1)}
+                 for i in range(users)]
+    User._get_collection().insert_many(user_docs)
+
+    # Zipf-like activity: a few users have most of the workouts, like real usage
+    weights = [1 / (i + 1) for i in range(users)]
+    owners = rng.choices([u['_id'] for u in user_docs], weights=weights, k=workouts)
+    start = datetime(2024, 1, 1)
+    batch = []
+    for i, owner in enumerate(owners):
+        body_mass = rng.uniform(50, 100)
+        max_power = rng.uniform(100, 1500)
+        video = f'gs://bucket/videos/sha256/{i:064x}.mp4'
+        batch.append({
+            'user': owner, 'body_mass': body_mass, 'exercise_mass': body_mass, 'exercise_type': rng.choice(EXERCISES),
+            'rep_count': rng.randint(1, 30), 'avg_power': max_power * 0.7, 'max_power': max_power,
+            'avg_power_per_kg': max_power * 0.7 / body_mass, 'max_power_per_kg': max_power / body_mass,
+            'video_path': video, 'source_video_path': video, 'video_hash': f'{i:064x}', 'scoring_key': f'{i:064x}',
+            'is_public': rng.random() < 0.5, 'status': 'complete' if rng.random() < 0.95 else 'error',
+            'created_at': start + timedelta(seconds=i * 60),
+        })
+        if len(batch) == 10000:
+            Workout._get_collection().insert_many(batch)
+            batch = []
+    if batch:
+        Workout._get_collection().insert_many(batch)
+    rebuild_rankings()
+
+    heavy_user = user_docs[0]
+    return {
+        'user': heavy_user['_id'],
+        'username': user_docs[users // 2]['username'],
+        'google_id': user_docs[users // 2]['google_id'],
+        'scoring_key': f'{workouts // 2:064x}',
+        'video_url': f'gs://bucket/videos/sha256/{workouts // 2:064x}.mp4',
+    }
+
+
+def route_queries(sample: dict) -> dict:
+    """Returns {name: function returning the queryset} of the queries the frontend routes run."""
+    # Cursors in the middle of the ranking and of the heavy user's history, for deep pages
+    middle = LeaderboardEntry.objects(exercise_type='pullups', metric='max_power_per_kg').order_by('-value')
+    middle = middle.skip(middle.count() // 2).first()
+    history = Workout.objects(user=sample['user']).order_by('-created_at', '-id')
+    older = history.skip(history.count() // 2).first()
+
+    return {
+        'index: overall top 10': lambda: LeaderboardEntry.objects(
+            exercise_type=ALL_EXERCISES, metric='max_power_per_kg').order_by('-value', 'workout').limit(11),
+        'leaderboard: first page': lambda: LeaderboardEntry.objects(
+            exercise_type='pullups', metric='max_power_per_kg').order_by('-value', 'workout').limit(51),
+        'leaderboard: deep page': lambda: LeaderboardEntry.objects(
+            Q(value__lt=middle.value) | Q(value=middle.value, workout__gt=middle.workout.id),
+            exercise_type='pullups', metric='max_power_per_kg').order_by('-value', 'workout').limit(51),
+        'dashboard: first page': lambda: Workout.objects(user=sample['user']).order_by('-created_at', '-id').limit(51),
+        'dashboard: deep page': lambda: Workout.objects(
+            Q(created_at__lt=older.created_at) | Q(created_at=older.created_at, id__lt=older.id),
+            user=sample['user']).order_by('-created_at', '-id').limit(51),
+        'dashboard: stats': lambda: UserStats.objects(user=sample['user']).limit(1),
+        'upload: reusable result': lambda: Workout.objects(scoring_key=sample['scoring_key'], status='complete').limit(1),
+        'delete: shared video': lambda: Workout.objects(
+            Q(video_path=sample['video_url']) | Q(source_video_path=sample['video_url'])).limit(1),
+        'login: by username': lambda: User.objects(username=sample['username']).limit(1),
+        'google login: by google_id': lambda: User.objects(google_id=sample['google_id']).limit(1),
+        'rankings verify: live query': lambda: Workout.objects(
+            is_public=True, status='complete').only('exercise_type', *RANKED_METRICS),
+    }
+
+
+def plan_summary(explain: dict) -> dict:
+    """Returns the stages of the winning plan, e.g. 'LIMIT > FETCH > IXSCAN(user_1_created_at_-1__id_-1)'."""
+    def stages(plan):
+        name = plan.get('stage', '?')
+        if 'indexName' in plan:
+            name += f"({plan['indexName']})"
+        children = [plan['inputStage']] if 'inputStage' in plan else plan.get('inputStages', [])
+        if not children:
+            return name
+        inner = ' | '.join(stages(child) for child in children)
+        return f"{name} > {inner}" if len(children) == 1 else f"{name} > ({inner})"
+
+    winning = explain.get('queryPlanner', {}).get('winningPlan', {})
+    winning = winning.get('queryPlan', winning)  # Slot-based engine wraps the plan
+    execution = explain.get('executionStats', {})
+    return {
+        'plan': stages(winning),
+        'docs_examined': execution.get('totalDocsExamined'),
+        'keys_examined': execution.get('totalKeysExamined'),
+        'returned': execution.get('nReturned'),
+    }
+
+
+def measure(queries: dict, repeat: int) -> dict:
+    """Times every query `repeat` times and explains it once."""
+    results = {}
+    for name, query in queries.items():
+        list(query())  # Warm-up
+        latencies = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            list(query())
+            latencies.append(time.perf_counter() - start)
+        p50, p95 = np.percentile(latencies, [50, 95]) * 1000
+        result = {'p50_ms': float(p50), 'p95_ms': float(p95)}
+        try:
+            result.update(plan_summary(query().explain()))
+        except (NotImplementedError, AttributeError):
+            result['plan'] = 'n/a'  # mongomock has no query planner
+        results[name] = result
+    return results
+
+
+def auto_create_indexes(enabled: bool):
+    """Turns off mongoengine's index creation on first use, so the collections start with only _id indexes."""
+    for document in (User, Workout, LeaderboardEntry, UserStats):
+        document._meta['auto_create_index'] = enabled
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the route queries without and with indexes")
+    parser.add_argument('--uri', default='mongodb://localhost:27017', help="MongoDB to create the scratch database on")
+    parser.add_argument('--db', default='aitrainer_query_benchmark', help="Scratch database, dropped afterwards")
+    parser.add_argument('--mongomock', action='store_true', help="Use an in-memory mongomock database instead")
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--workouts', type=int, default=200000)
+    parser.add_argument('--repeat', type=int, default=20, help="Timed runs per query")
+    parser.add_argument('--output', default=str(DEFAULT_REPORT), help="Where to write the JSON report")
+    parser.add_argument('--keep', action='store_true', help="Keep the scratch database")
+    args = parser.parse_args()
+
+    if args.mongomock:
+        import mongomock
+        connect(db=args.db, host='mongodb://localhost', mongo_client_class=mongomock.MongoClient)
+    else:
+        connect(db=args.db, host=args.uri)
+    client = User._get_db().client
+    client.drop_database(args.db)
+
+    try:
+        print(f"Filling {args.db} with {args.users} users and {args.workouts} workouts...")
+        auto_create_indexes(False)
+        sample = fill(args.users, args.workouts)
+        queries = route_queries(sample)
+
+        print("Measuring without indexes...")
+        before = measure(queries, args.repeat)
+        auto_create_indexes(True)
+        ensure_indexes()
+        print("Measuring with indexes...")
+        after = measure(queries, args.repeat)
+    finally:
+        if not args.keep:
+            client.drop_database(args.db)
+        disconnect()
+
+    for name in queries:
+        print(f"\n{name}")
+        for label, result in (('before', before[name]), ('after', after[name])):
+            print(f"  {label:6} p50 {result['p50_ms']:8.2f} ms  p95 {result['p95_ms']:8.2f} ms  "
+                  f"docs examined {result.get('docs_examined')}  {result['plan']}")
+
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump({'meta': {'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'), 'users': args.users,
+                            'workouts': args.workouts, 'mongomock': args.mongomock},
+                   'before': before, 'after': after}, f, indent=2)
+    print(f"\nReport written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -13,6 +13,13 @@ class Settings(BaseSettings):
     # Google Cloud Storage settings
     GCS_BUCKET_NAME: str = os.getenv('GCS_BUCKET_NAME', default=None)
     GCS_CREDENTIALS_PATH: str = os.getenv('GCS_CREDENTIALS_PATH', default=None)
+    STORAGE_BACKEND: str = os.getenv('STORAGE_BACKEND', default="gcs")  # gcs, or local to keep the bucket on disk
+    LOCAL_STORAGE_ROOT: str = os.getenv('LOCAL_STORAGE_ROOT', default="storage")  # Bucket directory of the local backend
+    STREAM_DOWNLOADS: bool = True  # Decode videos while they download instead of after
+    UPLOAD_CHUNK_SIZE: int = 8 * 1024 * 1024  # Bytes per resumable upload request, a multiple of 256 KiB
+    UPLOAD_MAX_RETRIES: int = 5  # Retries of one failed upload chunk before the upload fails
+    VIDEO_CACHE_DIR: str = "cache/videos"  # On-disk LRU cache of downloaded videos
+    VIDEO_CACHE_MAX_BYTES: int = 2 * 1024 ** 3  # Size bound of the video cache, 0 disables it
     
     # Google OAuth settings
     GOOGLE_CLIENT_ID: str = os.getenv('GOOGLE_CLIENT_ID', default=None)
@@ -31,12 +38,35 @@ class Settings(BaseSettings):
     
     # File upload settings
     MAX_CONTENT_LENGTH: int = 16 * 1024 * 1024  # 16MB
+    DIRECT_UPLOAD_MAX_BYTES: int = 2 * 1024 ** 3  # Largest video the browser can upload straight to the bucket
+    UPLOAD_SESSION_TTL: int = 24 * 3600  # Seconds a direct upload can take before its token expires
     ALLOWED_EXTENSIONS: set = {'mp4', 'avi', 'mov'}
+
+    # Leaderboard settings
+    LEADERBOARD_PAGE_SIZE: int = 50  # Workouts per leaderboard page
+    LEADERBOARD_MAX_PAGE_SIZE: int = 200  # Largest page a request can ask for
     
     # Inference service settings
     INFERENCE_HOST: str = "0.0.0.0"
     INFERENCE_PORT: int = 5001
     INFERENCE_URL: str = "http://localhost:5001"
+    JOB_POLL_INTERVAL: float = 2.0  # Seconds between job status polls from the frontend
+    JOB_REQUEST_TIMEOUT: float = 10.0  # Seconds before a request to the inference service is given up and retried
+    JOB_MAX_WAIT: float = 3 * 3600  # Seconds the frontend waits for a job before marking the workout as errored
+    INFERENCE_BATCH_SIZE: int = 8  # Frames per pose model call in process_video
+    INFERENCE_WORKERS: int = 0  # Worker processes for /jobs, 0 means one per CPU
+    MODEL_POOL_SIZE: int = 1  # Warm pose models loaded at inference service startup
+    INFERENCE_BACKEND: str = "auto"  # pytorch, onnx, openvino, or auto to pick the fastest installed one
+    KEYPOINT_CACHE_DIR: str = "cache/keypoints"  # Cached keypoint trajectories for re-scoring
+    VIDEO_DECODER: str = "ffmpeg"  # ffmpeg decodes at the processing resolution, opencv resizes full frames
+    INFERENCE_ROI: bool = False  # Run the pose model on a crop around the athlete, for single-athlete videos
+    INFERENCE_KEYFRAME_INTERVAL: int = 1  # Max frames between pose model runs, optical flow in between; 1 disables
+    INFERENCE_TARGET_FPS: float = 0  # Process at most this many frames per second, 0 processes every frame
+    VIDEO_CODEC: str = "h264"  # h264 (ffmpeg, browser-ready) or mp4v (OpenCV) for processed videos
+    VIDEO_PRESET: str = "veryfast"  # libx264 preset of processed videos, slower presets give smaller files
+    VIDEO_CRF: int = 23  # libx264 constant rate factor of processed videos, lower is better quality
+    SEGMENT_OVERLAP: int = 30  # Tracker warm-up frames before each segment of a segmented job
+    INSTRUMENTATION_ENABLED: bool = True  # Per-stage timing histograms served on /metrics, off for zero overhead
     
     class Config:
         env_file = ".env"
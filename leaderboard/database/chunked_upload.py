@@ -0,0 +1,129 @@
+import os
+import time
+
+UPLOAD_URL = "https://storage.googleapis.com/upload/storage/v1/b/{bucket}/o?uploadType=resumable"
+READ_WRITE_SCOPE = "https://www.googleapis.com/auth/devstorage.read_write"
+
+
+class GCSResumableSession:
+    """
+    GCS resumable upload session sending one chunk per request.
+
+    Only the chunk being sent is held in memory. After a failed request the session asks GCS how many bytes
+    it persisted and continues from there.
+    """
+
+    def __init__(self, bucket: str, blob: str, chunk_size: int, content_type: str = "video/mp4"):
+        import google.auth
+        from google.auth.transport.requests import AuthorizedSession
+        from google.resumable_media.requests import ResumableUpload
+
+        credentials, _ = google.auth.default(scopes=[READ_WRITE_SCOPE])
+        self._transport = AuthorizedSession(credentials)
+        self._upload = ResumableUpload(UPLOAD_URL.format(bucket=bucket), chunk_size)
+        self._blob = blob
+        self._content_type = content_type
+        self._stream = None
+
+    def initiate(self, stream, total_bytes: int):
+        self._stream = stream
+        self._upload.initiate(self._transport, stream, {'name': self._blob}, self._content_type,
+                              total_bytes=total_bytes)
+
+    def send_next(self) -> bool:
+        """Sends the next chunk, returns True once the upload is complete."""
+        self._upload.transmit_next_chunk(self._transport)
+        return self._upload.finished
+
+    def recover(self):
+        """Rewinds the stream to the last byte GCS persisted."""
+        if self._upload.invalid:
+            # GCS rejected the chunk, ask it how much it has
+            self._upload.recover(self._transport)
+        else:
+            # The request never got a response, nothing past the last acknowledged chunk is persisted
+            self._stream.seek(self._upload.bytes_uploaded)
+
+    @property
+    def bytes_uploaded(self) -> int:
+        return self._upload.bytes_uploaded
+
+
+class LocalResumableSession:
+    """
+    Resumable upload to a file on local disk with the same interface as GCSResumableSession.
+
+    Chunks are appended to a partial file that is renamed into place when complete, so readers never see a
+    partial upload. After a failed write the stream is rewound to the size of the partial file.
+    """
+
+    def __init__(self, path: str, chunk_size: int):
+        self._path = path
+        self._partial = f"{path}.partial"
+        self._chunk_size = chunk_size
+        self._stream = None
+        self._total_bytes = 0
+
+    def initiate(self, stream, total_bytes: int):
+        os.makedirs(os.path.dirname(self._path) or '.', exist_ok=True)
+        open(self._partial, 'wb').close()
+        self._stream = stream
+        self._total_bytes = total_bytes
+
+    def send_next(self) -> bool:
+        chunk = self._stream.read(self._chunk_size)
+        with open(self._partial, 'ab') as f:
+            f.write(chunk)
+        if self.bytes_uploaded >= self._total_bytes:
+            os.replace(self._partial, self._path)
+            return True
+        return False
+
+    def recover(self):
+        # Drop a partially written chunk and continue after the last complete one
+        persisted = self.bytes_uploaded - self.bytes_uploaded % self._chunk_size
+        with open(self._partial, 'r+b') as f:
+            f.truncate(persisted)
+        self._stream.seek(persisted)
+
+    @property
+    def bytes_uploaded(self) -> int:
+        return os.path.getsize(self._partial) if os.path.exists(self._partial) else self._total_bytes
+
+
+def upload_in_chunks(session, file_path: str, max_retries: int = 5, backoff: float = 1.0) -> int:
+    """
+    Uploads a file through a resumable session one chunk at a time, retrying failed chunks.
+
+    Memory use is bounded by the chunk size, whatever the size of the file. A failed chunk is retried up to
+    `max_retries` times with exponential backoff, resuming from the last byte the destination persisted
+    instead of starting over.
+
+    Args:
+        session: GCSResumableSession or LocalResumableSession
+        file_path: Local path to the file to upload
+        max_retries: Attempts per chunk after the first one fails
+        backoff: Seconds to wait before the first retry, doubled on every further retry
+
+    Returns:
+        int: Number of chunk retries needed
+    """
+    retries = 0
+    with open(file_path, 'rb') as stream:
+        session.initiate(stream, os.path.getsize(file_path))
+        done = False
+        attempt = 0
+        while not done:
+            try:
+                done = session.send_next()
+                attempt = 0
+            except Exception as e:
+                if attempt >= max_retries:
+                    raise
+                wait = backoff * 2 ** attempt
+                attempt += 1
+                retries += 1
+                print(f"Chunk upload failed at byte {session.bytes_uploaded} ({str(e)}), retry {attempt} in {wait:.1f} s")
+                time.sleep(wait)
+                session.recover()
+    return retries
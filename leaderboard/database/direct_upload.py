@@ -0,0 +1,72 @@
+import os
+import re
+
+CONTENT_RANGE = re.compile(r'^bytes (?:(\d+)-(\d+)|\*)/(\d+)$')
+
+
+def parse_content_range(header: str) -> tuple:
+    """
+    Parses the Content-Range header of a resumable upload request.
+
+    Returns:
+        tuple: (first byte, last byte, total bytes), with None for the byte range of a status query
+            ("bytes */total")
+
+    Raises:
+        ValueError: If the header is missing or malformed
+    """
+    match = CONTENT_RANGE.match(header or '')
+    if not match:
+        raise ValueError(f"Invalid Content-Range: {header}")
+    start, end, total = match.groups()
+    if start is None:
+        return None, None, int(total)
+    start, end = int(start), int(end)
+    if end < start or end >= int(total):
+        raise ValueError(f"Invalid Content-Range: {header}")
+    return start, end, int(total)
+
+
+class LocalUploadSession:
+    """
+    Stand-in for a GCS resumable upload session URI, writing to the local storage backend.
+
+    Follows the GCS protocol browsers use: chunks are PUT with a Content-Range header, incomplete uploads are
+    answered with the bytes received so far, and the client continues from there after a failure. Chunks are
+    appended to a partial file that is renamed into place when the last byte arrives, so readers never see a
+    partial upload.
+    """
+
+    def __init__(self, path: str, total_bytes: int):
+        self.path = path
+        self.partial = f"{path}.partial"
+        self.total_bytes = total_bytes
+
+    @property
+    def received(self) -> int:
+        """Bytes persisted so far."""
+        if os.path.exists(self.partial):
+            return os.path.getsize(self.partial)
+        return self.total_bytes if os.path.exists(self.path) else 0
+
+    def write(self, start: int, data: bytes) -> int:
+        """
+        Appends a chunk starting at byte `start`.
+
+        A chunk that does not start at the end of the received bytes is dropped, like GCS does; the client
+        learns where to continue from the returned count.
+
+        Returns:
+            int: Bytes received after the write
+        """
+        received = self.received
+        if start != received or received >= self.total_bytes:
+            return received
+        data = data[:self.total_bytes - start]
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.partial, 'ab') as f:
+            f.write(data)
+        received += len(data)
+        if received >= self.total_bytes:
+            os.replace(self.partial, self.path)
+        return received
@@ -1,25 +1,139 @@
 from cloudpathlib import CloudPath
+from cloudpathlib.local import LocalGSClient
+from contextlib import contextmanager
 from typing import Optional
 import uuid
 import os
+import shutil
 from ..config.settings import settings
+from src.instrumentation import timer
+from src.keypoint_cache import video_hash
+from .video_stream import VideoStream, read_head, STREAM_CHUNK_SIZE
+from .chunked_upload import GCSResumableSession, LocalResumableSession, upload_in_chunks
+from .video_cache import VideoCache
+from .direct_upload import LocalUploadSession
 
 class GCSStorage:
     def __init__(self):
         if not settings.GCS_BUCKET_NAME:
             raise ValueError("GCS_BUCKET_NAME is not set in settings")
+
+        # Local copies of downloaded videos, shared by repeated downloads of the same video
+        self.cache = None
+        if settings.VIDEO_CACHE_MAX_BYTES > 0:
+            self.cache = VideoCache(settings.VIDEO_CACHE_DIR, settings.VIDEO_CACHE_MAX_BYTES)
+
+        self.local = settings.STORAGE_BACKEND == "local"
+        if self.local:
+            # Stand-in for the bucket on the local filesystem, for development and offline benchmarks
+            self.client = LocalGSClient(local_storage_dir=settings.LOCAL_STORAGE_ROOT)
+            self.bucket = self.client.CloudPath(f"gs://{settings.GCS_BUCKET_NAME}")
+            print(f"Initialized local storage with bucket: {self.bucket} in {settings.LOCAL_STORAGE_ROOT}")
+            return
+
         if not settings.GCS_CREDENTIALS_PATH:
             raise ValueError("GCS_CREDENTIALS_PATH is not set in settings")
         if not os.path.exists(settings.GCS_CREDENTIALS_PATH):
             raise FileNotFoundError(f"GCS credentials file not found at: {settings.GCS_CREDENTIALS_PATH}")
             
+        self.client = None
         self.bucket = CloudPath(f"gs://{settings.GCS_BUCKET_NAME}")
         os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = settings.GCS_CREDENTIALS_PATH
         print(f"Initialized GCS storage with bucket: {self.bucket}")
+
+    def _path(self, video_url: str):
+        """Returns the CloudPath of a video URL in the configured storage backend."""
+        return self.client.CloudPath(video_url) if self.local else CloudPath(video_url)
+
+    def open_reader(self, video_url: str):
+        """
+        Opens a stored video for sequential reading, without downloading it first.
+
+        Args:
+            video_url (str): URL of the video in GCS
+
+        Returns:
+            Binary file-like object reading the video in chunks
+        """
+        source_path = self._path(video_url)
+        if self.local:
+            return open(os.path.join(settings.LOCAL_STORAGE_ROOT, source_path.bucket, source_path.blob), 'rb')
+        blob = source_path.client.client.bucket(source_path.bucket).blob(source_path.blob)
+        return blob.open('rb', chunk_size=STREAM_CHUNK_SIZE)
+
+    @contextmanager
+    def stream_video(self, video_url: str, fallback_path: str):
+        """
+        Makes a stored video available for decoding while it is still downloading.
+
+        Videos with their index in front of the media data (MP4/MOV written with +faststart) are streamed
+        through a named pipe. Other videos cannot be decoded before the last byte arrives and are downloaded to
+        `fallback_path` as before. With a video cache, a streamed video is also written to the cache as it is
+        read, and a downloaded one is downloaded into the cache. A cached video is linked to `fallback_path`,
+        so it stays readable until the caller removes it even if the cache evicts it.
+
+        Args:
+            video_url (str): URL of the video in GCS
+            fallback_path (str): Local path, owned by the caller, to download or link the video to if it is not
+                streamed
+
+        Yields:
+            tuple: (path to open with cv2.VideoCapture, callable returning the SHA-256 content hash of the
+                video, or None if the video is at `fallback_path`)
+
+        Example:
+        with gcs.stream_video(video_url, "./local_video.mp4") as (path, content_hash):
+            metrics = process_video(path, ..., content_hash=content_hash)
+        """
+        if not video_url:
+            raise ValueError("video_url cannot be None")
+
+        cached_path = self.cache.lookup(video_url) if self.cache else None
+        if cached_path:
+            try:
+                # Pin the entry to this job, so eviction or another job cannot remove it while it is read
+                self.cache.pin(cached_path, fallback_path)
+            except FileNotFoundError:
+                print(f"Cached copy of {video_url} was evicted, streaming it instead")
+                cached_path = None
+        if cached_path:
+            print(f"Using cached copy of {video_url}")
+            yield fallback_path, None
+            return
+
+        reader = self.open_reader(video_url)
+        streamable, head = read_head(reader)
+        if not streamable:
+            print(f"Video {video_url} is not streamable (moov after mdat), downloading it first")
+            os.makedirs(os.path.dirname(fallback_path) or '.', exist_ok=True)
+
+            def fetch(path):
+                with timer("gcs_download"), open(path, 'wb') as f:
+                    f.write(head)
+                    for chunk in iter(lambda: reader.read(STREAM_CHUNK_SIZE), b''):
+                        f.write(chunk)
+
+            with reader:
+                if self.cache:
+                    self.cache.pin(self.cache.get(video_url, fetch), fallback_path)
+                else:
+                    fetch(fallback_path)
+            yield fallback_path, None
+            return
+
+        print(f"Streaming {video_url}")
+        stream = VideoStream(reader, head, fill=self.cache.open_fill(video_url) if self.cache else None)
+        try:
+            yield stream.path, stream.content_hash
+        finally:
+            stream.close()
     
     def upload_video(self, file_path: str, user_id: str) -> str:
         """
         Upload a video file to GCS.
+
+        The file is sent in chunks of settings.UPLOAD_CHUNK_SIZE through a resumable upload, so memory use
+        does not grow with the size of the video, and a failed chunk is retried on its own.
         
         Args:
             file_path (str): Local path to the video file
@@ -35,11 +149,82 @@ class GCSStorage:
         filename = f"{user_id}_{uuid.uuid4()}_{os.path.basename(file_path)}"
         destination_path = self.bucket / "videos" / filename
         
-        print(f"Uploading file {file_path} to {destination_path}")
-        with open(file_path, 'rb') as f:
-            destination_path.write_bytes(f.read())
-        
+        self._upload(file_path, destination_path)
         return str(destination_path)
+
+    def upload_video_deduplicated(self, file_path: str, content_hash: str = None) -> tuple:
+        """
+        Upload a video file to GCS under its content hash, skipping the upload if the same video is stored.
+
+        Identical videos map to one object, so re-uploads of the same clip cost a hash of the local file
+        instead of a GCS upload.
+
+        Args:
+            file_path (str): Local path to the video file
+            content_hash (str): SHA-256 of the file if already known, computed in chunks otherwise
+
+        Returns:
+            tuple: (URL of the stored video, content hash)
+        """
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(f"File not found: {file_path}")
+
+        content_hash = content_hash or video_hash(file_path)
+        extension = os.path.splitext(file_path)[1].lower()
+        destination_path = self.bucket / "videos" / "sha256" / f"{content_hash}{extension}"
+        if destination_path.exists():
+            print(f"Video {file_path} is already stored at {destination_path}, skipping upload")
+        else:
+            self._upload(file_path, destination_path)
+        return str(destination_path), content_hash
+
+    def direct_upload_path(self, user_id: str, filename: str):
+        """Returns a new, unique destination for a video the browser uploads straight to the bucket."""
+        return self.bucket / "videos" / f"{user_id}_{uuid.uuid4()}_{filename}"
+
+    def create_upload_session(self, destination_path, content_type: str, size: int, origin: str = None) -> str:
+        """
+        Starts a GCS resumable upload session the browser can send the video to without credentials.
+
+        Args:
+            destination_path: CloudPath returned by direct_upload_path
+            content_type (str): MIME type of the video
+            size (int): Size of the video in bytes, GCS rejects uploads of any other size
+            origin (str): Origin of the page uploading, allowed by GCS for cross-origin requests to the session
+
+        Returns:
+            str: Session URI to PUT the video to in chunks
+        """
+        if self.local:
+            raise RuntimeError("The local backend has no GCS sessions, use local_upload_session")
+        blob = destination_path.client.client.bucket(destination_path.bucket).blob(destination_path.blob)
+        return blob.create_resumable_upload_session(content_type=content_type, size=size, origin=origin)
+
+    def local_upload_session(self, video_url: str, size: int) -> LocalUploadSession:
+        """Returns the stand-in for a resumable upload session of the local backend."""
+        if not self.local:
+            raise RuntimeError("Local upload sessions require STORAGE_BACKEND=local")
+        destination_path = self._path(video_url)
+        local_path = os.path.join(settings.LOCAL_STORAGE_ROOT, destination_path.bucket, destination_path.blob)
+        return LocalUploadSession(local_path, size)
+
+    def stored_size(self, video_url: str) -> Optional[int]:
+        """Returns the size in bytes of a stored video, or None if it does not exist (yet)."""
+        path = self._path(video_url)
+        if not path.exists():
+            return None
+        return path.stat().st_size
+
+    def _upload(self, file_path: str, destination_path) -> None:
+        """Uploads a file to `destination_path` in resumable chunks."""
+        print(f"Uploading file {file_path} to {destination_path}")
+        if self.local:
+            local_path = os.path.join(settings.LOCAL_STORAGE_ROOT, destination_path.bucket, destination_path.blob)
+            session = LocalResumableSession(local_path, settings.UPLOAD_CHUNK_SIZE)
+        else:
+            session = GCSResumableSession(destination_path.bucket, destination_path.blob, settings.UPLOAD_CHUNK_SIZE)
+        with timer("gcs_upload"):
+            upload_in_chunks(session, file_path, max_retries=settings.UPLOAD_MAX_RETRIES)
     
     def download_video(self, video_url: str, destination_path: str) -> None:
         """
@@ -61,15 +246,13 @@ class GCSStorage:
         print(f"Attempting to download from {video_url} to {destination_path}")
         
         try:
-            source_path = CloudPath(video_url)
-            print(f"Created CloudPath object: {source_path}")
-            
             # Ensure destination directory exists
             os.makedirs(os.path.dirname(destination_path), exist_ok=True)
-            
-            print("Starting download...")
-            source_path.download_to(destination_path)
-            print("Download completed successfully")
+
+            if self.cache:
+                shutil.copyfile(self.cached_video(video_url), destination_path)
+            else:
+                self._download(video_url, destination_path)
             
             if not os.path.exists(destination_path):
                 raise FileNotFoundError(f"File was not created at {destination_path}")
@@ -81,6 +264,31 @@ class GCSStorage:
             print(f"Error during download: {str(e)}")
             raise
 
+    def cached_video(self, video_url: str) -> str:
+        """
+        Returns a local path of a video in GCS, downloading it into the cache only if it is not cached yet.
+
+        Concurrent calls for the same video download it once. The returned file belongs to the cache and
+        must not be modified or deleted.
+
+        Args:
+            video_url (str): URL of the video in GCS
+
+        Returns:
+            str: Path of the cached video
+        """
+        if not self.cache:
+            raise RuntimeError("Video cache is disabled, set VIDEO_CACHE_MAX_BYTES")
+        return self.cache.get(video_url, lambda path: self._download(video_url, path))
+
+    def _download(self, video_url: str, destination_path: str) -> None:
+        """Downloads a video from GCS, bypassing the cache."""
+        source_path = self._path(video_url)
+        print(f"Starting download of {source_path}...")
+        with timer("gcs_download"):
+            source_path.download_to(destination_path)
+        print("Download completed successfully")
+
     def delete_video(self, video_url: str) -> None:
         """
         Delete a video from GCS.
@@ -91,5 +299,7 @@ class GCSStorage:
         if not video_url:
             raise ValueError("video_url cannot be None")
             
-        source_path = CloudPath(video_url)
-        source_path.unlink() 
\ No newline at end of file
+        source_path = self._path(video_url)
+        source_path.unlink()
+        if self.cache:
+            self.cache.discard(video_url) 
\ No newline at end of file
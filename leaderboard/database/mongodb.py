@@ -53,12 +53,79 @@ class Workout(db.Document):
     avg_power_per_kg = db.FloatField(required=True)  # Average power per kg
     max_power_per_kg = db.FloatField(required=True)  # Maximum power per kg
     video_path = db.StringField(max_length=255)  # Path to stored video or GCS URL
+    source_video_path = db.StringField(max_length=255)  # GCS URL of the original upload, shared by identical videos
+    upload_id = db.StringField(max_length=255)  # Destination of a direct upload, one workout per upload
+    video_hash = db.StringField(max_length=64)  # Content hash of the original video, keys the keypoint cache
+    scoring_key = db.StringField(max_length=64)  # Hash of video_hash and exercise parameters, see dedup.scoring_key
     is_public = db.BooleanField(default=False)  # Whether to show on leaderboard
     created_at = db.DateTimeField(default=datetime.utcnow)
     status = db.StringField(max_length=20, default="complete", choices=["pending", "processing", "complete", "error"])
     error_message = db.StringField(max_length=500)  # Error message if processing failed
     
-    meta = {'collection': 'workouts'}
+    meta = {
+        'collection': 'workouts',
+        'indexes': [
+            {'fields': ['user', '-created_at', '-id']},  # Dashboard pages and per-user stats
+            {'fields': ['is_public', 'status']},  # Rebuilding and verifying the rankings, see rankings.py
+            {'fields': ['scoring_key', 'status']},  # Reusable results of the same video, see dedup.py
+            {'fields': ['video_path']},  # Workouts sharing a stored video
+            {'fields': ['source_video_path']},
+            {'fields': ['upload_id'], 'unique': True, 'sparse': True},  # Repeated /uploads/complete calls
+        ]
+    }
 
     def __repr__(self):
-        return f'<Workout {self.id}>'
\ No newline at end of file
+        return f'<Workout {self.id}>'
+
+class LeaderboardEntry(db.Document):
+    """One public, complete workout in the materialized ranking of an exercise type by one metric."""
+    exercise_type = db.StringField(max_length=50, required=True)  # Exercise type, or "all" for the overall ranking
+    metric = db.StringField(max_length=50, required=True)  # Workout field the ranking is sorted by
+    value = db.FloatField(required=True)  # Value of `metric` of the workout
+    workout = db.ReferenceField(document_type=Workout, required=True)
+
+    meta = {
+        'collection': 'leaderboard',
+        'indexes': [
+            # Top-N reads walk this index and stop after N entries
+            {'fields': ['exercise_type', 'metric', '-value', 'workout']},
+            {'fields': ['workout', 'exercise_type', 'metric'], 'unique': True},
+        ]
+    }
+
+    def __repr__(self):
+        return f'<LeaderboardEntry {self.exercise_type} {self.metric} {self.value}>'
+
+class UserStats(db.Document):
+    """Dashboard statistics of one user, updated incrementally as their workouts change, see user_stats.py."""
+    user = db.ReferenceField(document_type=User, required=True, unique=True)
+    workout_count = db.IntField(default=0)  # Workouts in any status
+    total_reps = db.IntField(default=0)  # Reps of complete workouts
+    best_power_per_kg = db.FloatField(default=0)  # Best max power per kg of complete workouts
+    exercise_powers = db.DictField()  # Exercise type -> best max power per kg of its complete workouts
+
+    meta = {'collection': 'user_stats'}
+
+    def __repr__(self):
+        return f'<UserStats {self.user}>'
+
+
+# Indexes that earlier versions declared and nothing queries any more, by collection
+OBSOLETE_INDEXES = {'workouts': ['is_public_1_status_1_exercise_type_1']}
+
+
+def ensure_indexes():
+    """
+    Creates the indexes declared by every model that do not exist yet, e.g. at startup, and drops obsolete ones.
+
+    User indexes come from its unique fields (username, email, google_id). Leaderboard pages read the
+    LeaderboardEntry index on (exercise_type, metric, -value, workout) rather than sorting workouts, so workouts
+    have no (is_public, exercise_type, metric) index: only rebuilding the rankings filters them on is_public.
+    """
+    for document in (User, Workout, LeaderboardEntry, UserStats):
+        document.ensure_indexes()
+        collection = document._get_collection()
+        existing = collection.index_information()
+        for name in OBSOLETE_INDEXES.get(collection.name, []):
+            if name in existing:
+                collection.drop_index(name)
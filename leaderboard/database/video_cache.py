@@ -0,0 +1,212 @@
+import hashlib
+import os
+import shutil
+import threading
+
+
+class VideoCache:
+    """
+    Size-bounded on-disk LRU cache of downloaded videos.
+
+    Entries are keyed by a hash of the object URL. Stored videos are never modified in place (new uploads
+    get new names, deduplicated ones are named by their content hash), so the URL identifies the content.
+
+    Fills are atomic: a video is fetched to a temporary file and renamed into place, so readers never see a
+    partial entry, also across processes sharing the directory. Concurrent requests for the same video in one
+    process are single-flight: one thread fetches, the others wait for it and then read the cached file.
+    Recency is tracked with the file modification time, which is bumped on every hit.
+
+    Attributes:
+        hits (int): Requests served from the cache.
+        misses (int): Requests that fetched the video.
+        evictions (int): Entries removed to stay under `max_bytes`.
+
+    Examples:
+        >>> cache = VideoCache("cache/videos", max_bytes=2 * 1024 ** 3)
+        >>> path = cache.get(url, lambda tmp: CloudPath(url).download_to(tmp))
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._inflight = {}  # Key -> Event set when its fetch finishes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def path(self, video_url: str) -> str:
+        """Returns where the video at `video_url` is cached."""
+        key = hashlib.sha256(video_url.encode()).hexdigest()
+        extension = os.path.splitext(video_url)[1].lower() or '.mp4'
+        return os.path.join(self.cache_dir, f"{key}{extension}")
+
+    def lookup(self, video_url: str):
+        """Returns the cached path of `video_url` and counts a hit, or None without fetching."""
+        path = self.path(video_url)
+        with self._lock:
+            if self._touch(path):
+                self.hits += 1
+                return path
+        return None
+
+    def get(self, video_url: str, fetch) -> str:
+        """
+        Returns the path of the cached video, fetching it first on a miss.
+
+        Args:
+            video_url: URL of the video
+            fetch: Called as fetch(path) to download the video to `path` on a miss
+
+        Returns:
+            str: Path of the cached video. Do not modify or delete it; it may be evicted later, but stays
+                readable through file handles that are already open.
+        """
+        path = self.path(video_url)
+        while True:
+            with self._lock:
+                if self._touch(path):
+                    self.hits += 1
+                    return path
+                event = self._inflight.get(path)
+                if event is None:
+                    self._inflight[path] = threading.Event()
+                    self.misses += 1
+                    break
+            # Another thread is fetching this video, use its result, or take over if it failed
+            event.wait()
+
+        tmp_path = f"{path}.tmp{os.getpid()}_{threading.get_ident()}"
+        try:
+            fetch(tmp_path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(path).set()
+        self.evict(keep=path)
+        return path
+
+    def open_fill(self, video_url: str) -> "CacheFill":
+        """
+        Starts adding `video_url` from a stream that is read anyway, e.g. while it is decoded, and counts a miss.
+
+        Returns:
+            CacheFill: Write the whole video to it in order, then commit it to add the entry, or abort it
+        """
+        fill = CacheFill(self, self.path(video_url))
+        with self._lock:
+            self.misses += 1
+        return fill
+
+    def pin(self, path: str, destination: str):
+        """
+        Makes a cached file readable at `destination` for as long as the caller needs it.
+
+        The file is hard-linked, so eviction only removes the cache's name for it, or copied if `destination` is
+        on another filesystem. `destination` is replaced if it exists.
+
+        Raises:
+            FileNotFoundError: If the entry was evicted before it could be pinned
+        """
+        tmp_path = f"{destination}.tmp{os.getpid()}_{threading.get_ident()}"
+        try:
+            try:
+                os.link(path, tmp_path)
+            except FileNotFoundError:
+                raise
+            except OSError:
+                shutil.copyfile(path, tmp_path)
+            os.replace(tmp_path, destination)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def discard(self, video_url: str):
+        """Removes the cached copy of `video_url`, if any."""
+        try:
+            os.remove(self.path(video_url))
+        except FileNotFoundError:
+            pass
+
+    def _touch(self, path: str) -> bool:
+        try:
+            os.utime(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def evict(self, keep: str = None):
+        """Removes the least recently used entries, except `keep`, until the cache fits in `max_bytes`."""
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file() and '.tmp' not in entry.name:
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            total -= size
+            with self._lock:
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        """Returns the hit, miss and eviction counts and the current size of the cache in bytes."""
+        size = sum(e.stat().st_size for e in os.scandir(self.cache_dir) if e.is_file() and '.tmp' not in e.name)
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'bytes': size}
+
+    @staticmethod
+    def merge_stats(*stats) -> dict:
+        """
+        Adds up the stats of the caches of several processes sharing one cache directory, e.g. the service and
+        its job workers. The counts are summed; the size is the directory's, so it is not.
+        """
+        merged = {'hits': 0, 'misses': 0, 'evictions': 0, 'bytes': 0}
+        for stat in stats:
+            for name in ('hits', 'misses', 'evictions'):
+                merged[name] += stat[name]
+            merged['bytes'] = max(merged['bytes'], stat['bytes'])
+        return merged
+
+
+class CacheFill:
+    """
+    Entry of a VideoCache being written from a stream, see VideoCache.open_fill.
+
+    The bytes go to a temporary file that `commit` renames into place, so readers never see a partial entry.
+    """
+
+    def __init__(self, cache: VideoCache, path: str):
+        self.cache = cache
+        self.path = path
+        self.tmp_path = f"{path}.tmp{os.getpid()}_{threading.get_ident()}"
+        self._file = open(self.tmp_path, 'wb')
+
+    def write(self, chunk: bytes):
+        self._file.write(chunk)
+
+    def commit(self):
+        """Adds the written video to the cache, evicting older entries if needed."""
+        self._file.close()
+        os.replace(self.tmp_path, self.path)
+        self.cache.evict(keep=self.path)
+
+    def abort(self):
+        """Discards the written bytes, e.g. when the stream failed before its end."""
+        self._file.close()
+        try:
+            os.remove(self.tmp_path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,150 @@
+import hashlib
+import os
+import shutil
+import struct
+import tempfile
+import threading
+from src.instrumentation import timer
+
+STREAM_CHUNK_SIZE = 1024 * 1024  # Bytes copied at a time from the object stream
+MAX_HEAD_SIZE = 4 * 1024 * 1024  # Bytes read looking for the moov box before giving up on streaming
+
+
+def read_head(reader) -> tuple:
+    """
+    Reads the top-level MP4/MOV boxes in front of the media data and checks if the video can be streamed.
+
+    A video can be decoded from a pipe only if its index (the moov box) comes before the media data (mdat),
+    as written by `ffmpeg -movflags +faststart`. Otherwise the decoder has to seek to the end of the file.
+
+    Args:
+        reader: Binary file-like object positioned at the start of the video
+
+    Returns:
+        tuple: (streamable, head), the bytes consumed from `reader` so far, to be written out first
+    """
+    head = b''
+    offset = 0
+    while len(head) < MAX_HEAD_SIZE:
+        while len(head) < offset + 16:
+            chunk = reader.read(STREAM_CHUNK_SIZE)
+            if not chunk:
+                return False, head
+            head += chunk
+        size, box = struct.unpack('>I4s', head[offset:offset + 8])
+        if size == 1:
+            size = struct.unpack('>Q', head[offset + 8:offset + 16])[0]
+        if offset == 0 and box != b'ftyp':
+            return False, head  # Not an MP4/MOV file, e.g. AVI
+        if box == b'moov':
+            return True, head
+        if box == b'mdat' or size < 8:
+            return False, head
+        offset += size
+    return False, head
+
+
+class VideoStream:
+    """
+    Copies a video from a binary reader into a named pipe in a background thread.
+
+    The pipe can be opened with cv2.VideoCapture right away, so decoding runs while the video is still being
+    downloaded. The SHA-256 hash of the video is computed on the way, and the video can be teed into a video
+    cache entry, which is added once the whole video was read.
+
+    Attributes:
+        path (str): Path of the named pipe to decode from.
+        bytes_streamed (int): Bytes written to the pipe so far.
+
+    Examples:
+        >>> stream = VideoStream(reader)
+        >>> metrics = process_video(stream.path, ..., content_hash=stream.content_hash)
+        >>> stream.close()
+    """
+
+    def __init__(self, reader, head: bytes = b'', fill=None):
+        self._reader = reader
+        self._head = head
+        self._fill = fill  # CacheFill of a VideoCache to copy the video into, or None
+        self._dir = tempfile.mkdtemp()
+        self.path = os.path.join(self._dir, 'video.mp4')
+        os.mkfifo(self.path)
+        self.bytes_streamed = 0
+        self._digest = hashlib.sha256()
+        self._error = None
+        self._thread = threading.Thread(target=self._copy, daemon=True)
+        self._thread.start()
+
+    def _copy(self):
+        fifo = None
+        try:
+            with timer("gcs_stream"):
+                fifo = open(self.path, 'wb', buffering=0)
+                for chunk in self._chunks():
+                    self._digest.update(chunk)
+                    self._tee(chunk)
+                    if fifo is None:
+                        continue
+                    try:
+                        self._write(fifo, chunk)
+                    except BrokenPipeError:
+                        # The decoder stopped reading before the end of the video, e.g. at trailing boxes
+                        # after the last frame or an early stop: keep reading so the hash covers all of it
+                        fifo.close()
+                        fifo = None
+            if self._fill is not None:
+                self._fill.commit()
+                self._fill = None
+        except Exception as e:
+            self._error = e
+        finally:
+            if fifo is not None:
+                fifo.close()
+            if self._fill is not None:
+                self._fill.abort()
+            self._reader.close()
+
+    def _tee(self, chunk: bytes):
+        # A full disk or similar only costs the cache entry, never the stream
+        if self._fill is None:
+            return
+        try:
+            self._fill.write(chunk)
+        except OSError as e:
+            print(f"Not caching the streamed video: {str(e)}")
+            self._fill.abort()
+            self._fill = None
+
+    def _write(self, fifo, chunk: bytes):
+        view = memoryview(chunk)
+        while view:
+            written = fifo.write(view)
+            self.bytes_streamed += written
+            view = view[written:]
+
+    def _chunks(self):
+        if self._head:
+            yield self._head
+        yield from iter(lambda: self._reader.read(STREAM_CHUNK_SIZE), b'')
+
+    def content_hash(self) -> str:
+        """
+        Waits for the whole video to be read and returns its SHA-256 hash.
+
+        The hash covers the whole video even if the decoder stopped reading the pipe early.
+        """
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+        return self._digest.hexdigest()
+
+    def close(self):
+        """Unblocks the copy if the decoder did not read the whole video and removes the pipe."""
+        for _ in range(50):
+            if not self._thread.is_alive():
+                break
+            # Open and close the read end so a copy blocked on the pipe fails with a broken pipe
+            fd = os.open(self.path, os.O_RDONLY | os.O_NONBLOCK)
+            self._thread.join(timeout=0.1)
+            os.close(fd)
+        shutil.rmtree(self._dir, ignore_errors=True)
@@ -0,0 +1,71 @@
+import hashlib
+import json
+from mongoengine import Q
+from pathlib import Path
+import sys
+sys.path.append(str(Path(__file__).parent.parent))
+from src.config import exercise_settings
+from leaderboard.database.mongodb import Workout
+
+
+def scoring_key(video_hash: str, exercise_type: str, exercise_mass: float) -> str:
+    """
+    Returns a key identifying the metrics of a video scored with the given exercise parameters.
+
+    Workouts with the same key have the same rep count and power, whatever the athlete's body mass; only the
+    per-kg metrics differ. The current exercise_settings are part of the key, so changing the thresholds of
+    an exercise stops old results from being reused.
+    """
+    params = {
+        'video_hash': video_hash,
+        'exercise_type': exercise_type,
+        'exercise_mass': round(float(exercise_mass), 3),
+        'settings': exercise_settings.get(exercise_type),
+    }
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()
+
+
+def find_reusable_result(key: str, exclude_id=None):
+    """Returns a completed workout with scoring key `key`, or None if the video has to be processed."""
+    workouts = Workout.objects(scoring_key=key, status="complete")
+    if exclude_id is not None:
+        workouts = workouts.filter(id__ne=exclude_id)
+    return workouts.first()
+
+
+def reused_metrics(source: Workout, body_mass: float) -> dict:
+    """Returns the metrics of `source` for an athlete of `body_mass`, as Workout fields."""
+    return {
+        'rep_count': source.rep_count,
+        'avg_power': source.avg_power,
+        'max_power': source.max_power,
+        'avg_power_per_kg': source.avg_power / body_mass if body_mass > 0 else 0,
+        'max_power_per_kg': source.max_power / body_mass if body_mass > 0 else 0,
+    }
+
+
+def is_referenced(video_url: str, exclude_id=None) -> bool:
+    """Whether any workout other than `exclude_id` still uses `video_url` as its original or processed video."""
+    if not video_url:
+        return False
+    workouts = Workout.objects(Q(video_path=video_url) | Q(source_video_path=video_url))
+    if exclude_id is not None:
+        workouts = workouts.filter(id__ne=exclude_id)
+    return workouts.first() is not None
+
+
+def release_videos(workout: Workout, gcs) -> list:
+    """
+    Deletes the stored videos of a workout that is being deleted, unless other workouts share them.
+
+    Returns:
+        list: URLs of the deleted objects
+    """
+    deleted = []
+    for video_url in {workout.video_path, workout.source_video_path} - {None, ''}:
+        if is_referenced(video_url, exclude_id=workout.id):
+            print(f"Keeping {video_url}, still used by other workouts")
+            continue
+        gcs.delete_video(video_url)
+        deleted.append(video_url)
+    return deleted
@@ -1,12 +1,14 @@
-from flask import Flask, request, jsonify
-import os
-import tempfile
+from flask import Flask, request, jsonify, Response
 from pathlib import Path
 import sys
 sys.path.append(str(Path(__file__).parent.parent))
-from src.workout_monitoring import process_video
 from src.config import exercise_settings
-from leaderboard.database.mongodb import Workout, User, db
+from src.keypoint_cache import load_trajectories, rescore
+from src.model_pool import ModelPool
+from src.backends import resolve_backend
+from src import instrumentation
+from leaderboard.database.mongodb import db
+from leaderboard.jobs import JobQueue, run_workout, validate_payload, RESCORE_FIELDS
 from leaderboard.database.gcs_storage import GCSStorage
 from leaderboard.config.settings import settings
 
@@ -20,6 +22,24 @@ app.config['MONGODB_SETTINGS'] = {
 db.init_app(app)
 gcs = GCSStorage()
 
+# Warm pose models and job workers, created by init_models() when the service starts
+model_pool = None
+job_queue = None
+
+def init_models():
+    """
+    Load and warm the pose models once, requests check one out instead of reloading it, and start the
+    worker processes for asynchronous jobs, each with its own warm pose model.
+    
+    Not done at import time: worker processes are spawned and re-import this module.
+    """
+    global model_pool, job_queue
+    instrumentation.set_enabled(settings.INSTRUMENTATION_ENABLED)
+    # Pick the backend here, before any worker starts, instead of benchmarking 'auto' in every pool and worker
+    backend = resolve_backend(settings.INFERENCE_BACKEND)
+    model_pool = ModelPool(size=settings.MODEL_POOL_SIZE, backend=backend)
+    job_queue = JobQueue(workers=settings.INFERENCE_WORKERS or None, backend=backend, gcs=gcs)
+
 @app.route('/health', methods=['GET'])
 def health():
     """
@@ -27,6 +47,30 @@ def health():
     """
     return jsonify({"status": "ok"}), 200
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    Stage timing histograms and job queue gauges in the Prometheus text format.
+    
+    Histograms and video cache counts of this process and of all job worker processes are merged. Stages: decode, track, annotate,
+    encode, process_video, gcs_download, gcs_stream and gcs_upload; decode_wait and encode_wait are the time
+    inference waited on the pipelined decode and encode threads.
+    """
+    snapshot = instrumentation.snapshot()
+    gauges = {}
+    if job_queue is not None:
+        snapshot = instrumentation.merge(snapshot, job_queue.metrics_snapshot())
+        counts = job_queue.counts()
+        gauges['jobs_queued'] = ("Jobs waiting for a worker", counts['queued'])
+        gauges['jobs_in_flight'] = ("Jobs being processed", counts['running'])
+    if gcs.cache:
+        # Jobs run in the worker processes, which count their own cache hits and misses
+        worker_stats = job_queue.cache_stats() if job_queue is not None else []
+        for name, value in gcs.cache.merge_stats(gcs.cache.stats(), *worker_stats).items():
+            gauges[f'video_cache_{name}'] = (f"Video cache {name}", value)
+    gauges['instrumentation_enabled'] = ("1 if stage timing is on", int(instrumentation.is_enabled()))
+    return Response(instrumentation.render_prometheus(snapshot, gauges), mimetype='text/plain; version=0.0.4')
+
 @app.route('/process_workout', methods=['POST'])
 def process_workout():
     """
@@ -38,95 +82,115 @@ def process_workout():
         "video_url": "gcs_url_of_uploaded_video",
         "body_mass": 70.5,
         "exercise_mass": 20.0,
-        "exercise_type": "pullups"
+        "exercise_type": "pullups",
+        "batch_size": 8,  (optional, defaults to settings.INFERENCE_BATCH_SIZE)
+        "render": true,  (optional, false returns metrics only without a processed video)
+        "segments": 4,  (optional, process this many time segments of the video in parallel)
+        "roi": true,  (optional, single-athlete video: run the pose model on a crop around the athlete)
+        "keyframe_interval": 4,  (optional, run the pose model at most every 4 frames and track keypoints with
+                                  optical flow in between, defaults to settings.INFERENCE_KEYFRAME_INTERVAL)
+        "target_fps": 15,  (optional, process at most this many frames per second, defaults to settings.INFERENCE_TARGET_FPS)
+        "video_hash": "sha256"  (optional, content hash of the video; reuses the results of the same video
+                                 scored with the same exercise parameters instead of processing it again)
     }
     
     Returns:
-        JSON with workout metrics and URL to processed video
+        JSON with workout metrics and URL to processed video (null when render is false)
     """
     # Get data from request
     data = request.json
     print(data)
 
-    if not data:
-        return jsonify({"error": "No data provided"}), 400
-    
-    required_fields = ['workout_id', 'video_url', 'body_mass', 'exercise_mass', 'exercise_type']
-    for field in required_fields:
-        if field not in data:
-            return jsonify({"error": f"Missing required field: {field}"}), 400
-    
-    temp_path = None
+    error = validate_payload(data)
+    if error:
+        return jsonify({"error": error}), 400
+
     try:
-        # Create temporary file for downloaded video
-        temp_file = tempfile.NamedTemporaryFile(suffix='.mp4', delete=False)
-        temp_path = temp_file.name
-        temp_file.close()  # Close the file handle but keep the file on disk
-        
-        # Debug: hard code temp path of video
-        # temp_path = r"C:\Users\matth\AppData\Local\Temp\pullups_weighted.mp4"
-        
-        # Download video from GCS
-        gcs.download_video(data['video_url'], temp_path)
-
-        # Process video
-        metrics = process_video(
-            temp_path,
-            body_mass=float(data['body_mass']),
-            exercise_mass=float(data['exercise_mass']),
-            exercise_type=data['exercise_type'],
-            up_angle=exercise_settings[data['exercise_type']]['up_angle'],
-            down_angle=exercise_settings[data['exercise_type']]['down_angle'],
-            displacement=exercise_settings[data['exercise_type']]['displacement'],
-            is_display=False
-        )
-        
-        # Get processed video path
-        processed_video_path = metrics['processed_video_path']
-        print("processed_video_path: ", processed_video_path)
-        
-        if not settings.DEBUG:
-            ## If only testing process_video, comment out the following lines which uses gcs and mongodb
-            # Retrieve workout record for update
-            workout = Workout.objects(id=data['workout_id']).first()
-            if not workout:
-                return jsonify({"error": "Workout not found"}), 404
-            
-            # Extract user_id from workout
-            user_id = str(workout.user.id)
-            
-            # Upload processed video to GCS
-            processed_video_url = gcs.upload_video(processed_video_path, user_id)
-        
-        # Clean up temporary files
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
-        if os.path.exists(processed_video_path):
-            os.remove(processed_video_path)
-
-        # Return success response with metrics
-        return jsonify({
-            "success": True,
-            "workout_id": str(workout.id),
-            "metrics": {
-                "rep_count": metrics['rep_count'],
-                "avg_power": metrics['avg_power'],
-                "max_power": metrics['max_power'],
-                "avg_power_per_kg": metrics['avg_power_per_kg'],
-                "max_power_per_kg": metrics['max_power_per_kg'],
-            },
-            "processed_video_url": processed_video_url #processed_video_path for local
-        })
-        
+        # Process video with a warm pose model from the pool
+        with model_pool.checkout() as gym:
+            return jsonify(run_workout(data, gcs, gym))
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 404
     except Exception as e:
         print(f"Error processing workout: {str(e)}")
-        # Clean up temporary file if it exists and there was an error
-        if temp_path and os.path.exists(temp_path):
-            try:
-                os.remove(temp_path)
-            except Exception as cleanup_error:
-                print(f"Error removing temporary file: {str(cleanup_error)}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """
+    Queue a workout video for asynchronous processing by the worker pool.
+    
+    Expects the same JSON payload as /process_workout.
+    
+    Returns:
+        JSON with the job id (202), poll /jobs/<job_id> for progress and the result
+    """
+    data = request.json
+    print(data)
+
+    error = validate_payload(data)
+    if error:
+        return jsonify({"error": error}), 400
+
+    job_id = job_queue.submit(data)
+    return jsonify({"job_id": job_id, "status_url": f"/jobs/{job_id}"}), 202
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """
+    Status of a queued workout job.
+    
+    Returns:
+        JSON with status (queued, running, complete or error), frames_processed, total_frames and
+        eta_seconds; the /process_workout response as "result" when complete, or "error" on failure
+    """
+    status = job_queue.status(job_id)
+    if status is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(status)
+
+@app.route('/rescore_workout', methods=['POST'])
+def rescore_workout():
+    """
+    Recompute workout metrics from cached keypoint trajectories, without downloading the video or running
+    the pose model. Use after changing exercise_settings or a workout's exercise_mass.
+    
+    Expected JSON payload:
+    {
+        "video_hash": "content hash returned by /process_workout",
+        "body_mass": 70.5,
+        "exercise_mass": 20.0,
+        "exercise_type": "pullups"
+    }
+    
+    Returns:
+        JSON with workout metrics, or 404 if the video's keypoints are not cached
+    """
+    data = request.json
+
+    error = validate_payload(data, RESCORE_FIELDS)
+    if error:
+        return jsonify({"error": error}), 400
+
+    cached = load_trajectories(settings.KEYPOINT_CACHE_DIR, data['video_hash'])
+    if cached is None:
+        return jsonify({"error": "Keypoints not cached for this video"}), 404
+
+    metrics = rescore(
+        cached,
+        body_mass=float(data['body_mass']),
+        exercise_mass=float(data['exercise_mass']),
+        exercise_type=data['exercise_type'],
+        up_angle=exercise_settings[data['exercise_type']]['up_angle'],
+        down_angle=exercise_settings[data['exercise_type']]['down_angle'],
+        displacement=exercise_settings[data['exercise_type']]['displacement']
+    )
+    return jsonify({
+        "success": True,
+        "video_hash": data['video_hash'],
+        "metrics": metrics
+    })
+
 if __name__ == '__main__':
+    init_models()
     app.run(host=settings.INFERENCE_HOST, port=settings.INFERENCE_PORT, debug=False)
\ No newline at end of file
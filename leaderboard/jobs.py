@@ -0,0 +1,435 @@
+import math
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+import sys
+sys.path.append(str(Path(__file__).parent.parent))
+from src.workout_monitoring import process_video
+from src import segment_processing
+from src.segment_processing import process_video_segmented
+from src.config import exercise_settings
+from src.keypoint_cache import is_video_hash
+from src import instrumentation
+from leaderboard.database.mongodb import Workout
+from leaderboard.dedup import scoring_key, find_reusable_result, reused_metrics
+from leaderboard.parsing import parse_bool
+from leaderboard.config.settings import settings
+
+REQUIRED_FIELDS = ['workout_id', 'video_url', 'body_mass', 'exercise_mass', 'exercise_type']
+RESCORE_FIELDS = ['video_hash', 'body_mass', 'exercise_mass', 'exercise_type']
+
+
+def _number(value):
+    """Returns `value` as a finite float, or None if it is not a number."""
+    if isinstance(value, bool):
+        return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return number if math.isfinite(number) else None
+
+
+def _integer(value):
+    """Returns `value` as an int, or None if it is not a whole number."""
+    if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+
+def validate_payload(data: dict, required: list = REQUIRED_FIELDS):
+    """
+    Returns an error message if a /process_workout payload is invalid, else None.
+
+    Pass `required`=RESCORE_FIELDS to validate a /rescore_workout payload.
+    """
+    if not data or not isinstance(data, dict):
+        return "No data provided"
+    for field in required:
+        if field not in data:
+            return f"Missing required field: {field}"
+    if data['exercise_type'] not in exercise_settings:
+        return f"Unknown exercise type: {data['exercise_type']}"
+    body_mass, exercise_mass = _number(data['body_mass']), _number(data['exercise_mass'])
+    if body_mass is None or body_mass <= 0:
+        return "body_mass must be a positive number"
+    if exercise_mass is None or exercise_mass < 0:
+        return "exercise_mass must be a non-negative number"
+    for field in ('batch_size', 'segments', 'keyframe_interval'):
+        if field in data and (_integer(data[field]) is None or _integer(data[field]) < 1):
+            return f"{field} must be a positive integer"
+    for field in ('render', 'roi'):
+        if field in data:
+            try:
+                parse_bool(data[field])
+            except ValueError:
+                return f"{field} must be true or false"
+    if 'target_fps' in data:
+        target_fps = _number(data['target_fps'])
+        if target_fps is None or target_fps < 0:
+            return "target_fps must be a non-negative number"
+    if ('video_hash' in required or data.get('video_hash')) and not is_video_hash(data['video_hash']):
+        return "video_hash must be a lowercase hex SHA-256 digest"
+    return None
+
+
+def _process(video_path: str, data: dict, gym, output_dir: str, progress_callback=None, content_hash=None,
+             executor=None, manager=None) -> dict:
+    """Processes a downloaded or streamed workout video with the settings of its exercise type."""
+    render = parse_bool(data.get('render', True))
+    segments = int(data.get('segments', 1))
+    exercise = exercise_settings[data['exercise_type']]
+    if segments > 1:
+        # Long videos: track time segments in parallel worker processes and stitch the results
+        return process_video_segmented(
+            video_path,
+            body_mass=float(data['body_mass']),
+            exercise_mass=float(data['exercise_mass']),
+            exercise_type=data['exercise_type'],
+            up_angle=exercise['up_angle'],
+            down_angle=exercise['down_angle'],
+            displacement=exercise['displacement'],
+            workers=segments,
+            overlap=settings.SEGMENT_OVERLAP,
+            render=render,
+            backend=gym.backend if gym is not None else settings.INFERENCE_BACKEND,
+            batch_size=int(data.get('batch_size', settings.INFERENCE_BATCH_SIZE)),
+            keypoint_cache_dir=settings.KEYPOINT_CACHE_DIR,
+            codec=settings.VIDEO_CODEC,
+            preset=settings.VIDEO_PRESET,
+            crf=settings.VIDEO_CRF,
+            output_dir=output_dir,
+            executor=executor,
+            progress_callback=progress_callback,
+            manager=manager
+        )
+    return process_video(
+        video_path,
+        body_mass=float(data['body_mass']),
+        exercise_mass=float(data['exercise_mass']),
+        exercise_type=data['exercise_type'],
+        up_angle=exercise['up_angle'],
+        down_angle=exercise['down_angle'],
+        displacement=exercise['displacement'],
+        is_display=False,
+        batch_size=int(data.get('batch_size', settings.INFERENCE_BATCH_SIZE)),
+        render=render,
+        keypoint_cache_dir=settings.KEYPOINT_CACHE_DIR,
+        gym=gym,
+        progress_callback=progress_callback,
+        content_hash=content_hash,
+        target_fps=float(data.get('target_fps', settings.INFERENCE_TARGET_FPS)) or None,
+        decoder=settings.VIDEO_DECODER,
+        roi=parse_bool(data.get('roi', settings.INFERENCE_ROI)),
+        keyframe_interval=int(data.get('keyframe_interval', settings.INFERENCE_KEYFRAME_INTERVAL)),
+        codec=settings.VIDEO_CODEC,
+        preset=settings.VIDEO_PRESET,
+        crf=settings.VIDEO_CRF,
+        output_dir=output_dir
+    )
+
+
+def run_workout(data: dict, gcs, gym, progress_callback=None, executor=None, manager=None) -> dict:
+    """
+    Download a workout video from GCS, process it and upload the processed video.
+
+    With settings.STREAM_DOWNLOADS the video is decoded while it downloads. Segmented jobs seek within the
+    video and always download it first.
+
+    Args:
+        data: Validated /process_workout payload
+        gcs: GCSStorage to download from and upload to
+        gym: Warm AIGym to process the video with, unused by segmented jobs
+        progress_callback: Passed on to process_video or process_video_segmented
+        executor: Worker pool to run the segments of a segmented job on, see process_video_segmented
+        manager: multiprocessing Manager the segments of a segmented job report progress through, see
+            process_video_segmented
+
+    Returns:
+        dict: The /process_workout response body
+
+    Raises:
+        LookupError: If the workout does not exist
+    """
+    reused = _reuse_result(data)
+    if reused is not None:
+        return reused
+
+    # Everything the job writes lives in its own directory, so concurrent jobs on the same video never collide
+    work_dir = tempfile.mkdtemp()
+    try:
+        temp_path = os.path.join(work_dir, 'video.mp4')
+        output_dir = os.path.join(work_dir, 'processed')
+
+        if settings.STREAM_DOWNLOADS and int(data.get('segments', 1)) <= 1:
+            # Stream video from GCS straight into the decoder
+            with gcs.stream_video(data['video_url'], temp_path) as (video_path, content_hash):
+                metrics = _process(video_path, data, gym, output_dir, progress_callback, content_hash)
+        else:
+            # Download video from GCS
+            gcs.download_video(data['video_url'], temp_path)
+            metrics = _process(temp_path, data, gym, output_dir, progress_callback, executor=executor,
+                               manager=manager)
+        processed_video_url = _upload_processed(data, gcs, metrics['processed_video_path'])
+
+        return {
+            "success": True,
+            "workout_id": str(data['workout_id']),
+            "metrics": {
+                "rep_count": metrics['rep_count'],
+                "avg_power": metrics['avg_power'],
+                "max_power": metrics['max_power'],
+                "avg_power_per_kg": metrics['avg_power_per_kg'],
+                "max_power_per_kg": metrics['max_power_per_kg'],
+            },
+            "processed_video_url": processed_video_url,
+            "video_hash": metrics['video_hash']
+        }
+    finally:
+        # Clean up the downloaded and processed videos
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def _reuse_result(data: dict):
+    """
+    Returns the response for a video that was already scored with the same exercise parameters, or None.
+
+    Only possible when the payload carries the video_hash computed at upload.
+    """
+    if settings.DEBUG or not data.get('video_hash'):
+        return None
+    key = scoring_key(data['video_hash'], data['exercise_type'], float(data['exercise_mass']))
+    existing = find_reusable_result(key, exclude_id=data['workout_id'])
+    if existing is None:
+        return None
+
+    print(f"Reusing results of workout {existing.id} for workout {data['workout_id']}")
+    metrics = reused_metrics(existing, float(data['body_mass']))
+    return {
+        "success": True,
+        "workout_id": str(data['workout_id']),
+        "metrics": metrics,
+        "processed_video_url": existing.video_path,
+        "video_hash": data['video_hash'],
+        "reused_from": str(existing.id)
+    }
+
+
+def _upload_processed(data: dict, gcs, processed_video_path: str):
+    """Uploads the processed video of a workout to GCS and removes the local copy, returning its URL."""
+    print("processed_video_path: ", processed_video_path)
+
+    processed_video_url = None
+    try:
+        if not settings.DEBUG:
+            # Retrieve workout record for update
+            workout = Workout.objects(id=data['workout_id']).first()
+            if not workout:
+                raise LookupError("Workout not found")
+
+            # Extract user_id from workout
+            user_id = str(workout.user.id)
+
+            # Upload processed video to GCS
+            if processed_video_path:
+                processed_video_url = gcs.upload_video(processed_video_path, user_id)
+    finally:
+        # Clean up processed video
+        if processed_video_path and os.path.exists(processed_video_path):
+            os.remove(processed_video_path)
+    return processed_video_url
+
+
+# State of each worker process, set up once by _init_worker and reused across jobs
+_worker = {}
+
+
+def _init_worker(progress, metrics, cache_stats, backend: str, threads: int):
+    """Connects a worker process to MongoDB and GCS and loads its warm pose model."""
+    import torch
+    from mongoengine import connect
+    from src.model_pool import ModelPool
+    from leaderboard.database.gcs_storage import GCSStorage
+
+    torch.set_num_threads(threads)  # Share the cores between workers instead of oversubscribing them
+    instrumentation.set_enabled(settings.INSTRUMENTATION_ENABLED)
+    connect(db=settings.MONGODB_DB, host=settings.MONGODB_URI)
+    _worker['progress'] = progress
+    _worker['metrics'] = metrics
+    _worker['cache_stats'] = cache_stats
+    _worker['gcs'] = GCSStorage()
+    _worker['model_pool'] = ModelPool(size=1, backend=backend)
+    segment_processing.use_model_pool(_worker['model_pool'])  # Segments of segmented jobs reuse the warm model
+
+
+def _publish_metrics():
+    """Shares this worker's stage histograms and video cache counts with the service process."""
+    if instrumentation.is_enabled():
+        _worker['metrics'][os.getpid()] = instrumentation.snapshot()
+    if _worker['gcs'].cache:
+        _worker['cache_stats'][os.getpid()] = _worker['gcs'].cache.stats()
+
+
+def _progress_reporter(progress, job_id: str, on_report=None):
+    """
+    Marks a job as started and returns a progress callback storing its progress in `progress` at most every
+    half second, calling `on_report` after each store.
+    """
+    progress[job_id] = {'frames_processed': 0, 'total_frames': 0, 'started_at': time.time()}
+    last_report = [0.0]
+
+    def report(frames_processed, total_frames):
+        now = time.time()
+        if now - last_report[0] >= 0.5:
+            last_report[0] = now
+            progress[job_id] = dict(progress[job_id], frames_processed=frames_processed, total_frames=total_frames)
+            if on_report is not None:
+                on_report()
+
+    return report
+
+
+def _run_job(job_id: str, data: dict) -> dict:
+    """Runs one job in a worker process, reporting progress and stage timings at most every half second."""
+    report = _progress_reporter(_worker['progress'], job_id, on_report=_publish_metrics)
+    try:
+        with _worker['model_pool'].checkout() as gym:
+            return run_workout(data, _worker['gcs'], gym, progress_callback=report)
+    finally:
+        _publish_metrics()
+
+
+
+class JobQueue:
+    """
+    Runs /process_workout jobs asynchronously on a pool of worker processes.
+
+    Each worker loads its own warm pose model once and reuses it for every job it runs. Segmented jobs are
+    dispatched from this process: it downloads the video and spreads the segments over the same workers, which
+    track them with their warm models. Job state is kept in memory; finished jobs are forgotten after
+    `keep_finished` seconds.
+
+    Examples:
+        >>> jobs = JobQueue()
+        >>> job_id = jobs.submit(payload)
+        >>> jobs.status(job_id)["status"]
+        'running'
+    """
+
+    def __init__(self, workers: int = None, backend: str = "pytorch", keep_finished: float = 3600, gcs=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.keep_finished = keep_finished
+        self._gcs = gcs  # GCSStorage of segmented jobs, created on first use if not given
+        context = multiprocessing.get_context("spawn")  # Fork is unsafe once torch threads are running
+        self._manager = context.Manager()
+        self._progress = self._manager.dict()
+        self._metrics = self._manager.dict()  # Worker pid -> stage histogram snapshot
+        self._cache_stats = self._manager.dict()  # Worker pid -> video cache stats
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(self._progress, self._metrics, self._cache_stats, backend,
+                      max(1, (os.cpu_count() or 1) // self.workers))
+        )
+        self._dispatcher = ThreadPoolExecutor(max_workers=self.workers)  # Threads of segmented jobs
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, data: dict) -> str:
+        """Queues a validated /process_workout payload and returns its job id."""
+        job_id = uuid.uuid4().hex
+        # Register the job with its future in one step, so status and cancel never see a job without one
+        with self._lock:
+            self._forget_finished()
+            if int(data.get('segments', 1)) > 1:
+                future = self._dispatcher.submit(self._run_segmented, job_id, data)
+            else:
+                future = self._executor.submit(_run_job, job_id, data)
+            self._jobs[job_id] = {'workout_id': str(data['workout_id']), 'submitted_at': time.time(),
+                                  'finished_at': None, 'future': future}
+        # Outside the lock: the callback takes it, and runs right away if the job already finished
+        future.add_done_callback(lambda _: self._finish(job_id))
+        return job_id
+
+    def _run_segmented(self, job_id: str, data: dict) -> dict:
+        """Runs a segmented job on a dispatcher thread, with its segments on the worker processes."""
+        if self._gcs is None:
+            from leaderboard.database.gcs_storage import GCSStorage
+            self._gcs = GCSStorage()
+        report = _progress_reporter(self._progress, job_id)
+        return run_workout(data, self._gcs, None, progress_callback=report, executor=self._executor,
+                           manager=self._manager)
+
+    def _finish(self, job_id: str):
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id]['finished_at'] = time.time()
+
+    def _forget_finished(self):
+        cutoff = time.time() - self.keep_finished
+        for job_id in [j for j, job in self._jobs.items() if job['finished_at'] and job['finished_at'] < cutoff]:
+            del self._jobs[job_id]
+            self._progress.pop(job_id, None)
+
+    def status(self, job_id: str):
+        """
+        Returns the status of a job, or None if it is unknown.
+
+        The status is one of queued, running, complete or error, with frames processed, total frames and the
+        estimated seconds remaining while running, the /process_workout response when complete, and the error
+        message on error.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        future = job['future']
+        progress = self._progress.get(job_id)
+        status = {'job_id': job_id, 'workout_id': job['workout_id'], 'status': 'queued',
+                  'frames_processed': 0, 'total_frames': 0, 'eta_seconds': None}
+        if progress:
+            status.update(status='running', frames_processed=progress['frames_processed'],
+                          total_frames=progress['total_frames'])
+            elapsed = time.time() - progress['started_at']
+            done, total = progress['frames_processed'], progress['total_frames']
+            if done > 0 and total > done:
+                status['eta_seconds'] = round((total - done) * elapsed / done, 1)
+        if future.done():
+            status['eta_seconds'] = 0
+            error = future.exception()
+            if error is None:
+                status.update(status='complete', result=future.result())
+            else:
+                status.update(status='error', error=str(error))
+        return status
+
+    def counts(self) -> dict:
+        """Returns the number of queued and running jobs."""
+        with self._lock:
+            jobs = list(self._jobs.items())
+        running = sum(1 for job_id, job in jobs if not job['finished_at'] and job_id in self._progress)
+        queued = sum(1 for job_id, job in jobs if not job['finished_at']) - running
+        return {'queued': queued, 'running': running}
+
+    def metrics_snapshot(self) -> dict:
+        """Returns the stage histograms of all worker processes, merged."""
+        return instrumentation.merge(*self._metrics.values())
+
+    def cache_stats(self) -> list:
+        """Returns the video cache stats of every worker process that ran a job, see VideoCache.merge_stats."""
+        return list(self._cache_stats.values())
+
+    def shutdown(self):
+        self._dispatcher.shutdown(wait=False, cancel_futures=True)
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._manager.shutdown()
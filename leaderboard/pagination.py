@@ -0,0 +1,95 @@
+"""
+Keyset pagination of workout lists.
+
+A page is read with a range condition on the sort key of its last row instead of an offset, so every page
+costs one index walk of `limit` + 1 documents however deep it is. The position is handed to the client as an
+opaque cursor.
+"""
+import base64
+import json
+from datetime import datetime
+from bson import ObjectId
+from mongoengine import Q
+from pathlib import Path
+import sys
+sys.path.append(str(Path(__file__).parent.parent))
+from leaderboard.database.mongodb import Workout
+
+
+def encode_cursor(*values) -> str:
+    """Encodes the sort key of the last row of a page as an opaque, URL-safe cursor."""
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str, length: int) -> list:
+    """
+    Decodes a cursor returned by encode_cursor.
+
+    Raises:
+        ValueError: If the cursor is malformed or does not hold `length` values
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid cursor: {e}")
+    if not isinstance(values, list) or len(values) != length:
+        raise ValueError("Invalid cursor")
+    return values
+
+
+def user_workouts_page(user_id, limit: int, cursor: str = None) -> tuple:
+    """
+    Returns one page of a user's workouts, newest first.
+
+    Args:
+        user_id: ID of the user
+        limit: Workouts per page
+        cursor: Cursor of the previous page, None for the first page
+
+    Returns:
+        tuple: (workouts, cursor of the next page or None)
+
+    Raises:
+        ValueError: If the cursor is invalid
+    """
+    workouts = Workout.objects(user=user_id)
+    if cursor:
+        created_at, workout_id = decode_cursor(cursor, 2)
+        try:
+            created_at, workout_id = datetime.fromisoformat(created_at), ObjectId(workout_id)
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"Invalid cursor: {e}")
+        workouts = workouts.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=workout_id))
+    workouts = list(workouts.order_by('-created_at', '-id').limit(limit + 1))
+
+    next_cursor = None
+    if len(workouts) > limit:
+        workouts = workouts[:limit]
+        last = workouts[-1]
+        next_cursor = encode_cursor(last.created_at.isoformat(), str(last.id))
+    return workouts, next_cursor
+
+
+def workout_json(workout: Workout, owner: bool = False) -> dict:
+    """Returns the fields of a workout shown in lists, with status and visibility for its owner."""
+    data = {
+        'id': str(workout.id),
+        'exercise_type': workout.exercise_type,
+        'exercise_mass': workout.exercise_mass,
+        'rep_count': workout.rep_count,
+        'avg_power_per_kg': workout.avg_power_per_kg,
+        'max_power_per_kg': workout.max_power_per_kg,
+        'created_at': workout.created_at.isoformat() if workout.created_at else None,
+    }
+    if not owner:
+        data['username'] = workout.user.username
+    else:
+        data.update({
+            'body_mass': workout.body_mass,
+            'avg_power': workout.avg_power,
+            'max_power': workout.max_power,
+            'status': workout.status,
+            'error_message': workout.error_message,
+            'is_public': workout.is_public,
+        })
+    return data
@@ -0,0 +1,22 @@
+"""
+Parsing of request values sent as JSON or form fields.
+"""
+
+TRUE_VALUES = ('true', '1')
+FALSE_VALUES = ('false', '0')
+
+
+def parse_bool(value) -> bool:
+    """
+    Returns `value` as a bool: a JSON boolean, or "true"/"false"/"1"/"0" in any case, as form fields send them.
+
+    Raises:
+        ValueError: If `value` is anything else, e.g. "no" or 2
+    """
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.strip().lower() in TRUE_VALUES + FALSE_VALUES:
+        return value.strip().lower() in TRUE_VALUES
+    if isinstance(value, int) and value in (0, 1):
+        return bool(value)
+    raise ValueError(f"Invalid boolean: {value!r}")
@@ -0,0 +1,186 @@
+"""
+Materialized leaderboard rankings, one per (exercise type, metric).
+
+Every public, complete workout has one LeaderboardEntry per ranked metric in the ranking of its exercise type
+and in the overall ranking. Entries are kept up to date incrementally with `update_rankings` whenever a
+workout is completed, edited or has its visibility toggled, and `remove_rankings` when it is deleted, so
+leaderboard pages read the top N entries of an index instead of sorting the whole workouts collection.
+
+Usage:
+    python leaderboard/rankings.py verify     # compare the rankings against the live workouts query
+    python leaderboard/rankings.py rebuild    # recompute all rankings from the workouts collection
+"""
+import argparse
+from bson import ObjectId
+from mongoengine import Q
+from pathlib import Path
+import sys
+sys.path.append(str(Path(__file__).parent.parent))
+from leaderboard.database.mongodb import Workout, LeaderboardEntry
+from leaderboard.pagination import encode_cursor, decode_cursor
+
+# Workout fields a leaderboard can be sorted by
+RANKED_METRICS = ('max_power_per_kg', 'avg_power_per_kg', 'rep_count')
+
+# Exercise type of the overall ranking across all exercises
+ALL_EXERCISES = "all"
+
+
+def is_ranked(workout: Workout) -> bool:
+    """Whether `workout` belongs on the leaderboards."""
+    return bool(workout.is_public) and workout.status == "complete"
+
+
+def update_rankings(workout: Workout):
+    """
+    Inserts, moves or removes the entries of `workout` after it changed.
+
+    Call it with the saved state of the workout, e.g. after `workout.reload()` following `workout.update()`.
+    """
+    if not is_ranked(workout):
+        remove_rankings(workout)
+        return
+
+    # A changed exercise type moves the workout to another ranking
+    LeaderboardEntry.objects(workout=workout.id,
+                             exercise_type__nin=[workout.exercise_type, ALL_EXERCISES]).delete()
+    for exercise_type in (workout.exercise_type, ALL_EXERCISES):
+        for metric in RANKED_METRICS:
+            LeaderboardEntry.objects(workout=workout.id, exercise_type=exercise_type, metric=metric).update_one(
+                upsert=True, set__value=float(getattr(workout, metric) or 0))
+
+
+def remove_rankings(workout: Workout):
+    """Removes `workout` from all rankings, e.g. when it is deleted or made private."""
+    LeaderboardEntry.objects(workout=workout.id).delete()
+
+
+def top_workouts(exercise_type: str, metric: str, limit: int) -> list:
+    """
+    Returns the `limit` best public workouts of an exercise type by `metric`, best first.
+
+    Args:
+        exercise_type: Exercise type, or ALL_EXERCISES for the overall ranking
+        metric: One of RANKED_METRICS
+        limit: Number of workouts to return
+
+    Returns:
+        list: Workouts with their users loaded
+    """
+    return ranking_page(exercise_type, metric, limit)[0]
+
+
+def ranking_page(exercise_type: str, metric: str, limit: int, cursor: str = None) -> tuple:
+    """
+    Returns one page of a ranking, best first, read with keyset pagination on (value, workout).
+
+    Args:
+        exercise_type: Exercise type, or ALL_EXERCISES for the overall ranking
+        metric: One of RANKED_METRICS
+        limit: Workouts per page
+        cursor: Cursor of the previous page, None for the first page
+
+    Returns:
+        tuple: (workouts with their users loaded, rank of the first workout, cursor of the next page or None)
+
+    Raises:
+        ValueError: If the cursor is invalid
+    """
+    entries = LeaderboardEntry.objects(exercise_type=exercise_type, metric=metric)
+    first_rank = 1
+    if cursor:
+        value, workout_id, first_rank = decode_cursor(cursor, 3)
+        try:
+            value, workout_id, first_rank = float(value), ObjectId(workout_id), int(first_rank)
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"Invalid cursor: {e}")
+        entries = entries.filter(Q(value__lt=value) | Q(value=value, workout__gt=workout_id))
+    entries = list(entries.order_by('-value', 'workout').limit(limit + 1).select_related(max_depth=2))
+
+    next_cursor = None
+    if len(entries) > limit:
+        entries = entries[:limit]
+        last = entries[-1]
+        next_cursor = encode_cursor(last.value, str(last.workout.id), first_rank + limit)
+    return [entry.workout for entry in entries], first_rank, next_cursor
+
+
+def _live_rankings() -> dict:
+    """Returns {(exercise_type, metric): {workout_id: value}} computed from the workouts collection."""
+    rankings = {}
+    workouts = Workout.objects(is_public=True, status="complete").only('exercise_type', *RANKED_METRICS)
+    for workout in workouts:
+        for exercise_type in (workout.exercise_type, ALL_EXERCISES):
+            for metric in RANKED_METRICS:
+                ranking = rankings.setdefault((exercise_type, metric), {})
+                ranking[workout.id] = float(getattr(workout, metric) or 0)
+    return rankings
+
+
+def _stored_rankings() -> dict:
+    """Returns {(exercise_type, metric): {workout_id: value}} of the materialized rankings."""
+    rankings = {}
+    for entry in LeaderboardEntry.objects.no_dereference().as_pymongo():
+        ranking = rankings.setdefault((entry['exercise_type'], entry['metric']), {})
+        ranking[entry['workout']] = entry['value']
+    return rankings
+
+
+def verify_rankings() -> list:
+    """
+    Compares the materialized rankings with the live workouts query.
+
+    Returns:
+        list: One message per ranking that differs, empty if they all match
+    """
+    live, stored = _live_rankings(), _stored_rankings()
+    problems = []
+    for key in sorted(set(live) | set(stored)):
+        expected, actual = live.get(key, {}), stored.get(key, {})
+        missing = expected.keys() - actual.keys()
+        extra = actual.keys() - expected.keys()
+        stale = [i for i in expected.keys() & actual.keys() if expected[i] != actual[i]]
+        if missing or extra or stale:
+            problems.append(f"{key[0]}/{key[1]}: {len(missing)} missing, {len(extra)} extra, "
+                            f"{len(stale)} stale of {len(expected)} entries")
+    return problems
+
+
+def rebuild_rankings() -> int:
+    """
+    Recomputes all rankings from the workouts collection.
+
+    Returns:
+        int: Number of entries written
+    """
+    entries = [LeaderboardEntry(exercise_type=exercise_type, metric=metric, value=value, workout=workout_id)
+               for (exercise_type, metric), ranking in _live_rankings().items()
+               for workout_id, value in ranking.items()]
+    LeaderboardEntry.objects.delete()
+    if entries:
+        LeaderboardEntry.objects.insert(entries, load_bulk=False)
+    return len(entries)
+
+
+def main():
+    from mongoengine import connect
+    from leaderboard.config.settings import settings
+
+    parser = argparse.ArgumentParser(description="Verify or rebuild the materialized leaderboard rankings")
+    parser.add_argument('command', choices=['verify', 'rebuild'])
+    args = parser.parse_args()
+
+    connect(db=settings.MONGODB_DB, host=settings.MONGODB_URI)
+    if args.command == 'rebuild':
+        print(f"Rebuilt rankings with {rebuild_rankings()} entries")
+
+    problems = verify_rankings()
+    for problem in problems:
+        print(problem)
+    if problems:
+        sys.exit(1)
+    print("Rankings match the workouts collection")
+
+
+if __name__ == "__main__":
+    main()
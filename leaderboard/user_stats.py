@@ -0,0 +1,118 @@
+"""
+Per-user dashboard statistics kept in a UserStats rollup document.
+
+The rollup is updated with atomic $inc / $max updates as workouts are created, completed and deleted, so the
+dashboard reads one small document whatever the length of a user's history. A maximum cannot be decremented:
+removing a workout that may hold a best power rebuilds the rollup with an aggregation pipeline instead, as does
+the first read of a user without a rollup.
+
+The record_* updates deliberately do not upsert: a user without a rollup has none because it was never built,
+and an upserted one would only hold the changes since then while looking complete. They leave such a user
+alone, and the first read builds the rollup from all of their workouts.
+
+Usage:
+    python leaderboard/user_stats.py rebuild    # recompute the rollups of all users from their workouts
+"""
+import argparse
+from pathlib import Path
+import sys
+sys.path.append(str(Path(__file__).parent.parent))
+from leaderboard.database.mongodb import Workout, UserStats
+
+
+def _owner(workout: Workout):
+    """Returns the user ID of `workout` without loading the user."""
+    return workout.to_mongo().get('user')
+
+
+def record_created(workout: Workout):
+    """Counts a new workout of any status, in an existing rollup only (see the module docstring)."""
+    UserStats.objects(user=_owner(workout)).update_one(inc__workout_count=1)
+
+
+def record_completed(workout: Workout):
+    """Adds the metrics of a workout that just became complete, in an existing rollup only."""
+    power = float(workout.max_power_per_kg or 0)
+    UserStats.objects(user=_owner(workout)).update_one(
+        inc__total_reps=int(workout.rep_count or 0),
+        max__best_power_per_kg=power,
+        **{f'max__exercise_powers__{workout.exercise_type}': power})
+
+
+def record_removed(workout: Workout, deleted: bool = True):
+    """
+    Takes out a workout that was deleted, or is no longer complete because it is processed again.
+
+    Call it after the change is saved, with the workout as it was before, so a rebuild no longer sees it.
+
+    Args:
+        workout: Workout with its previous status and metrics
+        deleted: Whether the workout was deleted, rather than only reset
+    """
+    user_id = _owner(workout)
+    complete = workout.status == "complete"
+    changes = {}
+    if deleted:
+        changes['dec__workout_count'] = 1
+    if complete:
+        changes['dec__total_reps'] = int(workout.rep_count or 0)
+    if changes:
+        UserStats.objects(user=user_id).update_one(**changes)
+    if not complete:
+        return
+
+    # The workout may have held the best power of its exercise, which only a full pass can replace
+    stats = UserStats.objects(user=user_id).only('exercise_powers').first()
+    if stats and float(workout.max_power_per_kg or 0) >= stats.exercise_powers.get(workout.exercise_type, 0):
+        rebuild_user_stats(user_id)
+
+
+def rebuild_user_stats(user_id) -> UserStats:
+    """Recomputes the rollup of a user from their workouts with an aggregation pipeline."""
+    complete = {'$eq': ['$status', 'complete']}
+    groups = Workout.objects(user=user_id).aggregate([
+        {'$group': {
+            '_id': '$exercise_type',
+            'workouts': {'$sum': 1},
+            'reps': {'$sum': {'$cond': [complete, '$rep_count', 0]}},
+            'best': {'$max': {'$cond': [complete, '$max_power_per_kg', None]}},
+        }}
+    ])
+
+    workout_count, total_reps, exercise_powers = 0, 0, {}
+    for group in groups:
+        workout_count += group['workouts']
+        total_reps += group['reps']
+        if group['best'] is not None:
+            exercise_powers[group['_id']] = group['best']
+
+    return UserStats.objects(user=user_id).modify(
+        upsert=True, new=True,
+        set__workout_count=workout_count,
+        set__total_reps=total_reps,
+        set__best_power_per_kg=max(exercise_powers.values(), default=0),
+        set__exercise_powers=exercise_powers)
+
+
+def user_stats(user_id) -> UserStats:
+    """Returns the rollup of a user, building it on first use."""
+    return UserStats.objects(user=user_id).first() or rebuild_user_stats(user_id)
+
+
+def main():
+    from mongoengine import connect
+    from leaderboard.config.settings import settings
+
+    parser = argparse.ArgumentParser(description="Rebuild the per-user dashboard statistics")
+    parser.add_argument('command', choices=['rebuild'])
+    parser.parse_args()
+
+    connect(db=settings.MONGODB_DB, host=settings.MONGODB_URI)
+    user_ids = set(Workout.objects.distinct('user')) | set(UserStats.objects.distinct('user'))
+    for user_id in user_ids:
+        rebuild_user_stats(getattr(user_id, 'id', user_id))
+    print(f"Rebuilt the statistics of {len(user_ids)} users")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,42 +2,106 @@
 
 from ultralytics.solutions.solutions import BaseSolution
 from ultralytics.utils.plotting import Annotator
-import numpy as np
+from src.rep_counter import RepCounter, TrackState
+from src.backends import resolve_model
+from src.instrumentation import timer
+from src.roi import pad_box, select_detection
 import cv2
+import numpy as np
+
+# Track ID of the athlete followed in ROI mode, which does not use the tracker
+ROI_TRACK_ID = 1
+
+# Events the tracker hooks into the predictor of a model once `track` is called on it
+TRACKER_EVENTS = ("on_predict_start", "on_predict_postprocess_end")
+
+
+def draw_workout_info(im0, state:TrackState, exercise_mass:float, displacement:float):
+    """Draws the rep and power summary of one person at the bottom left of the image."""
+    # Get image dimensions for positioning
+    img_h, img_w = im0.shape[:2]
+    
+    # Format text for display
+    info_text = [
+        f"Reps: {state.count}", # Reps
+        f"m: {exercise_mass:.0f} kg",  # Mass in kg
+        f"dh: {displacement:.2f} m",  # Distance
+        f"t: {state.rep_durations[-1]:.2f} s" if state.rep_durations else "",  # Time in seconds
+        f"Rep Power: {state.power_outputs[-1]:.0f} W",  # Result
+        f"Max Power: {state.max_power:.0f} W" if state.max_power > 0 else "",  # Max power in W
+        f"Avg Power: {state.avg_power:.0f} W" if state.avg_power > 0 else "", # Average power in W
+    ]
+    
+    # Position text at bottom left with smaller font
+    font_scale = 0.7  # Smaller font size
+    font_thickness = 1  # Thinner text
+    font = cv2.FONT_HERSHEY_SIMPLEX
+    padding = 10  # Padding from image edges
+    
+    # Calculate starting y position from bottom
+    y_offset = img_h - (len(info_text) * 25 + padding)  # 25 pixels between lines
+    x_offset = padding
+    
+    for text in info_text:
+        if text:  # Only display non-empty text
+            cv2.putText(im0, text, (x_offset, y_offset), 
+                      font, font_scale, (0, 255, 0), font_thickness)
+            y_offset += 25  # Smaller line spacing
 
 
-class AIGym(BaseSolution):
+class AIGym(BaseSolution, RepCounter):
     """
     A class to manage gym steps of people in a real-time video stream based on their poses.
 
     This class extends BaseSolution to monitor workouts using YOLO pose estimation models. It tracks and counts
-    repetitions of exercises based on predefined angle thresholds for up and down positions.
+    repetitions of exercises based on predefined angle thresholds for up and down positions. The rep and power
+    state machine itself lives in RepCounter.
 
     Attributes:
-        count (List[int]): Repetition counts for each detected person.
-        angle (List[float]): Current angle of the tracked body part for each person.
-        stage (List[str]): Current exercise stage ('up', 'down', or '-') for each person.
+        tracks (Dict[int, TrackState]): Rep and power state of every live track, keyed by tracker ID.
+        retired (TrackState | None): Best track evicted after `track_ttl` unseen frames.
+        track_ttl (int): Frames a track may go unseen before its state is evicted.
         initial_stage (str | None): Initial stage of the exercise.
         up_angle (float): Angle threshold for considering the 'up' position of an exercise.
         down_angle (float): Angle threshold for considering the 'down' position of an exercise.
         kpts (List[int]): Indices of keypoints used for angle calculation.
+        backend (str): Inference backend: 'pytorch', 'onnx', 'openvino' or 'auto' for the fastest available.
         lw (int): Line width for drawing annotations.
         annotator (Annotator): Object for drawing annotations on the image.
-        start_frames (List[int]): Frame number when movement starts.
-        start_positions (List[float]): Starting Y position.
-        power_outputs (List[float]): Power output for each rep.
-        rep_durations (List[List[float]]): List of rep durations.
         exercise_mass (float): User mass in kg.
         displacement (float): Rep displacement in meters.
         fps (float): Video FPS.
         frame_count (int): Current frame number.
+        record_keypoints (bool): Whether to record per-frame, per-track keypoints for the keypoint cache.
+        trajectory (List[tuple]): Recorded (frame, track_id, keypoints) entries.
+        roi (bool): Follow a single athlete and run the pose model on a padded crop around their last box.
+        roi_padding (float): Fraction of the box size added on each side of the crop.
+        roi_imgsz (int): Pose model input size for crops.
+        roi_conf (float): Minimum confidence of the athlete's detection.
+        roi_box (tuple | None): Crop region for the next frame, None until the athlete is found.
+        untracked_callbacks (dict): Predictor callbacks of the model without the tracker's, used in ROI mode.
+        keyframe_interval (int): Maximum frames between pose model runs; in between, the keypoints in `kpts`
+            are propagated with optical flow. 1 runs the model on every frame.
+        flow_interval (int): Current, adaptive, number of frames between pose model runs.
+        flow_max_error (float): Lucas-Kanade tracking error above which the pose model is run again.
+        max_angle_velocity (float): Joint angle change in degrees per frame above which the pose model is run
+            on the next frame.
 
     Methods:
         calculate_power: Calculates power output based on exercise mass, distance, and time.
+        primary: Returns the state of the main athlete.
+        reset: Resets tracker and rep state to reuse the loaded model for a new video.
         monitor: Processes a frame to detect poses, calculate angles, and count repetitions.
+        monitor_batch: Processes a batch of consecutive frames with a single pose model call.
+        monitor_roi: Processes a frame on a crop around the athlete, falling back to the full frame.
+        predict_untracked: Runs the pose model on one image without the tracker.
+        monitor_propagated: Runs the pose model on keyframes only, propagating keypoints with optical flow.
+        process_tracks: Updates counts and power from the tracking result of one frame.
+        process_people: Updates counts and power from the keypoints of each person in one frame.
+        draw_info: Draws the rep and power summary of one person on the image.
 
     Examples:
-        >>> gym = AIGym(model="yolov8n-pose.pt")
+        >>> gym = AIGym(model="yolov8n-pose.pt", backend="onnx")
         >>> image = cv2.imread("gym_scene.jpg")
         >>> processed_image = gym.monitor(image)
         >>> cv2.imshow("Processed Image", processed_image)
@@ -52,88 +116,85 @@ class AIGym(BaseSolution):
         elif "model" not in kwargs:
             kwargs["model"] = "yolo11n-pose.pt"
 
+        # Load the pose model through the requested inference backend, exported and cached on first use
+        self.backend = kwargs.pop("backend", "pytorch")
+        if self.backend != "pytorch":
+            kwargs["model"] = resolve_model(kwargs["model"], self.backend)
+
         super().__init__(**kwargs)
-        self.count = []  
-        self.angle = [] 
-        self.stage = [] 
-        
-        # Add power calculation attributes
-        self.start_frames = []  # Frame number when movement starts
-        self.start_positions = []  # Starting Y position
-        self.power_outputs = []  # Power output for each rep
-        self.avg_power = []  # Average power output
-        self.max_power = []  # Maximum power output
-        self.rep_durations = []  # List of rep durations
-        self.exercise_mass = kwargs.get('exercise_mass', 70.0)  # Exercise mass in kg
-        self.displacement = kwargs.get('displacement', 0.6)  # Rep displacement in meters
-        self.fps = kwargs.get('fps', 30.0)  # Video FPS
-        self.frame_count = 0  # Current frame number
+
+        # Predictor callbacks before any `track` call adds the tracker's, for inference without the tracker
+        self.untracked_callbacks = {event: list(self.model.callbacks.get(event, [])) for event in TRACKER_EVENTS}
 
         # Extract details from CFG single time for usage later
+        RepCounter.__init__(
+            self,
+            pose_type=kwargs.get("pose_type"),
+            up_angle=self.CFG["up_angle"],  # Pose up predefined angle to consider up pose
+            down_angle=self.CFG["down_angle"],  # Pose down predefined angle to consider down pose
+            exercise_mass=kwargs.get('exercise_mass', 70.0),  # Exercise mass in kg
+            displacement=kwargs.get('displacement', 0.6),  # Rep displacement in meters
+            fps=kwargs.get('fps', 30.0),  # Video FPS
+            track_ttl=kwargs.get('track_ttl', 300),  # Frames before an unseen track is evicted
+        )
         self.initial_stage = None
-        self.up_angle = float(self.CFG["up_angle"])  # Pose up predefined angle to consider up pose
-        self.down_angle = float(self.CFG["down_angle"])  # Pose down predefined angle to consider down pose
         self.kpts = self.CFG["kpts"]  # User selected kpts of workouts
         self.lw = self.CFG["line_width"]  # Store line_width for usage
-        if "pose_type" in kwargs:
-            self.pose_type = kwargs["pose_type"]
-
-    def calculate_power(self, vertical_distance: float, time_taken: float):
-        """Calculate power output based on exercise mass, distance, and time."""
-        if time_taken <= 0:
-            return 0
-        g = 9.81  # m/s²
-        work = self.exercise_mass * g * vertical_distance
-        power = work / time_taken
-        return power
-
-    def track_pullups(self, ind:int, kpts:list):
-        # Get shoulder position (kpts[0] should be shoulder joint)
-        shoulder_y = float(kpts[0][1])
-
-        if self.angle[ind] > self.down_angle and self.stage[ind] != "down":
-            # Starting position detected
-            self.start_frames[ind] = self.frame_count
-            self.start_positions[ind] = shoulder_y
-            self.stage[ind] = "down"
-        elif self.angle[ind] < self.up_angle:
-            if self.stage[ind] == "down":
-                # Completed rep
-                if self.start_frames[ind] > 0:
-                    # Calculate duration in seconds using frame count
-                    frames_elapsed = self.frame_count - self.start_frames[ind]
-                    duration = frames_elapsed / self.fps
-                    
-                    # Calculate and store power
-                    power = self.calculate_power(self.displacement, duration)
-                    if ind < len(self.power_outputs):
-                        self.power_outputs[ind].append(power)
-                    
-                    # Store duration
-                    if ind < len(self.rep_durations):
-                        self.rep_durations[ind].append(duration)
-                
-                self.count[ind] += 1
-            self.stage[ind] = "up"
-
-    def track_dips(self, ind:int, kpts:list):
-        pass
-
-    def track_pushups(self, ind:int, kpts:list):
-        if self.angle[ind] < self.down_angle:
-            if self.stage[ind] == "up":
-                self.count[ind] += 1
-            self.stage[ind] = "down"
-        elif self.angle[ind] > self.up_angle:
-            self.stage[ind] = "up"
-
-    def track_squats(self, ind:int, kpts:list):
-        pass
-
-    def track_situps(self, ind:int, kpts:list):
-        pass
-
-    def monitor(self, im0, is_display:bool=False):
+
+        # Keypoint trajectory recording for the keypoint cache
+        self.record_keypoints = kwargs.get('record_keypoints', False)
+        self.trajectory = []
+
+        # Region-of-interest inference for single-athlete videos
+        self.roi = kwargs.get('roi', False)
+        self.roi_padding = kwargs.get('roi_padding', 0.25)
+        self.roi_imgsz = kwargs.get('roi_imgsz', 320)
+        self.roi_conf = kwargs.get('roi_conf', 0.5)
+        self.roi_box = None
+        self.roi_last_box = None
+
+        # Keyframe detection with optical flow propagation in between
+        self.keyframe_interval = kwargs.get('keyframe_interval', 1)
+        self.flow_max_error = kwargs.get('flow_max_error', 30.0)
+        self.max_angle_velocity = kwargs.get('max_angle_velocity', 6.0)
+        self.reset_flow()
+
+    def reset(self, **kwargs):
+        """
+        Resets tracker and rep state so the loaded model can be reused for a new video.
+
+        Any of pose_type, up_angle, down_angle, exercise_mass, displacement, fps, track_ttl, record_keypoints and
+        the roi and keyframe settings can be passed to reconfigure the instance; omitted settings keep their current values.
+
+        Examples:
+            >>> gym.reset(pose_type="pushups", up_angle=150, down_angle=100, fps=60)
+        """
+        for name in ("pose_type", "exercise_mass", "displacement", "fps", "track_ttl", "record_keypoints",
+                     "roi", "roi_padding", "roi_imgsz", "roi_conf", "keyframe_interval", "flow_max_error",
+                     "max_angle_velocity"):
+            if kwargs.get(name) is not None:
+                setattr(self, name, kwargs[name])
+        for name in ("up_angle", "down_angle"):
+            if kwargs.get(name) is not None:
+                setattr(self, name, float(kwargs[name]))
+                self.CFG[name] = kwargs[name]
+
+        self.reset_counters()
+        self.trajectory = []
+        self.roi_box = None
+        self.roi_last_box = None
+        self.reset_flow()
+
+        # Drop all tracks so IDs and motion state do not leak from the previous video
+        predictor = getattr(self.model, "predictor", None)
+        for tracker in getattr(predictor, "trackers", None) or []:
+            tracker.reset()
+
+    def draw_info(self, im0, state:TrackState):
+        """Draws the rep and power summary of one person at the bottom left of the image."""
+        draw_workout_info(im0, state, self.exercise_mass, self.displacement)
+
+    def monitor(self, im0, is_display:bool=False, render:bool=True):
         """
         Monitors workouts using Ultralytics YOLO Pose Model.
 
@@ -144,6 +205,8 @@ class AIGym(BaseSolution):
         Args:
             im0 (ndarray): Input image for processing.
             is_dispaly (bool): Display the output
+            render (bool): Draw keypoints and the info overlay. When False only tracking and rep/power
+                computation run and `im0` is returned untouched.
 
         Returns:
             (ndarray): Processed image with annotations for workout monitoring.
@@ -153,94 +216,286 @@ class AIGym(BaseSolution):
             >>> image = cv2.imread("workout.jpg")
             >>> processed_image = gym.monitor(image)
         """
+        if self.keyframe_interval > 1:
+            return self.monitor_propagated(im0, is_display, render)
+        return self.monitor_keyframe(im0, is_display, render)
+
+    def monitor_keyframe(self, im0, is_display:bool=False, render:bool=True):
+        """Runs the pose model on a frame, on a crop around the athlete in ROI mode, and processes the result."""
+        if self.roi:
+            return self.monitor_roi(im0, is_display, render)
+
+        # Extract tracks
+        with timer("track"):
+            tracks = self.model.track(source=im0, persist=True, classes=self.CFG["classes"])[0]
+        return self.process_tracks(im0, tracks, is_display, render)
+
+    def monitor_batch(self, frames:list, is_display:bool=False, render:bool=True):
+        """
+        Monitors a batch of consecutive frames with a single pose model call.
+
+        The whole batch goes through the model in one forward pass. The tracker still updates frame by frame in
+        order, and every result is then fed through the rep state machine exactly as `monitor` would.
+
+        Args:
+            frames (List[ndarray]): Consecutive input images, oldest first.
+            is_display (bool): Display the output
+            render (bool): Draw keypoints and the info overlay.
+
+        Returns:
+            (List[ndarray]): Processed images with annotations, in the same order as `frames`.
+
+        Examples:
+            >>> gym = AIGym()
+            >>> processed_frames = gym.monitor_batch([frame1, frame2, frame3, frame4])
+        """
+        if not frames:
+            return []
+        if self.roi or self.keyframe_interval > 1:
+            # Every crop or propagated frame depends on the previous frame's result
+            return [self.monitor(im0, is_display, render) for im0 in frames]
+        with timer("track"):
+            results = self.model.track(source=list(frames), persist=True, classes=self.CFG["classes"])
+        return [self.process_tracks(im0, tracks, is_display, render) for im0, tracks in zip(frames, results)]
+
+    def monitor_roi(self, im0, is_display:bool=False, render:bool=True):
+        """
+        Monitors a single athlete, running the pose model on a padded crop around their last bounding box.
+
+        The crop is run at the smaller `roi_imgsz` input size and the keypoints are mapped back to frame
+        coordinates. Until the athlete is first found, or when the crop loses them, the full frame is used
+        instead. The tracker is not used: the followed athlete always has track ID ROI_TRACK_ID.
+
+        Args:
+            im0 (ndarray): Input image for processing.
+            is_display (bool): Display the output
+            render (bool): Draw keypoints and the info overlay.
+
+        Returns:
+            (ndarray): Processed image with annotations for workout monitoring.
+        """
+        detection = None
+        if self.roi_box is not None:
+            x1, y1, x2, y2 = self.roi_box
+            crop = np.ascontiguousarray(im0[y1:y2, x1:x2])
+            with timer("track"):
+                result = self.predict_untracked(crop, imgsz=self.roi_imgsz)
+            detection = self._roi_detection(result, (x1, y1))
+
+        if detection is None:
+            # No athlete yet, or the crop lost them: detect on the full frame
+            with timer("track"):
+                result = self.predict_untracked(im0)
+            detection = self._roi_detection(result, (0, 0))
+
+        if detection is None:
+            # Keep the last crop region, the athlete is most likely to reappear there
+            return self.process_people(im0, [], [], is_display, render)
+
+        box, k = detection
+        self.roi_last_box = box
+        self.roi_box = pad_box(box, im0.shape, self.roi_padding)
+        return self.process_people(im0, [ROI_TRACK_ID], [k], is_display, render)
+
+    def predict_untracked(self, im0, **kwargs):
+        """
+        Runs the pose model on one image without the tracker.
+
+        Once `track` ran on the model, e.g. in ModelPool.warmup or an earlier job, its predictor calls the tracker
+        after every inference, which would keep only confirmed tracks and feed crop coordinates to the tracker.
+        The tracker callbacks are taken out for this call and put back afterwards, so tracking keeps working
+        for later videos.
+
+        Returns:
+            (Results): Pose model result for `im0`.
+        """
+        callbacks = self.model.callbacks
+        tracked = {event: callbacks.get(event, []) for event in TRACKER_EVENTS}
+        callbacks.update({event: list(untracked) for event, untracked in self.untracked_callbacks.items()})
+        try:
+            return self.model.predict(im0, classes=self.CFG["classes"], verbose=False, **kwargs)[0]
+        finally:
+            callbacks.update(tracked)
+
+    def reset_flow(self):
+        """Forgets the optical flow state, so the next frame is a keyframe."""
+        self.flow_interval = self.keyframe_interval
+        self.flow_prev_gray = None
+        self.flow_people = []
+        self.flow_since_keyframe = 0
+        self.flow_force = True
+        self.flow_angles = {}
+
+    def monitor_propagated(self, im0, is_display:bool=False, render:bool=True):
+        """
+        Runs the pose model every `flow_interval` frames and propagates keypoints with optical flow in between.
+
+        On frames between keyframes, only the `kpts` keypoints of the people found on the previous frame are
+        moved with pyramidal Lucas-Kanade optical flow; the others keep their last position. The interval adapts
+        between 1 and `keyframe_interval`: it grows by one after every keyframe reached without trouble, and
+        halves when the flow loses a keypoint, its error exceeds `flow_max_error`, or a joint angle moves faster
+        than `max_angle_velocity` degrees per frame, which forces a keyframe. Fast angle changes happen around
+        rep transitions, where rep timing needs real detections. The tracker only sees keyframes.
+
+        Args:
+            im0 (ndarray): Input image for processing.
+            is_display (bool): Display the output
+            render (bool): Draw keypoints and the info overlay.
+
+        Returns:
+            (ndarray): Processed image with annotations for workout monitoring.
+        """
+        gray = cv2.cvtColor(im0, cv2.COLOR_BGR2GRAY)
+        people = None
+        if not self.flow_force and self.flow_people and self.flow_since_keyframe < self.flow_interval - 1:
+            people = self._propagate(gray)
+
+        if people is None:
+            if not self.flow_force:
+                self.flow_interval = min(self.keyframe_interval, self.flow_interval + 1)
+            self.flow_force = False
+            self.flow_since_keyframe = 0
+            im0 = self.monitor_keyframe(im0, is_display, render)
+        else:
+            self.flow_since_keyframe += 1
+            im0 = self.process_people(im0, *people, is_display, render)
+
+        self.flow_prev_gray = gray
+        self._check_angle_velocity()
+        return im0
+
+    def _propagate(self, gray):
+        """Moves the last frame's people to `gray`, returns (track_ids, keypoints) or None to force a keyframe."""
+        indices = [int(i) for i in self.kpts]
+        points = np.array([[k[i, :2].tolist() for i in indices] for _, k in self.flow_people],
+                          dtype=np.float32).reshape(-1, 1, 2)
+        with timer("flow"):
+            moved, status, error = cv2.calcOpticalFlowPyrLK(self.flow_prev_gray, gray, points, None,
+                                                            winSize=(21, 21), maxLevel=3)
+        if not status.all() or float(error.max()) > self.flow_max_error:
+            self._force_keyframe()
+            return None
+
+        moved = moved.reshape(len(self.flow_people), len(indices), 2)
+        track_ids, keypoints = [], []
+        for (track_id, k), xy in zip(self.flow_people, moved):
+            k_new = k.numpy().copy()
+            k_new[indices, :2] = xy
+            track_ids.append(track_id)
+            keypoints.append(k.new_tensor(k_new))
+        return track_ids, keypoints
+
+    def _check_angle_velocity(self):
+        """Forces a keyframe on the next frame when a joint angle of a visible person moves too fast."""
+        angles = {}
+        fast = False
+        for track_id, _ in self.flow_people:
+            state = self.tracks.get(track_id)
+            if state is None:
+                continue
+            angles[track_id] = state.angle
+            previous = self.flow_angles.get(track_id)
+            fast = fast or (previous is not None and abs(state.angle - previous) > self.max_angle_velocity)
+        self.flow_angles = angles
+        if fast and not self.flow_force:
+            self._force_keyframe()
+
+    def _force_keyframe(self):
+        """Runs the pose model on the next frame and halves the keyframe interval."""
+        self.flow_force = True
+        self.flow_interval = max(1, self.flow_interval // 2)
+
+    def _roi_detection(self, result, offset:tuple):
+        """Returns the athlete's (box, keypoints) in frame coordinates from a crop at `offset`, or None."""
+        if result.keypoints is None or len(result.boxes) == 0:
+            return None
+        ox, oy = offset
+        boxes = result.boxes.xyxy.cpu().numpy() + np.array([ox, oy, ox, oy], dtype=np.float32)
+        i = select_detection(boxes, result.boxes.conf.cpu().numpy(), self.roi_last_box, self.roi_conf)
+        if i is None:
+            return None
+        k = result.keypoints.data[i].cpu()
+        return boxes[i], k + k.new_tensor([ox, oy, 0])
+
+    def process_tracks(self, im0, tracks, is_display:bool=False, render:bool=True):
+        """
+        Updates rep counts and power from the tracking result of one frame and annotates the frame.
+
+        Args:
+            im0 (ndarray): Image the tracks were computed on.
+            tracks (Results): Tracking result for `im0` returned by the pose model.
+            is_display (bool): Display the output
+            render (bool): Draw keypoints and the info overlay.
+
+        Returns:
+            (ndarray): Processed image with annotations for workout monitoring.
+        """
+        if tracks.boxes.id is None:
+            return self.process_people(im0, [], [], is_display, render)
+        track_ids = tracks.boxes.id.int().cpu().tolist()
+        return self.process_people(im0, track_ids, tracks.keypoints.data, is_display, render)
+
+    def process_people(self, im0, track_ids:list, keypoints, is_display:bool=False, render:bool=True):
+        """
+        Updates rep counts and power from the keypoints of every person in one frame and annotates the frame.
+
+        Args:
+            im0 (ndarray): Image the keypoints were detected on.
+            track_ids (List[int]): Track ID of every person.
+            keypoints (Tensor): (nPerson, 17, 3) keypoints in `im0` coordinates, in the order of `track_ids`.
+            is_display (bool): Display the output
+            render (bool): Draw keypoints and the info overlay.
+
+        Returns:
+            (ndarray): Processed image with annotations for workout monitoring.
+        """
         # Increment frame counter
         self.frame_count += 1
-        
-        # Extract tracks
-        tracks = self.model.track(source=im0, persist=True, classes=self.CFG["classes"])[0]
 
-        if tracks.boxes.id is not None:
+        if track_ids:
             # Extract and check keypoints
-            print("Number of tracks:", len(tracks), "Number of rep counters:", len(self.count))
-            if len(tracks) > len(self.count): # 1st frame len(self.count) is 0
-                new_human = len(tracks) - len(self.count)
-                self.angle += [0] * new_human
-                self.count += [0] * new_human
-                self.stage += ["-"] * new_human
-                self.start_frames += [0] * new_human
-                self.start_positions += [0] * new_human
-                self.rep_durations += [[]] * new_human
-                self.power_outputs += [[]] * new_human
-                self.avg_power += [0] * new_human
-                self.max_power += [0] * new_human
-
-            # Initialize annotator
-            self.annotator = Annotator(im0, line_width=self.lw)
+            print("Number of tracks:", len(track_ids), "Number of rep counters:", len(self.tracks))
+
+            # Initialize annotator only when the frame is drawn on
+            if render:
+                self.annotator = Annotator(im0, line_width=self.lw)
 
             # Enumerate over 17 keypoints, each with (x,y,visible) values
-            for ind, k in enumerate(reversed(tracks.keypoints.data)): # (nPerson, 17, 3)
-                # Get keypoints and estimate the angle
+            for track_id, k in zip(track_ids, keypoints): # (nPerson, 17, 3)
+                # Get keypoints, estimate the angle and track movement for power calculation
                 kpts = [k[int(self.kpts[i])].cpu() for i in range(len(self.kpts))]
-                self.angle[ind] = self.annotator.estimate_pose_angle(*kpts)
-                
-                # Track movement for power calculation
-                if self.pose_type == 'pullups':
-                    self.track_pullups(ind, kpts)
-
-                elif self.pose_type == 'pushups':
-                    self.track_pushups(ind, kpts)
-
-                # Draw keypoints and skeleton
-                draw_kpts = self.kpts # [5,7,9,11,12,13,14,15,16]
-                im0 = self.annotator.draw_specific_points(k, draw_kpts, radius=self.lw)
-
-                # Display comprehensive information
-                if ind < len(self.power_outputs) and len(self.power_outputs[ind]) > 0:
-                    # Calculate average and max power if we have multiple reps
-                    self.avg_power[ind] = 0
-                    self.max_power[ind] = 0
-                    if ind < len(self.rep_durations) and len(self.rep_durations[ind]) > 0:
-                        self.avg_power[ind] = np.mean(self.power_outputs[ind])
-                        self.max_power[ind] = np.max(self.power_outputs[ind])
-                    
-                    # Get image dimensions for positioning
-                    img_h, img_w = im0.shape[:2]
-                    
-                    # Format text for display
-                    info_text = [
-                        f"Reps: {self.count[ind]}", # Reps
-                        f"m: {self.exercise_mass:.0f} kg",  # Mass in kg
-                        f"dh: {self.displacement:.2f} m",  # Distance
-                        f"t: {self.rep_durations[ind][-1]:.2f} s" if self.rep_durations[ind] else "",  # Time in seconds
-                        f"Rep Power: {self.power_outputs[ind][-1]:.0f} W",  # Result
-                        f"Max Power: {self.max_power[ind]:.0f} W" if self.max_power[ind] > 0 else "",  # Max power in W
-                        f"Avg Power: {self.avg_power[ind]:.0f} W" if self.avg_power[ind] > 0 else "", # Average power in W
-                    ]
-                    
-                    # Position text at bottom left with smaller font
-                    font_scale = 0.7  # Smaller font size
-                    font_thickness = 1  # Thinner text
-                    font = cv2.FONT_HERSHEY_SIMPLEX
-                    padding = 10  # Padding from image edges
-                    
-                    # Calculate starting y position from bottom
-                    y_offset = img_h - (len(info_text) * 25 + padding)  # 25 pixels between lines
-                    x_offset = padding
-                    
-                    for text in info_text:
-                        if text:  # Only display non-empty text
-                            cv2.putText(im0, text, (x_offset, y_offset), 
-                                      font, font_scale, (0, 255, 0), font_thickness)
-                            y_offset += 25  # Smaller line spacing
+                state = self.update(track_id, kpts)
+
+                if self.record_keypoints:
+                    self.trajectory.append((self.frame_count, track_id, k.cpu().numpy()))
+
+                if not render:
+                    continue
+
+                with timer("annotate"):
+                    # Draw keypoints and skeleton
+                    draw_kpts = self.kpts # [5,7,9,11,12,13,14,15,16]
+                    im0 = self.annotator.draw_specific_points(k, draw_kpts, radius=self.lw)
+
+                    # Display comprehensive information
+                    if state.power_outputs:
+                        self.draw_info(im0, state)
 
                 # Display angle, count, and stage text
                 # self.annotator.plot_angle_and_count_and_stage(
-                #     angle_text=self.angle[ind],  # angle text for display
-                #     count_text=self.count[ind],  # count text for workouts
-                #     stage_text=self.stage[ind],  # stage position text
+                #     angle_text=state.angle,  # angle text for display
+                #     count_text=state.count,  # count text for workouts
+                #     stage_text=state.stage,  # stage position text
                 #     center_kpt=k[int(self.kpts[1])],  # center keypoint for display
                 # )
 
-        if is_display:
+        # Drop people who left the frame long ago
+        self.evict_stale()
+
+        if self.keyframe_interval > 1:
+            # People to propagate with optical flow to the next frame
+            self.flow_people = [(track_id, k.cpu()) for track_id, k in zip(track_ids, keypoints)]
+
+        if is_display and render:
             self.display_output(im0)  # Display output image, if environment support display
         return im0  # return an image
@@ -0,0 +1,176 @@
+import importlib.util
+import os
+import shutil
+import tempfile
+import time
+import numpy as np
+from pathlib import Path
+import sys
+sys.path.append(str(Path(__file__).parent.parent))
+from ultralytics import YOLO
+
+DEFAULT_MODEL = str(Path(__file__).parent.parent / "model/yolo11n-pose.pt")
+
+# Inference backends and the Python package each one needs at runtime
+BACKENDS = {
+    'pytorch': 'torch',
+    'onnx': 'onnxruntime',
+    'openvino': 'openvino',
+}
+
+
+def available_backends() -> list:
+    """Returns the backends whose runtime package is installed, PyTorch first."""
+    return [name for name, package in BACKENDS.items() if importlib.util.find_spec(package) is not None]
+
+
+def exported_path(model_path: str, backend: str) -> str:
+    """Returns where the export of `model_path` for `backend` is cached, next to the original model."""
+    path = Path(model_path)
+    if backend == 'onnx':
+        return str(path.with_suffix('.onnx'))
+    if backend == 'openvino':
+        return str(path.parent / f"{path.stem}_openvino_model")
+    return str(path)
+
+
+def export_model(model_path: str, backend: str) -> str:
+    """
+    Exports a PyTorch pose model for `backend`, reusing an earlier export if one is cached.
+
+    Exports use a dynamic input shape so batched inference and any frame size work. The export is written to a
+    temporary directory and moved into place in one rename, so processes exporting the same model at once never
+    load a partial artifact; the first to finish wins.
+
+    Args:
+        model_path: Path to the PyTorch `.pt` model
+        backend: One of BACKENDS
+
+    Returns:
+        str: Path to load the model for `backend` from
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend '{backend}', expected one of {list(BACKENDS)}")
+    target = exported_path(model_path, backend)
+    if backend == 'pytorch' or Path(target).exists():
+        return target
+
+    print(f"Exporting {model_path} to {backend}...")
+    work_dir = tempfile.mkdtemp(prefix=".export_", dir=Path(target).parent)
+    try:
+        # Export a copy of the model, ultralytics writes the export next to the model it exports
+        source = shutil.copy(model_path, work_dir)
+        exported = YOLO(source).export(format=backend, dynamic=True)
+        try:
+            os.replace(exported, target)
+        except OSError:
+            # A directory export (openvino) cannot replace the one another process already moved into place
+            if not Path(target).exists():
+                raise
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return target
+
+
+def benchmark_backend(model_path: str, runs: int = 5, shape: tuple = (480, 640, 3)) -> float:
+    """
+    Measures the mean latency of one pose inference on a dummy frame, after one untimed warm-up call.
+
+    Returns:
+        float: Mean seconds per inference
+    """
+    model = YOLO(model_path, task='pose')
+    frame = np.zeros(shape, dtype=np.uint8)
+    model.predict(frame, verbose=False)
+    start = time.perf_counter()
+    for _ in range(runs):
+        model.predict(frame, verbose=False)
+    return (time.perf_counter() - start) / runs
+
+
+def select_backend(model_path: str, candidates: list = None, runs: int = 5) -> tuple:
+    """
+    Picks the fastest available backend for `model_path` with a short micro-benchmark.
+
+    Backends that fail to export or load are skipped, so this always falls back to PyTorch.
+
+    Args:
+        model_path: Path to the PyTorch `.pt` model
+        candidates: Backends to consider (default: all available)
+        runs: Timed inferences per backend
+
+    Returns:
+        tuple: (backend, path to load the model from)
+    """
+    candidates = [b for b in (candidates or available_backends()) if b in available_backends()]
+    best = ('pytorch', model_path, float('inf'))
+    for backend in candidates:
+        try:
+            path = export_model(model_path, backend)
+            latency = benchmark_backend(path, runs=runs)
+        except Exception as e:
+            print(f"Skipping backend {backend}: {str(e)}")
+            continue
+        print(f"Backend {backend}: {latency * 1000:.1f} ms per frame")
+        if latency < best[2]:
+            best = (backend, path, latency)
+    print(f"Selected backend: {best[0]}")
+    return best[0], best[1]
+
+
+def resolve_backend(backend: str, model_path: str = DEFAULT_MODEL) -> str:
+    """
+    Returns `backend`, or the fastest available backend for `model_path` if it is 'auto'.
+
+    Resolve 'auto' once in the parent process and hand the result to model pools and worker processes, so the
+    micro-benchmark runs once, without other workers competing for the CPU.
+    """
+    if backend == 'auto':
+        return select_backend(model_path)[0]
+    return backend
+
+
+def resolve_model(model_path: str, backend: str = 'pytorch') -> str:
+    """
+    Returns the model path to load for `backend`, exporting the model first if needed.
+
+    Args:
+        model_path: Path to the PyTorch `.pt` model
+        backend: 'pytorch', 'onnx', 'openvino', or 'auto' to benchmark the available ones and pick the fastest
+
+    Returns:
+        str: Path to the model for the chosen backend
+    """
+    if backend == 'auto':
+        return select_backend(model_path)[1]
+    return export_model(model_path, backend)
+
+
+def compare_backends(video_path: str, backends: list = None, tolerance: int = 0, **kwargs) -> bool:
+    """
+    Processes one video with every backend and checks rep counts against PyTorch.
+
+    Args:
+        video_path: Path to the workout video
+        backends: Backends to compare (default: all available)
+        tolerance: Maximum allowed difference in rep count
+        **kwargs: Extra process_video arguments, e.g. exercise_type
+
+    Returns:
+        bool: True if every backend is within `tolerance` reps of PyTorch
+    """
+    from src.workout_monitoring import process_video
+
+    results = {}
+    for backend in backends or available_backends():
+        metrics = process_video(video_path, body_mass=70.0, exercise_mass=70.0, render=False, backend=backend, **kwargs)
+        results[backend] = metrics
+        print(f"{backend}: {metrics['rep_count']} reps, max power {metrics['max_power']:.1f} W")
+    reference = results.get('pytorch', next(iter(results.values())))['rep_count']
+    return all(abs(m['rep_count'] - reference) <= tolerance for m in results.values())
+
+
+if __name__ == "__main__":
+    root = Path(__file__).parent.parent
+    video_path = str(root / "data/pullups.mp4")
+    print("Rep counts match:", compare_backends(video_path, exercise_type='pullups'))
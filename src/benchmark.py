@@ -0,0 +1,317 @@
+"""
+Throughput and latency benchmarks of the inference hot paths.
+
+Runs on the bundled workout clip data/pullups.mp4, which has a person the pose model detects, so the annotate,
+rep counting and power paths do real work. A deterministic synthetic clip can be used instead where the
+bundled clip is not available, but the pose model may not detect its stick figure. Measures:
+    - monitor: frames/sec and p50/p95/p99 per-frame latency of AIGym.monitor, with and without rendering,
+      in ROI mode and with optical flow between keyframes
+    - process_video: end-to-end wall time in several modes (sequential, pipelined, batched, metrics only)
+    - keypoints_in_box: per-request latency
+    - peak RSS of every case, each run in a fresh process so they do not inherit each other's peak
+
+Usage:
+    python src/benchmark.py                           # run, write benchmark/report.json, compare to baseline
+    python src/benchmark.py --save-baseline           # run and store the report as the new baseline
+    python src/benchmark.py --only monitor --clip other_workout.mp4
+    python src/benchmark.py --synthetic --frames 150  # synthetic clip, e.g. without the bundled video
+
+Exits with status 1 if any metric regressed by more than --tolerance against the baseline, or if the baseline
+was recorded on a different clip.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import tempfile
+import time
+import numpy as np
+from pathlib import Path
+import sys
+sys.path.append(str(Path(__file__).parent.parent))
+
+root = Path(__file__).parent.parent
+DEFAULT_REPORT = root / "benchmark/report.json"
+DEFAULT_BASELINE = root / "benchmark/baseline.json"
+DEFAULT_CLIP = root / "data/pullups.mp4"
+
+# Whether a larger value of a metric is better; metrics not listed are not compared
+HIGHER_IS_BETTER = {
+    'fps': True,
+    'p50_ms': False,
+    'p95_ms': False,
+    'p99_ms': False,
+    'wall_s': False,
+    'peak_rss_mb': False,
+}
+
+
+def synthetic_clip(path: str, frames: int = 300, size: tuple = (1280, 720), fps: int = 30, seed: int = 0) -> str:
+    """
+    Writes a deterministic clip of a stick figure doing pull-ups on a noisy background.
+
+    The same arguments always produce the same frames, so timings are comparable between runs. The figure
+    is not meant to be detected reliably by the pose model, only to give it realistic work per frame; prefer
+    a real clip such as DEFAULT_CLIP.
+
+    Returns:
+        str: `path`
+    """
+    import cv2
+
+    w, h = size
+    rng = np.random.RandomState(seed)
+    background = rng.randint(60, 120, size=(h, w, 3), dtype=np.uint8)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, size)
+    bar_y = int(h * 0.15)
+    for i in range(frames):
+        im0 = background.copy()
+        cv2.line(im0, (int(w * 0.3), bar_y), (int(w * 0.7), bar_y), (40, 40, 40), 8)
+
+        # One pull-up every 2 seconds: shoulders move between hanging and chin over the bar
+        phase = 0.5 - 0.5 * np.cos(2 * np.pi * i / (2 * fps))
+        shoulder_y = int(bar_y + h * (0.35 - 0.2 * phase))
+        elbow_dx = int(w * (0.04 + 0.06 * phase))
+        cx = w // 2
+        hip_y, foot_y = shoulder_y + int(h * 0.3), shoulder_y + int(h * 0.6)
+        color = (200, 180, 160)
+        for side in (-1, 1):
+            shoulder = (cx + side * int(w * 0.05), shoulder_y)
+            hand = (cx + side * int(w * 0.08), bar_y)
+            elbow = (cx + side * (int(w * 0.05) + elbow_dx), (shoulder_y + bar_y) // 2)
+            cv2.line(im0, shoulder, elbow, color, 14)
+            cv2.line(im0, elbow, hand, color, 12)
+            cv2.line(im0, (cx + side * int(w * 0.03), hip_y), (cx + side * int(w * 0.03), foot_y), color, 16)
+        cv2.line(im0, (cx, shoulder_y), (cx, hip_y), color, 40)
+        cv2.circle(im0, (cx, shoulder_y - int(h * 0.06)), int(h * 0.05), color, -1)
+        writer.write(im0)
+    writer.release()
+    return path
+
+
+def percentiles(latencies: list) -> dict:
+    """Returns fps and p50/p95/p99 latency in milliseconds of per-call latencies in seconds."""
+    latencies = np.asarray(latencies)
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+    return {'fps': float(len(latencies) / latencies.sum()), 'p50_ms': float(p50), 'p95_ms': float(p95),
+            'p99_ms': float(p99), 'frames': int(len(latencies))}
+
+
+def bench_monitor(clip: str, render: bool = True, warmup: int = 5, **kwargs) -> dict:
+    """Per-frame latency of AIGym.monitor on the decoded and resized frames of `clip`."""
+    import cv2
+    from src.workout_monitoring import load_gym, output_size
+
+    cap = cv2.VideoCapture(clip)
+    w, h, fps = (int(cap.get(x)) for x in (cv2.CAP_PROP_FRAME_WIDTH, cv2.CAP_PROP_FRAME_HEIGHT, cv2.CAP_PROP_FPS))
+    size = output_size(w, h)
+    frames = []
+    while True:
+        success, im0 = cap.read()
+        if not success:
+            break
+        frames.append(cv2.resize(im0, size))
+    cap.release()
+
+    gym = load_gym(pose_type='pullups', fps=fps, **kwargs)
+    for im0 in frames[:warmup]:
+        gym.monitor(im0.copy(), render=render)
+    gym.reset()
+
+    latencies = []
+    for im0 in frames:
+        start = time.perf_counter()
+        gym.monitor(im0, render=render)
+        latencies.append(time.perf_counter() - start)
+    athlete = gym.primary()
+    return dict(percentiles(latencies), rep_count=athlete.count if athlete is not None else 0)
+
+
+def bench_process_video(clip: str, **kwargs) -> dict:
+    """End-to-end wall time of process_video on a copy of `clip`, so outputs land in a temporary directory."""
+    from src.workout_monitoring import process_video
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        video_path = shutil.copy(clip, work_dir)
+        start = time.perf_counter()
+        metrics = process_video(video_path, body_mass=70.0, exercise_mass=70.0, exercise_type='pullups', **kwargs)
+        return {'wall_s': time.perf_counter() - start, 'rep_count': metrics['rep_count']}
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def bench_keypoints_in_box(clip: str, requests: int = 50) -> dict:
+    """Latency of keypoints_in_box requests on single full-resolution frames of `clip`."""
+    import cv2
+    from src.keypoints_in_box import keypoints_in_box
+
+    cap = cv2.VideoCapture(clip)
+    frames = []
+    while len(frames) < requests:
+        success, im0 = cap.read()
+        if not success:
+            break
+        frames.append(im0)
+    cap.release()
+
+    h, w = frames[0].shape[:2]
+    box = (w // 4, 0, 3 * w // 4, h)
+    keypoints_in_box(frames[0].copy(), box)  # Warm-up
+    latencies = []
+    for im0 in frames:
+        start = time.perf_counter()
+        keypoints_in_box(im0, box)
+        latencies.append(time.perf_counter() - start)
+    return percentiles(latencies)
+
+
+# Benchmark cases: name -> (function, keyword arguments)
+CASES = {
+    'monitor': (bench_monitor, {'render': True}),
+    'monitor_no_render': (bench_monitor, {'render': False}),
+    'monitor_roi': (bench_monitor, {'render': True, 'roi': True}),
+    'monitor_keyframes': (bench_monitor, {'render': True, 'keyframe_interval': 4}),
+    'process_video_sequential': (bench_process_video, {'pipelined': False, 'batch_size': 1}),
+    'process_video_pipelined': (bench_process_video, {'pipelined': True, 'batch_size': 1}),
+    'process_video_batched': (bench_process_video, {'pipelined': True, 'batch_size': 8}),
+    'process_video_metrics_only': (bench_process_video, {'batch_size': 8, 'render': False}),
+    'keypoints_in_box': (bench_keypoints_in_box, {}),
+}
+
+
+def _run_case(name: str, clip: str) -> dict:
+    """Runs one case in the current (fresh) process and adds its peak RSS."""
+    function, kwargs = CASES[name]
+    result = function(clip, **kwargs)
+    result['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KiB on Linux
+    return result
+
+
+def run_benchmarks(cases: list = None, clip: str = None, frames: int = 300, size: tuple = (1280, 720)) -> dict:
+    """
+    Runs the benchmark cases on a workout clip, each in its own process.
+
+    Args:
+        cases: Names of the cases to run (default: all)
+        clip: Video to run on (default: None, a synthetic clip of `frames` frames of `size`)
+
+    Returns:
+        dict: Report with the environment and the clip under "meta" and the results of every case under "results"
+    """
+    from src.keypoint_cache import video_hash
+
+    cases = cases or list(CASES)
+    work_dir = tempfile.mkdtemp()
+    try:
+        if clip is None:
+            clip_meta = {'name': 'synthetic', 'frames': frames, 'width': size[0], 'height': size[1]}
+            clip = synthetic_clip(os.path.join(work_dir, "synthetic_pullups.mp4"), frames=frames, size=size)
+        else:
+            clip_meta = {'name': os.path.basename(clip), 'sha256': video_hash(clip)}
+        context = multiprocessing.get_context("spawn")
+        results = {}
+        for name in cases:
+            print(f"Running {name}...")
+            with context.Pool(1) as pool:
+                results[name] = pool.apply(_run_case, (name, clip))
+            print(f"{name}: {results[name]}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    rep_counts = [result['rep_count'] for result in results.values() if 'rep_count' in result]
+    if rep_counts and not any(rep_counts):
+        print("Warning: no reps were counted on this clip, so rendering and rep counting may have done no work "
+              "and the render/no-render cases measure the same thing")
+
+    return {
+        'meta': {
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'clip': clip_meta,
+        },
+        'results': results,
+    }
+
+
+def compare(report: dict, baseline: dict, tolerance: float = 0.1) -> list:
+    """
+    Compares a report against a baseline report.
+
+    Args:
+        report: Report returned by run_benchmarks
+        baseline: Earlier report to compare against
+        tolerance: Allowed relative change in the worse direction, e.g. 0.1 for 10%
+
+    Returns:
+        list: One message per regressed metric, empty if there are none
+    """
+    regressions = []
+    for name, result in report['results'].items():
+        reference = baseline.get('results', {}).get(name)
+        if reference is None:
+            continue
+        for metric, higher_is_better in HIGHER_IS_BETTER.items():
+            if metric not in result or not reference.get(metric):
+                continue
+            change = (result[metric] - reference[metric]) / reference[metric]
+            if (-change if higher_is_better else change) > tolerance:
+                regressions.append(f"{name}.{metric}: {reference[metric]:.3f} -> {result[metric]:.3f} "
+                                   f"({change * 100:+.1f}%)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the inference hot paths on a workout clip")
+    parser.add_argument('--only', nargs='+', choices=list(CASES), help="Cases to run (default: all)")
+    parser.add_argument('--clip', default=str(DEFAULT_CLIP), help="Workout video to run on")
+    parser.add_argument('--synthetic', action='store_true', help="Run on a generated clip instead of --clip")
+    parser.add_argument('--frames', type=int, default=300, help="Frames in the synthetic clip")
+    parser.add_argument('--size', type=int, nargs=2, default=(1280, 720), metavar=('WIDTH', 'HEIGHT'),
+                        help="Size of the synthetic clip")
+    parser.add_argument('--output', default=str(DEFAULT_REPORT), help="Where to write the JSON report")
+    parser.add_argument('--baseline', default=str(DEFAULT_BASELINE), help="Baseline report to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.1, help="Allowed relative regression")
+    parser.add_argument('--save-baseline', action='store_true', help="Store this report as the baseline")
+    args = parser.parse_args()
+
+    if not args.synthetic and not os.path.exists(args.clip):
+        parser.error(f"Clip {args.clip} not found, pass --clip or use --synthetic")
+    clip = None if args.synthetic else args.clip
+    report = run_benchmarks(args.only, clip=clip, frames=args.frames, size=tuple(args.size))
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {args.output}")
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        shutil.copy(args.output, args.baseline)
+        print(f"Baseline saved to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}, run with --save-baseline to create one")
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get('meta', {}).get('clip') != report['meta']['clip']:
+        print(f"The baseline was recorded on clip {baseline.get('meta', {}).get('clip')}, not "
+              f"{report['meta']['clip']}; re-create it with --save-baseline")
+        sys.exit(1)
+    regressions = compare(report, baseline, args.tolerance)
+    if regressions:
+        print("Regressions against the baseline:")
+        for regression in regressions:
+            print(f"  {regression}")
+        sys.exit(1)
+    print("No regressions against the baseline")
+
+
+if __name__ == "__main__":
+    main()
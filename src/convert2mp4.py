@@ -1,11 +1,19 @@
-import moviepy.editor as moviepy
+import subprocess
 
-def convertToMp4(origVidFile, finalVidFile):
-    clip = moviepy.VideoFileClip(origVidFile)
-    clip.write_videofile(finalVidFile)
+def convertToMp4(origVidFile, finalVidFile, preset="veryfast", crf=23):
+    """
+    Transcode an existing video to browser-ready H.264 MP4 with ffmpeg.
+
+    process_video already writes H.264 directly, this is only needed for videos written some other way.
+    """
+    subprocess.run([
+        'ffmpeg', '-y', '-loglevel', 'error', '-i', origVidFile,
+        '-c:v', 'libx264', '-preset', preset, '-crf', str(crf), '-pix_fmt', 'yuv420p',
+        '-c:a', 'aac', '-movflags', '+faststart', finalVidFile
+    ], check=True)
     print("Video converted to MP4 successfully.")
 
 if __name__ == '__main__':
     origVidFile = "./output/pullups.avi"
     finalVidFile = "./output/pullups.mp4"
-    convertToMp4(origVidFile, finalVidFile)
\ No newline at end of file
+    convertToMp4(origVidFile, finalVidFile)
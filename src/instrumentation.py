@@ -0,0 +1,136 @@
+"""
+Low-overhead per-stage timing of the processing pipeline.
+
+Stages are timed with `timer` and aggregated into one latency histogram per stage in the current process.
+Worker processes send `snapshot()`s to the parent, which combines them with `merge` and renders them with
+`render_prometheus`. `set_enabled(False)` turns every timer into a shared no-op context.
+
+Examples:
+    >>> with timer("track"):
+    ...     tracks = model.track(im0)
+    >>> print(render_prometheus(snapshot()))
+"""
+import bisect
+import os
+import threading
+import time
+
+# Upper bounds of the histogram buckets in seconds, from per-frame stages to whole jobs
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+_enabled = os.getenv("INSTRUMENTATION_ENABLED", "true").lower() not in ("0", "false", "no")
+_lock = threading.Lock()
+_histograms = {}  # stage -> [bucket counts..., +Inf count, sum]
+
+
+def set_enabled(enabled: bool):
+    """Turns instrumentation on or off for this process."""
+    global _enabled
+    _enabled = bool(enabled)
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def observe(stage: str, seconds: float):
+    """Records one duration of `stage`."""
+    if not _enabled:
+        return
+    index = bisect.bisect_left(BUCKETS, seconds)
+    with _lock:
+        histogram = _histograms.get(stage)
+        if histogram is None:
+            histogram = _histograms[stage] = [0] * (len(BUCKETS) + 1) + [0.0]
+        histogram[index] += 1
+        histogram[-1] += seconds
+
+
+class _Timer:
+    __slots__ = ('stage', 'start')
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def timer(stage: str):
+    """Returns a context manager timing its block as one observation of `stage`."""
+    return _Timer(stage) if _enabled else _NULL_TIMER
+
+
+def snapshot() -> dict:
+    """Returns a picklable copy of this process's histograms, {stage: {'buckets': [...], 'sum': seconds}}."""
+    with _lock:
+        return {stage: {'buckets': h[:-1], 'sum': h[-1]} for stage, h in _histograms.items()}
+
+
+def reset():
+    """Clears all histograms of this process."""
+    with _lock:
+        _histograms.clear()
+
+
+def merge(*snapshots) -> dict:
+    """Adds up snapshots, e.g. of the service and its worker processes, into one."""
+    merged = {}
+    for snap in snapshots:
+        for stage, histogram in snap.items():
+            if stage not in merged:
+                merged[stage] = {'buckets': list(histogram['buckets']), 'sum': histogram['sum']}
+                continue
+            merged[stage]['buckets'] = [a + b for a, b in zip(merged[stage]['buckets'], histogram['buckets'])]
+            merged[stage]['sum'] += histogram['sum']
+    return merged
+
+
+def render_prometheus(snap: dict, gauges: dict = None, prefix: str = "aitrainer") -> str:
+    """
+    Renders a snapshot and gauges in the Prometheus text exposition format.
+
+    Args:
+        snap: Snapshot returned by snapshot() or merge()
+        gauges: Extra {name: (help, value)} gauges, e.g. queue depth
+        prefix: Prefix of every metric name
+
+    Returns:
+        str: Metrics text for a /metrics endpoint
+    """
+    lines = [
+        f"# HELP {prefix}_stage_seconds Time spent per pipeline stage",
+        f"# TYPE {prefix}_stage_seconds histogram",
+    ]
+    for stage in sorted(snap):
+        counts = snap[stage]['buckets']
+        cumulative = 0
+        for bound, count in zip(BUCKETS + (float('inf'),), counts):
+            cumulative += count
+            le = "+Inf" if bound == float('inf') else repr(bound)
+            lines.append(f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+        lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {snap[stage]["sum"]:.6f}')
+        lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {cumulative}')
+    for name, (help_text, value) in (gauges or {}).items():
+        lines.append(f"# HELP {prefix}_{name} {help_text}")
+        lines.append(f"# TYPE {prefix}_{name} gauge")
+        lines.append(f"{prefix}_{name} {value}")
+    return "\n".join(lines) + "\n"
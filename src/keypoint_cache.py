@@ -0,0 +1,183 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import numpy as np
+from pathlib import Path
+import sys
+sys.path.append(str(Path(__file__).parent.parent))
+from src.rep_counter import RepCounter
+from src.rep_engine import angle_series, score_angles, primary_index
+
+CHUNK_SIZE = 1024 * 1024  # Bytes read at a time when hashing videos
+
+# Hex SHA-256 digest returned by video_hash, the only form of key used in cache paths
+VIDEO_HASH = re.compile(r'^[0-9a-f]{64}$')
+
+
+def video_hash(video_path: str) -> str:
+    """
+    Returns the SHA-256 content hash of a video file, read in chunks.
+
+    Args:
+        video_path: Path to the video file
+
+    Returns:
+        str: Hex digest of the file contents
+    """
+    digest = hashlib.sha256()
+    with open(video_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def is_video_hash(key) -> bool:
+    """Whether `key` has the form of a content hash from video_hash."""
+    return isinstance(key, str) and VIDEO_HASH.match(key) is not None
+
+
+def cache_path(cache_dir: str, key: str) -> str:
+    """
+    Returns the directory holding the cached trajectories of the video with content hash `key`.
+
+    Raises:
+        ValueError: If `key` is not a content hash, e.g. a path that would escape `cache_dir`
+    """
+    if not is_video_hash(key):
+        raise ValueError(f"Invalid video hash: {key!r}")
+    return os.path.join(cache_dir, key)
+
+
+def save_trajectories(cache_dir: str, key: str, trajectory: list, fps: float, num_frames: int, kpts: list) -> str:
+    """
+    Saves keypoint trajectories recorded by AIGym to the keypoint cache.
+
+    Each field is stored as its own uncompressed `.npy` file so it can be memory-mapped on load:
+        - frames.npy (N,) int32: frame number of each entry (1-based, like AIGym.frame_count)
+        - track_ids.npy (N,) int32: tracker ID of the person
+        - keypoints.npy (N, 17, 3) float32: all keypoints (x, y, conf) of the person
+        - meta.json: fps, frame count and the keypoint indices used for the angle
+
+    Args:
+        cache_dir: Root directory of the keypoint cache
+        key: Content hash of the video
+        trajectory: AIGym.trajectory, a list of (frame, track_id, keypoints) tuples
+        fps: FPS the trajectories were recorded at
+        num_frames: Number of frames processed
+        kpts: Indices of the keypoints used for angle calculation
+
+    Returns:
+        str: Directory the trajectories were written to
+    """
+    path = cache_path(cache_dir, key)
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    os.makedirs(tmp_path, exist_ok=True)
+
+    if trajectory:
+        frames, track_ids, keypoints = zip(*trajectory)
+        keypoints = np.stack(keypoints).astype(np.float32)
+    else:
+        frames, track_ids = (), ()
+        keypoints = np.zeros((0, 17, 3), dtype=np.float32)
+    np.save(os.path.join(tmp_path, 'frames.npy'), np.asarray(frames, dtype=np.int32))
+    np.save(os.path.join(tmp_path, 'track_ids.npy'), np.asarray(track_ids, dtype=np.int32))
+    np.save(os.path.join(tmp_path, 'keypoints.npy'), keypoints)
+    with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+        json.dump({'fps': float(fps), 'num_frames': int(num_frames), 'kpts': [int(i) for i in kpts]}, f)
+
+    # Swap the finished entry in so readers never see a partial one
+    try:
+        os.replace(tmp_path, path)
+    except OSError:
+        # Another job already cached the same video
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        return path
+    print(f"Saved {len(frames)} keypoint entries to {path}")
+    return path
+
+
+def load_trajectories(cache_dir: str, key: str):
+    """
+    Loads cached keypoint trajectories, memory-mapped.
+
+    Args:
+        cache_dir: Root directory of the keypoint cache
+        key: Content hash of the video
+
+    Returns:
+        dict | None: frames, track_ids, keypoints arrays and the meta fields, or None on a cache miss
+
+    Raises:
+        ValueError: If `key` is not a content hash
+    """
+    path = cache_path(cache_dir, key)
+    if not os.path.isfile(os.path.join(path, 'meta.json')):
+        return None
+    with open(os.path.join(path, 'meta.json')) as f:
+        cached = json.load(f)
+    for name in ('frames', 'track_ids', 'keypoints'):
+        cached[name] = np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r')
+    return cached
+
+
+def rescore(cached: dict, body_mass: float, exercise_mass: float, exercise_type: str = "pullups",
+            up_angle: float = 120, down_angle: float = 150, displacement: float = 0.6) -> dict:
+    """
+    Rebuilds workout metrics from cached keypoint trajectories without running the pose model.
+
+    The whole angle time series is scored at once with the vectorized rep engine. Thresholds it does not
+    support fall back to replaying the trajectories through the same RepCounter state machine AIGym uses.
+    Either way the result matches what process_video would return with the same parameters.
+
+    Args:
+        cached: Trajectories returned by load_trajectories
+        body_mass: User's mass in kg
+        exercise_mass: Mass being lifted in exercise (in kg)
+        exercise_type: Type of exercise (default: "pullups")
+        up_angle: The angle (in degrees) at which the rep is in the 'up' phase.
+        down_angle: The angle (in degrees) at which the rep is in the 'down' phase.
+        displacement: Vertical displacement in meters (default: 0.6)
+
+    Returns:
+        dict: rep_count, avg_power, max_power, avg_power_per_kg and max_power_per_kg, as in process_video
+    """
+    kpts = cached['kpts']
+    frames = np.asarray(cached['frames'])
+    track_ids = np.asarray(cached['track_ids'])
+
+    rep_count = 0
+    avg_power = 0
+    max_power = 0
+    try:
+        frame_numbers, person_keys, angles = angle_series(frames, track_ids, cached['keypoints'], kpts)
+        scores = score_angles(angles, frame_numbers, exercise_type, up_angle, down_angle, fps=cached['fps'],
+                              exercise_mass=exercise_mass, displacement=displacement)
+        # Report the main athlete, picked the same way as RepCounter.primary
+        athlete = primary_index(scores['count'], angles, frame_numbers, person_keys)
+        if athlete is not None:
+            rep_count = int(scores['count'][athlete])
+            avg_power = float(scores['avg_power'][athlete])
+            max_power = float(scores['max_power'][athlete])
+    except ValueError:
+        counter = RepCounter(pose_type=exercise_type, up_angle=up_angle, down_angle=down_angle,
+                             exercise_mass=exercise_mass, displacement=displacement, fps=cached['fps'])
+        keypoints = np.asarray(cached['keypoints'][:, kpts])
+        for frame, track_id, k in zip(frames, track_ids, keypoints):
+            counter.frame_count = int(frame)
+            counter.update(int(track_id), list(k))
+
+        athlete = counter.primary()
+        if athlete is not None:
+            rep_count = athlete.count
+            avg_power = athlete.avg_power
+            max_power = athlete.max_power
+
+    return {
+        'rep_count': rep_count,
+        'avg_power': avg_power,
+        'max_power': max_power,
+        'avg_power_per_kg': avg_power / body_mass if body_mass > 0 else 0,
+        'max_power_per_kg': max_power / body_mass if body_mass > 0 else 0,
+    }
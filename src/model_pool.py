@@ -0,0 +1,58 @@
+import queue
+import time
+from contextlib import contextmanager
+import numpy as np
+from pathlib import Path
+import sys
+sys.path.append(str(Path(__file__).parent.parent))
+from src.workout_monitoring import load_gym
+
+
+class ModelPool:
+    """
+    Process-wide pool of warm AIGym instances.
+
+    Every instance loads the pose model once and is warmed with a dummy inference, so jobs that check one out
+    skip the model load and first-call setup. A checked-out instance is reset by process_video before use.
+
+    Attributes:
+        size (int): Number of instances in the pool.
+        load_time (float): Seconds it took to load and warm one instance, on average.
+
+    Examples:
+        >>> pool = ModelPool(size=2)
+        >>> with pool.checkout() as gym:
+        ...     metrics = process_video("workout.mp4", body_mass=70, exercise_mass=70, gym=gym)
+    """
+
+    def __init__(self, model_path: str = None, size: int = 1, warmup_shape: tuple = (480, 640, 3), **kwargs):
+        self.size = max(1, int(size))
+        self._idle = queue.Queue()
+
+        start = time.perf_counter()
+        for _ in range(self.size):
+            gym = load_gym(model_path, **kwargs)
+            self.warmup(gym, warmup_shape)
+            self._idle.put(gym)
+        self.load_time = (time.perf_counter() - start) / self.size
+        print(f"Model pool ready: {self.size} pose model(s), {self.load_time:.2f} s load and warm-up each")
+
+    @staticmethod
+    def warmup(gym, shape: tuple = (480, 640, 3)):
+        """Runs one dummy inference so lazy model and tracker setup happens now, then resets the instance."""
+        gym.model.track(source=np.zeros(shape, dtype=np.uint8), persist=True, classes=gym.CFG["classes"])
+        gym.reset()
+
+    @contextmanager
+    def checkout(self, timeout: float = None):
+        """
+        Borrows an instance for one job and returns it to the pool afterwards.
+
+        Blocks until an instance is free, or raises queue.Empty after `timeout` seconds.
+        """
+        gym = self._idle.get(timeout=timeout)
+        print(f"Checked out warm pose model, skipped ~{self.load_time:.2f} s of model loading")
+        try:
+            yield gym
+        finally:
+            self._idle.put(gym)
@@ -0,0 +1,205 @@
+import numpy as np
+
+
+def estimate_pose_angle(a, b, c):
+    """
+    Calculates the angle at keypoint `b` formed by keypoints `a`, `b` and `c`.
+
+    Same formula as `Annotator.estimate_pose_angle`, kept here so rep counting does not depend on the
+    plotting utilities. Computed in float64 so per-frame and vectorized (rep_engine) results agree.
+
+    Args:
+        a, b, c: Keypoints as (x, y, ...) sequences, arrays or tensors.
+
+    Returns:
+        (float): Angle in degrees between 0 and 180.
+    """
+    a, b, c = (np.asarray(p, dtype=np.float64) for p in (a, b, c))
+    radians = np.arctan2(c[1] - b[1], c[0] - b[0]) - np.arctan2(a[1] - b[1], a[0] - b[0])
+    angle = np.abs(radians * 180.0 / np.pi)
+    if angle > 180.0:
+        angle = 360 - angle
+    return angle
+
+
+class TrackState:
+    """
+    Rep and power state of one tracked person.
+
+    Attributes:
+        track_id (int): Tracker ID of the person.
+        count (int): Repetition count.
+        angle (float): Current angle of the tracked body part.
+        stage (str): Current exercise stage ('up', 'down', or '-').
+        start_frame (int): Frame number when the current movement started.
+        start_position (float): Starting Y position.
+        power_outputs (List[float]): Power output for each rep.
+        rep_durations (List[float]): Duration of each rep in seconds.
+        avg_power (float): Average power output.
+        max_power (float): Maximum power output.
+        first_seen (int): Frame number the person was first tracked.
+        last_seen (int): Frame number the person was last tracked.
+    """
+
+    __slots__ = ("track_id", "count", "angle", "stage", "start_frame", "start_position", "power_outputs",
+                 "rep_durations", "avg_power", "max_power", "first_seen", "last_seen")
+
+    def __init__(self, track_id: int, frame: int = 0):
+        self.track_id = track_id
+        self.count = 0
+        self.angle = 0
+        self.stage = "-"
+        self.start_frame = 0
+        self.start_position = 0
+        self.power_outputs = []
+        self.rep_durations = []
+        self.avg_power = 0
+        self.max_power = 0
+        self.first_seen = frame
+        self.last_seen = frame
+
+    def rank_key(self):
+        """Sort key picking the main athlete: most reps, then first seen, then lowest track ID."""
+        return (-self.count, self.first_seen, self.track_id)
+
+
+class RepCounter:
+    """
+    Counts repetitions and computes power output from joint angles, one frame at a time.
+
+    This is the rep/power state machine used by AIGym, kept free of any model so the same logic can replay
+    cached keypoint trajectories. State is kept per tracker ID. Tracks not seen for `track_ttl` frames are
+    evicted so memory stays bounded in long sessions; the best evicted track is kept for `primary`.
+
+    Attributes:
+        tracks (Dict[int, TrackState]): State of every live track, keyed by tracker ID.
+        retired (TrackState | None): Best track evicted so far, by TrackState.rank_key.
+        track_ttl (int): Frames a track may go unseen before it is evicted. Keep this above the tracker's own
+            lost-track buffer so an evicted ID can never come back.
+        pose_type (str | None): Exercise being tracked, e.g. 'pullups' or 'pushups'.
+        up_angle (float): Angle threshold for considering the 'up' position of an exercise.
+        down_angle (float): Angle threshold for considering the 'down' position of an exercise.
+        exercise_mass (float): User mass in kg.
+        displacement (float): Rep displacement in meters.
+        fps (float): Video FPS.
+        frame_count (int): Current frame number.
+
+    Examples:
+        >>> counter = RepCounter(pose_type="pullups", up_angle=120, down_angle=150)
+        >>> counter.frame_count += 1
+        >>> counter.update(track_id, [shoulder, elbow, wrist])
+        >>> counter.evict_stale()
+        >>> counter.primary().count
+    """
+
+    def __init__(self, pose_type: str = None, up_angle: float = 120.0, down_angle: float = 150.0,
+                 exercise_mass: float = 70.0, displacement: float = 0.6, fps: float = 30.0, track_ttl: int = 300):
+        self.pose_type = pose_type
+        self.up_angle = float(up_angle)  # Pose up predefined angle to consider up pose
+        self.down_angle = float(down_angle)  # Pose down predefined angle to consider down pose
+        self.exercise_mass = exercise_mass  # Exercise mass in kg
+        self.displacement = displacement  # Rep displacement in meters
+        self.fps = fps  # Video FPS
+        self.track_ttl = track_ttl  # Frames before an unseen track is evicted
+        self.reset_counters()
+
+    def reset_counters(self):
+        """Clears all per-person state and the frame counter."""
+        self.tracks = {}
+        self.retired = None
+        self.frame_count = 0  # Current frame number
+
+    def evict_stale(self):
+        """Evicts tracks that have not been seen for more than `track_ttl` frames."""
+        stale = [tid for tid, state in self.tracks.items() if self.frame_count - state.last_seen > self.track_ttl]
+        for tid in stale:
+            state = self.tracks.pop(tid)
+            if self.retired is None or state.rank_key() < self.retired.rank_key():
+                self.retired = state
+
+    def primary(self):
+        """Returns the state of the main athlete, live or evicted, or None if nobody was tracked."""
+        candidates = list(self.tracks.values())
+        if self.retired is not None:
+            candidates.append(self.retired)
+        return min(candidates, key=TrackState.rank_key, default=None)
+
+    def calculate_power(self, vertical_distance: float, time_taken: float):
+        """Calculate power output based on exercise mass, distance, and time."""
+        if time_taken <= 0:
+            return 0
+        g = 9.81  # m/s²
+        work = self.exercise_mass * g * vertical_distance
+        power = work / time_taken
+        return power
+
+    def update(self, track_id: int, kpts: list):
+        """
+        Updates the angle, stage, rep count and power of one person for the current frame.
+
+        Args:
+            track_id (int): Tracker ID of the person.
+            kpts (list): The three keypoints (x, y, conf) the exercise angle is measured on.
+
+        Returns:
+            (TrackState): Updated state of the person.
+        """
+        state = self.tracks.get(track_id)
+        if state is None:
+            state = self.tracks[track_id] = TrackState(track_id, self.frame_count)
+        state.last_seen = self.frame_count
+        state.angle = estimate_pose_angle(*kpts)
+
+        # Track movement for power calculation
+        if self.pose_type == 'pullups':
+            self.track_pullups(state, kpts)
+
+        elif self.pose_type == 'pushups':
+            self.track_pushups(state, kpts)
+        return state
+
+    def track_pullups(self, state: TrackState, kpts:list):
+        # Get shoulder position (kpts[0] should be shoulder joint)
+        shoulder_y = float(kpts[0][1])
+
+        if state.angle > self.down_angle and state.stage != "down":
+            # Starting position detected
+            state.start_frame = self.frame_count
+            state.start_position = shoulder_y
+            state.stage = "down"
+        elif state.angle < self.up_angle:
+            if state.stage == "down":
+                # Completed rep
+                if state.start_frame > 0:
+                    # Calculate duration in seconds using frame count
+                    frames_elapsed = self.frame_count - state.start_frame
+                    duration = frames_elapsed / self.fps
+
+                    # Calculate and store power and duration
+                    power = self.calculate_power(self.displacement, duration)
+                    state.power_outputs.append(power)
+                    state.rep_durations.append(duration)
+
+                    # Average and max power only change when a rep completes
+                    state.avg_power = np.mean(state.power_outputs)
+                    state.max_power = np.max(state.power_outputs)
+
+                state.count += 1
+            state.stage = "up"
+
+    def track_dips(self, state: TrackState, kpts:list):
+        pass
+
+    def track_pushups(self, state: TrackState, kpts:list):
+        if state.angle < self.down_angle:
+            if state.stage == "up":
+                state.count += 1
+            state.stage = "down"
+        elif state.angle > self.up_angle:
+            state.stage = "up"
+
+    def track_squats(self, state: TrackState, kpts:list):
+        pass
+
+    def track_situps(self, state: TrackState, kpts:list):
+        pass
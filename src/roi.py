@@ -0,0 +1,54 @@
+import numpy as np
+
+
+def box_iou(a, b) -> float:
+    """Intersection over union of two (x1, y1, x2, y2) boxes."""
+    iw = max(0.0, min(a[2], b[2]) - max(a[0], b[0]))
+    ih = max(0.0, min(a[3], b[3]) - max(a[1], b[1]))
+    inter = iw * ih
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def pad_box(box, shape: tuple, padding: float = 0.25, min_size: int = 64) -> tuple:
+    """
+    Grows a box by `padding` times its size on every side and clips it to the image.
+
+    Args:
+        box: (x1, y1, x2, y2) in pixels
+        shape: Shape of the image, (height, width, ...)
+        padding: Fraction of the box width/height added on each side
+        min_size: Minimum width and height of the result in pixels
+
+    Returns:
+        tuple: Integer (x1, y1, x2, y2) crop region
+    """
+    h, w = shape[:2]
+    x1, y1, x2, y2 = box
+    pad_x = max((x2 - x1) * padding, (min_size - (x2 - x1)) / 2)
+    pad_y = max((y2 - y1) * padding, (min_size - (y2 - y1)) / 2)
+    return (int(max(0, x1 - pad_x)), int(max(0, y1 - pad_y)),
+            int(min(w, np.ceil(x2 + pad_x))), int(min(h, np.ceil(y2 + pad_y))))
+
+
+def select_detection(boxes: np.ndarray, confs: np.ndarray, last_box=None, min_conf: float = 0.5):
+    """
+    Picks the detection of the followed athlete.
+
+    Prefers the detection overlapping the athlete's last box the most, then the most confident one.
+
+    Args:
+        boxes: (N, 4) detection boxes in frame coordinates
+        confs: (N,) detection confidences
+        last_box: Athlete's box in the previous frame, or None
+        min_conf: Detections below this confidence are ignored
+
+    Returns:
+        int | None: Index of the detection, or None if there is none
+    """
+    candidates = [i for i in range(len(boxes)) if confs[i] >= min_conf]
+    if not candidates:
+        return None
+    if last_box is None:
+        return max(candidates, key=lambda i: confs[i])
+    return max(candidates, key=lambda i: (box_iou(boxes[i], last_box), confs[i]))
@@ -0,0 +1,465 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+import cv2
+import numpy as np
+from pathlib import Path
+import sys
+sys.path.append(str(Path(__file__).parent.parent))
+from src.ai_gym import draw_workout_info
+from src.backends import resolve_backend
+from src.rep_counter import TrackState
+from src.video_pipeline import open_video_writer, close_video_writer, concat_videos, FFmpegReader
+from src.rep_engine import angle_series, score_angles, primary_index
+from src.keypoint_cache import video_hash, save_trajectories
+from src.workout_monitoring import load_gym, output_size
+
+
+def plan_segments(total_frames: int, num_segments: int, overlap: int) -> list:
+    """
+    Splits frames [0, total_frames) into contiguous segments.
+
+    Each segment also starts up to `overlap` frames early to warm up the tracker. Warm-up frames belong to the
+    previous segment and are only used to match track IDs across the boundary.
+
+    Returns:
+        list: (warmup_start, start, end) per segment; the last segment's end is None (read to the end of file)
+    """
+    num_segments = max(1, min(num_segments, total_frames // max(1, 2 * overlap) or 1))
+    bounds = np.linspace(0, total_frames, num_segments + 1).astype(int)
+    segments = []
+    for i in range(num_segments):
+        start = int(bounds[i])
+        end = int(bounds[i + 1]) if i < num_segments - 1 else None
+        segments.append((max(0, start - overlap), start, end))
+    return segments
+
+
+# Warm models lent to segment tasks in this process, see use_model_pool
+_model_pool = None
+
+
+def use_model_pool(pool):
+    """
+    Makes segment tasks run in this process borrow a warm pose model from `pool` (a ModelPool) instead of
+    loading their own. For long-lived worker processes that process_video_segmented is given as `executor`.
+    """
+    global _model_pool
+    _model_pool = pool
+
+
+def _init_segment_worker(threads: int):
+    """Limits the threads of a segment worker, so the workers share the cores instead of oversubscribing them."""
+    import torch
+    torch.set_num_threads(threads)
+
+
+def _open_segment(video_path: str, first_frame: int, size: tuple, fps: float) -> tuple:
+    """
+    Opens a video for reading from frame `first_frame`.
+
+    Decodes at `size` in ffmpeg when it is installed, as process_video does, and otherwise with
+    cv2.VideoCapture, whose frames still have to be resized.
+
+    Returns:
+        tuple: (reader with the cv2.VideoCapture interface, size to resize frames to or None)
+    """
+    if shutil.which('ffmpeg') is not None:
+        # Seek half a frame early, so rounding of the timestamps cannot skip the first frame
+        start_time = (first_frame - 0.5) / fps if first_frame > 0 else None
+        return FFmpegReader(video_path, size, start_time=start_time), None
+    cap = cv2.VideoCapture(video_path)
+    assert cap.isOpened(), "Error reading video file"
+    cap.set(cv2.CAP_PROP_POS_FRAMES, first_frame)
+    return cap, size
+
+
+def _read(reader, resize: tuple):
+    success, im0 = reader.read()
+    if success and resize is not None:
+        im0 = cv2.resize(im0, resize)
+    return success, im0
+
+
+def _process_segment(video_path: str, warmup_start: int, start: int, end: int, size: tuple, fps: float,
+                     backend: str = "pytorch", batch_size: int = 1, progress: tuple = None) -> dict:
+    """
+    Runs pose tracking over one segment in a worker process.
+
+    Warm-up frames are tracked like the frames of the segment; they are only used to match track IDs across the
+    boundary. Uses a warm model of the process's model pool if there is one, see use_model_pool.
+
+    Args:
+        progress: (shared dict, key) to store the number of frames read in, about every half second
+
+    Returns:
+        dict: frames (global 1-based frame numbers), track_ids and keypoints of every detection, including
+            warm-up frames, and the number of frames read
+    """
+    if _model_pool is not None:
+        with _model_pool.checkout() as gym:
+            gym.reset(record_keypoints=True, fps=fps, roi=False, keyframe_interval=1)
+            return _track(gym, video_path, warmup_start, end, size, fps, batch_size, progress)
+    gym = load_gym(backend=backend, record_keypoints=True, fps=fps)
+    return _track(gym, video_path, warmup_start, end, size, fps, batch_size, progress)
+
+
+def _track(gym, video_path: str, warmup_start: int, end: int, size: tuple, fps: float, batch_size: int,
+           progress: tuple) -> dict:
+    reader, resize = _open_segment(video_path, warmup_start, size, fps)
+    last_report = 0.0
+    try:
+        frame = warmup_start
+        frames = []
+        while end is None or frame < end:
+            success, im0 = _read(reader, resize)
+            if not success:
+                break
+            frame += 1
+            frames.append(im0)
+            if len(frames) >= batch_size:
+                gym.monitor_batch(frames, render=False)
+                frames = []
+                if progress is not None and time.time() - last_report >= 0.5:
+                    last_report = time.time()
+                    progress[0][progress[1]] = frame - warmup_start
+        if frames:
+            gym.monitor_batch(frames, render=False)
+    finally:
+        reader.release()
+
+    trajectory = gym.trajectory
+    return {
+        'frames': np.array([f for f, _, _ in trajectory], dtype=np.int64) + warmup_start,
+        'track_ids': np.array([t for _, t, _ in trajectory], dtype=np.int64),
+        'keypoints': np.stack([k for _, _, k in trajectory]) if trajectory else np.zeros((0, 17, 3), np.float32),
+        'frames_read': frame - warmup_start,
+    }
+
+
+def _render_segment(video_path: str, warmup_start: int, start: int, end: int, size: tuple, fps: float,
+                    segment_path: str, detections: tuple, overlay: dict, codec: str = "h264",
+                    preset: str = "veryfast", crf: int = 23) -> int:
+    """
+    Writes the annotated video of one segment in a worker process, encoded with the final codec.
+
+    Draws the stitched keypoints of every person and the rep/power overlay of the main athlete as of each
+    frame, so the segment videos only need to be concatenated. Decoding starts at `warmup_start`, like tracking
+    did, so frame numbers match those of the detections.
+
+    Args:
+        detections: (frames, keypoints) of the detections in the segment
+        overlay: rep_frames, power_outputs and rep_durations of the main athlete, its track ID as athlete,
+            exercise_mass and displacement; athlete is None if nobody was tracked
+
+    Returns:
+        int: Number of frames written
+    """
+    from ultralytics.utils.plotting import Annotator
+
+    det_frames, det_keypoints = detections
+    rep_frames, powers, durations = overlay['rep_frames'], overlay['power_outputs'], overlay['rep_durations']
+    kpts = [5, 7, 9]  # Keypoints drawn, as in process_video
+
+    reader, resize = _open_segment(video_path, warmup_start, size, fps)
+    writer = open_video_writer(segment_path, fps, size, codec=codec, preset=preset, crf=crf)
+    frame = warmup_start
+    written = 0
+    try:
+        while end is None or frame < end:
+            success, im0 = _read(reader, resize)
+            if not success:
+                break
+            frame += 1
+            if frame <= start:
+                continue  # Warm-up frames belong to the previous segment
+
+            people = det_keypoints[det_frames == frame]
+            if len(people):
+                annotator = Annotator(im0, line_width=2)
+                for k in people:
+                    im0 = annotator.draw_specific_points(k, kpts, radius=2)
+
+            reps = int(np.searchsorted(rep_frames, frame, side='right'))
+            if reps > 0 and len(powers) > 0:
+                state = TrackState(overlay['athlete'], frame)
+                state.count = reps
+                state.power_outputs = list(powers[:reps])
+                state.rep_durations = list(durations[:reps])
+                state.avg_power = float(np.mean(powers[:reps]))
+                state.max_power = float(np.max(powers[:reps]))
+                draw_workout_info(im0, state, overlay['exercise_mass'], overlay['displacement'])
+            writer.write(im0)
+            written += 1
+        if written:
+            writer.release()
+        else:
+            close_video_writer(writer)  # Nothing to encode, the segment is left out of the join
+    except BaseException:
+        close_video_writer(writer)
+        raise
+    finally:
+        reader.release()
+    return written
+
+
+def _match_tracks(prev: dict, cur: dict, overlap_frames: set, max_distance: float) -> dict:
+    """
+    Maps track IDs of `cur` to global IDs of `prev` by mean keypoint distance over the overlap frames.
+
+    Pairs are matched greedily from the closest; pairs further apart than `max_distance` pixels stay unmatched.
+    """
+    def by_track(seg, ids_key):
+        tracks = {}
+        for f, tid, k in zip(seg['frames'], seg[ids_key], seg['keypoints']):
+            if int(f) in overlap_frames:
+                tracks.setdefault(int(tid), {})[int(f)] = k[:, :2]
+        return tracks
+
+    prev_tracks, cur_tracks = by_track(prev, 'global_ids'), by_track(cur, 'track_ids')
+    pairs = []
+    for gid, prev_kpts in prev_tracks.items():
+        for tid, cur_kpts in cur_tracks.items():
+            common = prev_kpts.keys() & cur_kpts.keys()
+            if common:
+                dist = np.mean([np.linalg.norm(prev_kpts[f] - cur_kpts[f], axis=1).mean() for f in common])
+                pairs.append((dist, gid, tid))
+
+    mapping, used = {}, set()
+    for dist, gid, tid in sorted(pairs):
+        if dist <= max_distance and gid not in used and tid not in mapping:
+            mapping[tid] = gid
+            used.add(gid)
+    return mapping
+
+
+def stitch_segments(segments: list, results: list, max_distance: float = 50.0) -> tuple:
+    """
+    Joins per-segment detections into one trajectory with consistent track IDs.
+
+    Returns:
+        tuple: (frames, track_ids, keypoints) arrays over the whole video, without warm-up duplicates
+    """
+    next_id = 0
+    frames, track_ids, keypoints = [], [], []
+    prev = None
+    for (warmup_start, start, _), seg in zip(segments, results):
+        mapping = {}
+        if prev is not None:
+            mapping = _match_tracks(prev, seg, set(range(warmup_start + 1, start + 1)), max_distance)
+        for tid in np.unique(seg['track_ids']):
+            if int(tid) not in mapping:
+                mapping[int(tid)] = next_id
+                next_id += 1
+        next_id = max(next_id, max(mapping.values(), default=-1) + 1)
+        seg['global_ids'] = np.array([mapping[int(t)] for t in seg['track_ids']], dtype=np.int64)
+
+        # Warm-up frames are already covered by the previous segment
+        own = seg['frames'] > start
+        frames.append(seg['frames'][own])
+        track_ids.append(seg['global_ids'][own])
+        keypoints.append(seg['keypoints'][own])
+        prev = seg
+    return np.concatenate(frames), np.concatenate(track_ids), np.concatenate(keypoints)
+
+
+def process_video_segmented(video_path: str, body_mass: float, exercise_mass: float, exercise_type: str = "pullups",
+                            up_angle: float = 120, down_angle: float = 150, displacement: float = 0.6,
+                            workers: int = None, overlap: int = 30, render: bool = True, backend: str = "pytorch",
+                            batch_size: int = 1, max_match_distance: float = 50.0,
+                            keypoint_cache_dir: str = None, codec: str = "h264", preset: str = "veryfast",
+                            crf: int = 23, output_dir: str = None, executor=None, progress_callback=None,
+                            manager=None) -> dict:
+    """
+    Process a workout video in parallel time segments and return metrics.
+
+    The video is split into one segment per worker. Each segment is tracked in its own process, starting
+    `overlap` frames early to warm up the tracker. Track IDs are matched across segment boundaries on the
+    overlap frames. The joint-angle series of the whole video is then scored in one pass, so reps crossing
+    a boundary count exactly once. With `render`, the same workers then draw the keypoints and the rep/power
+    overlay of the main athlete on their segments and encode them with the final codec, and the segment videos
+    are concatenated without re-encoding. Each worker gets an equal share of the cores for torch.
+
+    Args:
+        video_path: Path to the video file
+        body_mass: User's mass in kg
+        exercise_mass: Mass being lifted in exercise (in kg)
+        exercise_type: Type of exercise (default: "pullups")
+        up_angle: The angle (in degrees) at which the rep is in the 'up' phase.
+        down_angle: The angle (in degrees) at which the rep is in the 'down' phase.
+        displacement: Vertical displacement in meters (default: 0.6)
+        workers: Number of worker processes and segments (default: number of CPUs)
+        overlap: Tracker warm-up frames before each segment (default: 30)
+        render: Write the annotated output video (default: True)
+        backend: Inference backend of the pose model (default: "pytorch")
+        batch_size: Frames per pose model call in each worker (default: 1)
+        max_match_distance: Maximum mean keypoint distance in pixels to match tracks across segments
+        keypoint_cache_dir: Save the stitched keypoint trajectories here for rescoring (default: None)
+        codec: Codec of the output video, as in process_video (default: "h264")
+        preset: libx264 preset of the "h264" codec (default: "veryfast")
+        crf: libx264 constant rate factor of the "h264" codec (default: 23)
+        output_dir: Directory to write the output video to, as in process_video (default: None)
+        executor: Process pool to run the segments on, e.g. long-lived workers with warm models registered with
+            use_model_pool. Segments queue up if it has fewer workers than segments (default: None, start
+            `workers` processes for this video)
+        progress_callback: Called as progress_callback(frames_processed, total_frames) about every half second
+            while the segments are tracked (default: None)
+        manager: multiprocessing Manager to share the progress of the segments with `executor`'s workers through,
+            e.g. a long-lived one next to the executor (default: None, start one for this video if there is a
+            progress_callback)
+
+    Returns:
+        dict: Same metrics as process_video
+    """
+    cap = cv2.VideoCapture(video_path)
+    assert cap.isOpened(), "Error reading video file"
+    w, h, fps, total_frames = (int(cap.get(x)) for x in (cv2.CAP_PROP_FRAME_WIDTH, cv2.CAP_PROP_FRAME_HEIGHT,
+                                                         cv2.CAP_PROP_FPS, cv2.CAP_PROP_FRAME_COUNT))
+    stream_fps = cap.get(cv2.CAP_PROP_FPS) or fps  # Exact frame rate, to seek to segment starts
+    cap.release()
+    size = output_size(w, h)
+
+    if executor is None:
+        # Benchmark once here rather than in every worker
+        backend = resolve_backend(backend)
+
+    workers = workers or os.cpu_count() or 1
+    segments = plan_segments(total_frames, workers, overlap)
+    print(f"Processing {total_frames} frames in {len(segments)} segments")
+
+    segment_dir = tempfile.mkdtemp() if render else None
+    output_path = None
+    context = multiprocessing.get_context("spawn")
+    own_executor = executor is None
+    if own_executor:
+        threads = max(1, (os.cpu_count() or 1) // len(segments))
+        executor = ProcessPoolExecutor(max_workers=len(segments), mp_context=context,
+                                       initializer=_init_segment_worker, initargs=(threads,))
+    # Frames read per segment, shared with the worker processes for progress reports
+    own_manager = manager is None and progress_callback is not None
+    if own_manager:
+        manager = context.Manager()
+    frames_read = manager.dict() if progress_callback is not None else None
+    try:
+        futures = [executor.submit(_process_segment, video_path, warmup_start, start, end, size, stream_fps,
+                                   backend, batch_size, (frames_read, i) if frames_read is not None else None)
+                   for i, (warmup_start, start, end) in enumerate(segments)]
+        results = _results(futures, progress_callback, frames_read, total_frames)
+
+        # Score the stitched angle series of the whole video at once
+        frames, track_ids, keypoints = stitch_segments(segments, results, max_match_distance)
+        frame_numbers, person_keys, angles = angle_series(frames, track_ids, keypoints, [5, 7, 9])
+        scores = score_angles(angles, frame_numbers, exercise_type, up_angle, down_angle, fps=fps,
+                              exercise_mass=exercise_mass, displacement=displacement)
+        athlete = primary_index(scores['count'], angles, frame_numbers, person_keys)
+
+        if render:
+            # Draw and encode the segments in parallel with the final codec, then join them without
+            # re-encoding
+            output_dir = output_dir or os.path.join(os.path.dirname(video_path), 'processed')
+            os.makedirs(output_dir, exist_ok=True)
+            output_path = os.path.join(output_dir, f"processed_{os.path.basename(video_path)}")
+            overlay = _overlay(scores, athlete, person_keys, exercise_mass, displacement)
+            segment_paths = [os.path.join(segment_dir, f"segment_{i}.mp4") for i in range(len(segments))]
+            futures = []
+            for (warmup_start, start, end), path in zip(segments, segment_paths):
+                own = (frames > start) & (frames <= end if end is not None else True)
+                futures.append(executor.submit(
+                    _render_segment, video_path, warmup_start, start, end, size, stream_fps, path,
+                    (frames[own], keypoints[own]), overlay, codec, preset, crf))
+            written = _results(futures)
+            _join_segments([path for path, n in zip(segment_paths, written) if n > 0], output_path, stream_fps,
+                           size)
+    finally:
+        if own_executor:
+            executor.shutdown(cancel_futures=True)
+        if own_manager:
+            manager.shutdown()
+        if segment_dir is not None:
+            shutil.rmtree(segment_dir, ignore_errors=True)
+
+    rep_count = int(scores['count'][athlete]) if athlete is not None else 0
+    avg_power = float(scores['avg_power'][athlete]) if athlete is not None else 0
+    max_power = float(scores['max_power'][athlete]) if athlete is not None else 0
+
+    key = None
+    if keypoint_cache_dir:
+        key = video_hash(video_path)
+        num_frames = sum(seg['frames_read'] for seg in results) - sum(start - w for w, start, _ in segments)
+        save_trajectories(keypoint_cache_dir, key, list(zip(frames.tolist(), track_ids.tolist(), keypoints)),
+                          fps=fps, num_frames=num_frames, kpts=[5, 7, 9])
+
+    return {
+        'rep_count': rep_count,
+        'avg_power': avg_power,
+        'max_power': max_power,
+        'avg_power_per_kg': avg_power / body_mass if body_mass > 0 else 0,
+        'max_power_per_kg': max_power / body_mass if body_mass > 0 else 0,
+        'processed_video_path': output_path,
+        'video_hash': key
+    }
+
+
+def _results(futures: list, progress_callback=None, frames_read=None, total_frames: int = 0) -> list:
+    """
+    Waits for the segment tasks and returns their results in order, reporting progress every half second.
+
+    Cancels the tasks that have not started yet as soon as one fails, and raises its error.
+    """
+    pending = set(futures)
+    while pending:
+        done, pending = wait(pending, timeout=0.5)
+        if any(future.exception() is not None for future in done):
+            for future in pending:
+                future.cancel()
+            break
+        if progress_callback is not None:
+            progress_callback(min(total_frames, sum(frames_read.values())), total_frames)
+    return [future.result() for future in futures]
+
+
+def _overlay(scores: dict, athlete, person_keys, exercise_mass: float, displacement: float) -> dict:
+    """Returns the rep/power overlay data of the main athlete for _render_segment."""
+    empty = np.zeros(0)
+    return {
+        'athlete': int(person_keys[athlete]) if athlete is not None else None,
+        'rep_frames': scores['rep_frames'][athlete] if athlete is not None else empty,
+        'power_outputs': scores['power_outputs'][athlete] if athlete is not None else empty,
+        'rep_durations': scores['rep_durations'][athlete] if athlete is not None else empty,
+        'exercise_mass': exercise_mass,
+        'displacement': displacement,
+    }
+
+
+def _join_segments(segment_paths: list, output_path: str, fps: float, size: tuple):
+    """
+    Concatenates the rendered segment videos into `output_path`.
+
+    Segments are joined with stream copy when ffmpeg is installed; otherwise they were written as mp4v by
+    OpenCV and are re-encoded into one file frame by frame.
+    """
+    if shutil.which('ffmpeg') is not None:
+        concat_videos(segment_paths, output_path)
+        return
+    writer = open_video_writer(output_path, fps, size, codec="mp4v")
+    for path in segment_paths:
+        cap = cv2.VideoCapture(path)
+        while True:
+            success, im0 = cap.read()
+            if not success:
+                break
+            writer.write(im0)
+        cap.release()
+    writer.release()
+
+
+if __name__ == "__main__":
+    # Example usage
+    root = Path(__file__).parent.parent
+    metrics = process_video_segmented(str(root / "data/pullups.mp4"), body_mass=63.0, exercise_mass=63.0,
+                                      exercise_type='pullups')
+    print(f"Reps: {metrics['rep_count']}")
+    print(f"Maximum Power: {metrics['max_power']:.1f} W")
@@ -0,0 +1,394 @@
+import os
+import queue
+import shutil
+import subprocess
+import tempfile
+import threading
+import cv2
+import numpy as np
+from pathlib import Path
+import sys
+sys.path.append(str(Path(__file__).parent.parent))
+from src.instrumentation import timer
+
+# Marks the end of a frame stream in the queues
+_END = None
+
+
+class FrameReader(threading.Thread):
+    """
+    Decodes and resizes video frames on a background thread.
+
+    Frames are pushed into a bounded queue, so decoding runs at most `queue_size` frames ahead of inference and
+    blocks (backpressure) when the consumer falls behind. Frames come out in decode order. `read` mirrors
+    `cv2.VideoCapture.read` so it can be used as a drop-in replacement in the processing loop.
+
+    Examples:
+        >>> reader = FrameReader(cv2.VideoCapture("workout.mp4"), size=(640, 480))
+        >>> reader.start()
+        >>> success, im0 = reader.read()
+    """
+
+    def __init__(self, cap, size: tuple = None, queue_size: int = 32):
+        super().__init__(daemon=True)
+        self.cap = cap
+        self.size = size  # (width, height) to resize to, or None to keep original frames
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.error = None
+        self._stop_event = threading.Event()
+        self._finished = False
+
+    def run(self):
+        try:
+            while not self._stop_event.is_set():
+                with timer("decode"):
+                    success, im0 = self.cap.read()
+                    if success and self.size is not None:
+                        im0 = cv2.resize(im0, self.size)
+                if not success:
+                    break
+                self._put(im0)
+        except Exception as e:
+            self.error = e
+        finally:
+            self._put(_END)
+
+    def _put(self, item):
+        # Block while the queue is full, but give up once the reader is stopped
+        while not self._stop_event.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def read(self):
+        """Returns the next decoded frame as (success, frame), like cv2.VideoCapture.read."""
+        if self._finished:
+            return False, None
+        im0 = self.queue.get()
+        if im0 is _END:
+            self._finished = True
+            if self.error is not None:
+                raise self.error
+            return False, None
+        return True, im0
+
+    def stop(self):
+        """Stops decoding and waits for the thread to exit."""
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
+
+
+def decimation_step(fps: float, target_fps: float = None) -> int:
+    """Returns N to keep every Nth frame so a video at `fps` is processed at about `target_fps` or less."""
+    if not target_fps or target_fps >= fps:
+        return 1
+    return max(1, int(np.ceil(fps / target_fps - 1e-6)))
+
+
+class DecimatedCapture:
+    """
+    Wraps a cv2.VideoCapture to return only every `step`th frame.
+
+    Skipped frames are grabbed but not retrieved, which saves their color conversion and copy.
+    """
+
+    def __init__(self, cap, step: int):
+        self.cap = cap
+        self.step = step
+
+    def read(self):
+        success, im0 = self.cap.read()
+        if success:
+            for _ in range(self.step - 1):
+                if not self.cap.grab():
+                    break
+        return success, im0
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def release(self):
+        self.cap.release()
+
+
+class FFmpegReader:
+    """
+    Decodes a video with ffmpeg straight to the target resolution and, optionally, a reduced frame rate.
+
+    Scaling and frame dropping happen in ffmpeg's filter graph, so full-resolution frames never reach Python
+    and dropped frames are never converted to BGR. Has the `read`/`isOpened`/`release` interface of
+    cv2.VideoCapture, so it can be wrapped by FrameReader.
+
+    Args:
+        path: Video path
+        size: (width, height) to decode to
+        step: Keep every `step`th frame (default: 1, keep all)
+        start_time: Seek to this many seconds into the video first; frames before it are decoded but dropped
+            (default: None, start at the beginning)
+
+    Examples:
+        >>> reader = FFmpegReader("workout.mp4", (640, 360), step=2)
+        >>> success, im0 = reader.read()
+    """
+
+    def __init__(self, path: str, size: tuple, step: int = 1, start_time: float = None):
+        self.path = path
+        self.size = size
+        self._frame_bytes = size[0] * size[1] * 3
+        video_filter = f"scale={size[0]}:{size[1]}"
+        if step > 1:
+            video_filter = f"select=not(mod(n\\,{step})),{video_filter}"
+        seek = ['-ss', f"{start_time:.6f}"] if start_time else []
+        command = [
+            'ffmpeg', '-loglevel', 'error', *seek, '-i', path, '-an', '-vf', video_filter, '-fps_mode', 'passthrough',
+            '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-'
+        ]
+        # Errors go to a file rather than a pipe nobody drains while decoding
+        self._stderr = tempfile.TemporaryFile()
+        self.process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=self._stderr,
+                                        bufsize=self._frame_bytes)
+        self._opened = True
+
+    def read(self):
+        """
+        Returns the next decoded frame as (success, frame), like cv2.VideoCapture.read.
+
+        Raises:
+            RuntimeError: At the end of the stream if ffmpeg failed, e.g. on an unreadable file or unsupported
+                codec, instead of reporting a clean end of the video
+        """
+        if not self._opened:
+            return False, None
+        im0 = np.empty((self.size[1], self.size[0], 3), dtype=np.uint8)
+        view = memoryview(im0).cast('B')
+        received = 0
+        while received < self._frame_bytes:
+            n = self.process.stdout.readinto(view[received:])
+            if not n:
+                self._finish()
+                return False, None
+            received += n
+        return True, im0
+
+    def _finish(self):
+        """Waits for ffmpeg after the last frame and raises if it exited with an error."""
+        self._opened = False
+        if self.process.wait() != 0:
+            raise RuntimeError(f"ffmpeg failed to decode {self.path} (exit code {self.process.returncode}): "
+                               f"{_tail(self._stderr)}")
+
+    def isOpened(self):
+        return self._opened
+
+    def release(self):
+        """Stops ffmpeg if it is still decoding."""
+        self._opened = False
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.stdout.close()
+        self.process.wait()
+        self._stderr.close()
+
+
+def _tail(log, limit: int = 2000) -> str:
+    """Returns the last `limit` characters written to a subprocess log file."""
+    log.seek(0)
+    return log.read().decode(errors='replace').strip()[-limit:]
+
+
+class FrameWriter(threading.Thread):
+    """
+    Encodes frames on a background thread.
+
+    Wraps a writer with a `write`/`release` interface (e.g. cv2.VideoWriter). `write` only enqueues the frame and
+    blocks when `queue_size` frames are already waiting, so encoding overlaps with inference without unbounded
+    memory growth. Frames are written in the order they were submitted.
+
+    Examples:
+        >>> writer = FrameWriter(cv2.VideoWriter("out.mp4", cv2.VideoWriter_fourcc(*"mp4v"), 30, (640, 480)))
+        >>> writer.start()
+        >>> writer.write(im0)
+        >>> writer.release()
+    """
+
+    def __init__(self, writer, queue_size: int = 32):
+        super().__init__(daemon=True)
+        self.writer = writer
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.error = None
+        self._discard = False
+
+    def run(self):
+        while True:
+            im0 = self.queue.get()
+            if im0 is _END:
+                break
+            if self.error is not None or self._discard:
+                continue  # Keep draining so producers never block on a dead writer
+            try:
+                with timer("encode"):
+                    self.writer.write(im0)
+            except Exception as e:
+                self.error = e
+
+    def write(self, im0):
+        """Queues a frame for encoding."""
+        if self.error is not None:
+            raise self.error
+        self.queue.put(im0)
+
+    def release(self):
+        """Flushes all queued frames and releases the underlying writer."""
+        if self.is_alive():
+            self.queue.put(_END)
+            self.join()
+        self.writer.release()
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        """Drops the queued frames, stops the thread and closes the underlying writer. Safe to call more than once."""
+        self._discard = True
+        if self.is_alive():
+            self.queue.put(_END)
+            self.join()
+        close_video_writer(self.writer)
+
+
+class FFmpegWriter:
+    """
+    Encodes frames to browser-ready H.264 MP4 in a single ffmpeg subprocess.
+
+    Raw BGR frames are piped to ffmpeg, which encodes them with libx264 in yuv420p and moves the index to the
+    front of the file (`+faststart`), so the video plays in browsers and can start playing while it downloads
+    without a second conversion pass. Has the same `write`/`release` interface as cv2.VideoWriter.
+
+    Args:
+        path: Output video path
+        fps: Frame rate of the video
+        size: (width, height) of the frames written
+        preset: libx264 preset, trades encode speed for file size (e.g. ultrafast, veryfast, medium)
+        crf: libx264 constant rate factor, 0-51, lower is better quality and larger files
+
+    Examples:
+        >>> writer = FFmpegWriter("out.mp4", 30, (640, 480), preset="veryfast", crf=23)
+        >>> writer.write(im0)
+        >>> writer.release()
+    """
+
+    def __init__(self, path: str, fps: float, size: tuple, preset: str = "veryfast", crf: int = 23):
+        self.path = path
+        self.size = size
+        command = [
+            'ffmpeg', '-y', '-loglevel', 'error',
+            '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f"{size[0]}x{size[1]}", '-r', str(fps), '-i', '-',
+            '-an', '-c:v', 'libx264', '-preset', preset, '-crf', str(crf),
+            '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2',  # yuv420p needs even dimensions
+            '-pix_fmt', 'yuv420p', '-movflags', '+faststart', path
+        ]
+        # Errors go to a file, a stderr pipe nobody drains while encoding can fill up and block ffmpeg
+        self._stderr = tempfile.TemporaryFile()
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=self._stderr)
+        self._closed = False
+
+    def write(self, im0):
+        """Sends one BGR frame of the configured size to the encoder."""
+        try:
+            self.process.stdin.write(np.ascontiguousarray(im0, dtype=np.uint8).tobytes())
+        except BrokenPipeError:
+            self.process.wait()
+            raise RuntimeError(f"ffmpeg exited early: {_tail(self._stderr)}")
+
+    def release(self):
+        """Finishes encoding and waits for ffmpeg to write the file."""
+        if self._closed:
+            return
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        returncode = self.process.wait()
+        error = _tail(self._stderr) if returncode != 0 else None
+        self.close()
+        if error is not None:
+            raise RuntimeError(f"ffmpeg failed to encode {self.path}: {error}")
+
+    def close(self):
+        """Stops ffmpeg without finishing the video, e.g. after a failure. Safe to call more than once."""
+        if self._closed:
+            return
+        self._closed = True
+        if self.process.poll() is None:
+            self.process.kill()
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        self.process.wait()
+        self._stderr.close()
+
+
+def close_video_writer(writer):
+    """
+    Closes a writer of open_video_writer or a FrameWriter without finishing the video, freeing its threads and
+    subprocesses. For cleanup after a failure; writers without a `close` are released.
+    """
+    close = getattr(writer, 'close', None)
+    if close is not None:
+        close()
+    else:
+        writer.release()
+
+
+def open_video_writer(path: str, fps: float, size: tuple, codec: str = "h264", preset: str = "veryfast",
+                      crf: int = 23):
+    """
+    Opens a writer for the processed video.
+
+    Args:
+        path: Output video path
+        fps: Frame rate of the video
+        size: (width, height) of the frames written
+        codec: "h264" for a browser-ready H.264 video encoded by ffmpeg, or "mp4v" for cv2.VideoWriter's
+            MPEG-4 Part 2 encoder. Falls back to "mp4v" if ffmpeg is not installed.
+        preset: libx264 preset for "h264"
+        crf: libx264 constant rate factor for "h264"
+
+    Returns:
+        FFmpegWriter | cv2.VideoWriter: Writer with a `write`/`release` interface
+    """
+    if codec == "h264":
+        if shutil.which('ffmpeg') is not None:
+            return FFmpegWriter(path, fps, size, preset=preset, crf=crf)
+        print("ffmpeg not found, writing mp4v video instead of H.264")
+    return cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, size)
+
+
+def concat_videos(paths: list, output_path: str):
+    """
+    Joins videos encoded with the same codec and settings into one, without re-encoding.
+
+    Uses ffmpeg's concat demuxer with stream copy, so joining costs about as much as copying the files. The
+    index of the output is moved to the front (`+faststart`) like FFmpegWriter's.
+
+    Raises:
+        RuntimeError: If ffmpeg fails
+    """
+    list_path = f"{output_path}.concat.txt"
+    with open(list_path, 'w') as f:
+        for path in paths:
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+    command = [
+        'ffmpeg', '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0', '-i', list_path,
+        '-c', 'copy', '-movflags', '+faststart', output_path
+    ]
+    try:
+        with tempfile.TemporaryFile() as log:
+            if subprocess.run(command, stdin=subprocess.DEVNULL, stderr=log).returncode != 0:
+                raise RuntimeError(f"ffmpeg failed to join {len(paths)} videos into {output_path}: {_tail(log)}")
+    finally:
+        os.remove(list_path)
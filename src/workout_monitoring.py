@@ -1,13 +1,54 @@
 import os
+import shutil
+import stat
+import time
 import cv2
 from pathlib import Path
 import sys
 # Add parent directory to path to import workout_monitoring
 sys.path.append(str(Path(__file__).parent.parent))
 from src.ai_gym import AIGym
+from src.video_pipeline import (FrameReader, FrameWriter, open_video_writer, close_video_writer, decimation_step,
+                                DecimatedCapture, FFmpegReader)
+from src.keypoint_cache import video_hash, save_trajectories
+from src.instrumentation import timer, observe
+
+def output_size(w: int, h: int) -> tuple:
+    """Returns the (width, height) frames are resized to: fit within 640x480, or 480x640 for portrait video."""
+    max_resolution = (640, 480)
+    if h > w:
+        max_resolution = (480, 640)
+        
+    scale = min(max_resolution[0] / w, max_resolution[1] / h)
+    return int(w * scale), int(h * scale)
+
+def load_gym(model_path: str = None, **kwargs) -> AIGym:
+    """
+    Load an AIGym with the pose model and the keypoints used for workout monitoring.
+
+    Args:
+        model_path: Path to the pose model (default: model/yolo11n-pose.pt in the repo root)
+        **kwargs: Additional AIGym settings, e.g. pose_type, up_angle, down_angle, exercise_mass, fps
+    
+    Returns:
+        AIGym: Ready to monitor frames
+    """
+    root = Path(__file__).parent.parent
+    return AIGym(
+        show=True,
+        kpts=[5, 7, 9],  # Left shoulder, left elbow, left wrist
+        lw=2,
+        model=model_path or f"{str(root)}/model/yolo11n-pose.pt",
+        **kwargs
+    )
 
 def process_video(video_path: str, body_mass: float, exercise_mass: float, exercise_type: str = "pullups",
-                   up_angle: float = 120, down_angle: float = 150, displacement: float = 0.6, is_display:bool=False) -> dict:
+                   up_angle: float = 120, down_angle: float = 150, displacement: float = 0.6, is_display:bool=False,
+                   batch_size: int = 1, pipelined: bool = True, queue_size: int = 32, render: bool = True,
+                   keypoint_cache_dir: str = None, gym: AIGym = None, backend: str = "pytorch",
+                   progress_callback=None, content_hash=None, codec: str = "h264", preset: str = "veryfast",
+                   crf: int = 23, target_fps: float = None, decoder: str = "ffmpeg", roi: bool = False,
+                   keyframe_interval: int = 1, output_dir: str = None) -> dict:
     """
     Process a workout video and return metrics.
     
@@ -20,81 +61,177 @@ def process_video(video_path: str, body_mass: float, exercise_mass: float, exerc
         down_angle: The angle (in degrees) at which the rep is in the 'down' phase.
         displacement: Vertical displacement in meters (default: 0.6)
         is_display: Display output image or not (default: False).
+        batch_size: Number of frames decoded ahead and sent to the pose model in one call (default: 1).
+        pipelined: Decode and encode on background threads so they overlap with inference (default: True).
+        queue_size: Maximum number of frames buffered between the pipeline stages (default: 32).
+        render: Annotate frames and write the processed video. When False only metrics are computed and
+            no video is written (default: True).
+        keypoint_cache_dir: Directory to save the per-frame keypoint trajectories to, keyed by the content
+            hash of the video, so the video can be re-scored later without the pose model (default: None).
+        gym: Already loaded AIGym to reuse, e.g. from a ModelPool. It is reset and reconfigured for this
+            video instead of loading the pose model again (default: None).
+        backend: Inference backend used when loading the pose model: "pytorch", "onnx", "openvino", or "auto"
+            to benchmark the available ones and pick the fastest (default: "pytorch").
+        progress_callback: Called as progress_callback(frames_processed, total_frames) after every batch of
+            frames; total_frames is 0 if the container does not report a frame count (default: None).
+        content_hash: Callable returning the content hash of the video, for a video_path that cannot be read
+            twice such as a named pipe; called after processing (default: None, hash the file at video_path).
+        codec: "h264" to encode the processed video with ffmpeg in one pass, browser-ready and with
+            +faststart, or "mp4v" for OpenCV's encoder (default: "h264").
+        preset: libx264 preset of the "h264" codec, faster presets give larger files (default: "veryfast").
+        crf: libx264 constant rate factor of the "h264" codec, lower is better quality (default: 23).
+        target_fps: Process only every Nth frame so at most this many frames per second are processed. The
+            frame rate used for power timing and of the processed video is reduced to match (default: None,
+            process every frame).
+        decoder: "ffmpeg" to decode straight to the processing resolution and frame rate in ffmpeg, or
+            "opencv" to decode full frames with cv2.VideoCapture and resize them. Falls back to "opencv" if
+            ffmpeg is not installed or video_path is a named pipe, which can only be read once (default: "ffmpeg").
+        roi: Follow a single athlete and run the pose model on a crop around them at a smaller input size,
+            see AIGym.monitor_roi. Only for videos with one athlete (default: False).
+        keyframe_interval: Run the pose model at most every this many frames and propagate keypoints with
+            optical flow in between, see AIGym.monitor_propagated. 1 runs it on every frame (default: 1).
+        output_dir: Directory to write the processed video to. Give each job its own when several may process
+            the same file at once (default: None, a 'processed' directory next to the video).
     
     Returns:
         dict: Dictionary containing workout metrics:
             - rep_count: Number of repetitions
             - avg_power: Average power output in Watts
             - max_power: Maximum power output in Watts
+            - processed_video_path: Path to the annotated video, or None when render is False
+            - video_hash: Content hash of the video, or None when keypoint_cache_dir is not set
     """
+    started = time.perf_counter()
     cap = cv2.VideoCapture(video_path)
     assert cap.isOpened(), "Error reading video file"
     w, h, fps = (int(cap.get(x)) for x in (cv2.CAP_PROP_FRAME_WIDTH, cv2.CAP_PROP_FRAME_HEIGHT, cv2.CAP_PROP_FPS))
+    total_frames = max(0, int(cap.get(cv2.CAP_PROP_FRAME_COUNT)))
     print("Original resolution:", w, h)
-    max_resolution = (640, 480)
-    if h > w:
-        max_resolution = (480, 640)
-        
-    scale = min(max_resolution[0] / w, max_resolution[1] / h)
-    new_w = int(w * scale)
-    new_h = int(h * scale)
+    new_w, new_h = output_size(w, h)
     print("New resolution:", new_w, new_h)
 
-    # Create output directory if it doesn't exist
-    output_dir = os.path.join(os.path.dirname(video_path), 'processed')
-    os.makedirs(output_dir, exist_ok=True)
-    
-    # Create output video writer
-    output_path = os.path.join(output_dir, f"processed_{os.path.basename(video_path)}")
-    video_writer = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (new_w, new_h))
+    # Keep every Nth frame, timing in the rest of the pipeline uses the reduced frame rate
+    step = decimation_step(fps, target_fps)
+    if step > 1:
+        fps = fps / step
+        total_frames = -(-total_frames // step)
+        print(f"Processing every {step} frames at {fps:.1f} fps")
 
-    # Initialize AIGym
-    root = Path(__file__).parent.parent
-    gym = AIGym(
-        show=True,
-        kpts=[5, 7, 9],  # Left shoulder, left elbow, left wrist
-        lw=2,
-        up_angle=up_angle,
-        down_angle=down_angle,
-        pose_type=exercise_type,
-        model=f"{str(root)}/model/yolo11n-pose.pt",
-        exercise_mass=exercise_mass,
-        displacement=displacement,
-        fps=fps
-    )
-
-    rep_count = 0
-    avg_power = 0
-    max_power = 0
+    # Decode at the processing resolution and frame rate, instead of resizing full frames in Python
+    resize = (new_w, new_h)
+    if decoder == "ffmpeg" and shutil.which('ffmpeg') is not None and not stat.S_ISFIFO(os.stat(video_path).st_mode):
+        cap.release()
+        cap = FFmpegReader(video_path, (new_w, new_h), step=step)
+        resize = None
+    elif step > 1:
+        cap = DecimatedCapture(cap, step)
 
-    while cap.isOpened():
-        success, im0 = cap.read()
-        if not success:
-            break
+    output_path = None
+    video_writer = None
+    reader = cap
+    completed = False
+    try:
+        if render:
+            # Create output directory if it doesn't exist
+            output_dir = output_dir or os.path.join(os.path.dirname(video_path), 'processed')
+            os.makedirs(output_dir, exist_ok=True)
         
-        # resize video to 480p
-        im0 = cv2.resize(im0, (new_w, new_h))
+            # Create output video writer
+            output_path = os.path.join(output_dir, f"processed_{os.path.basename(video_path)}")
+            video_writer = open_video_writer(output_path, fps, (new_w, new_h), codec=codec, preset=preset, crf=crf)
 
-        # Process frame with AIGym to detect pose and calculate power
-        im0 = gym.monitor(im0, is_display)
-        video_writer.write(im0)
+        # Initialize AIGym, or reconfigure a warm one checked out from a model pool
+        gym_settings = dict(
+            up_angle=up_angle,
+            down_angle=down_angle,
+            pose_type=exercise_type,
+            exercise_mass=exercise_mass,
+            displacement=displacement,
+            fps=fps,
+            record_keypoints=keypoint_cache_dir is not None,
+            roi=roi,
+            keyframe_interval=keyframe_interval
+        )
+        if gym is None:
+            gym = load_gym(backend=backend, **gym_settings)
+        else:
+            gym.reset(**gym_settings)
 
-        # Update metrics if available        
-        if hasattr(gym, 'count') and len(gym.count) > 0:
-            rep_count = gym.count[0]
-        
-        if hasattr(gym, 'avg_power') and len(gym.avg_power) > 0:
-            avg_power = gym.avg_power[0]
-        
-        if hasattr(gym, 'max_power') and len(gym.max_power) > 0:
-            max_power = gym.max_power[0]
+        # Decode and encode on their own threads, connected to inference by bounded queues
+        if pipelined:
+            reader = FrameReader(cap, size=resize, queue_size=queue_size)
+            reader.start()
+            if render:
+                video_writer = FrameWriter(video_writer, queue_size=queue_size)
+                video_writer.start()
+
+        # With pipelining the main loop only waits on the decode and encode threads, which time the work itself
+        decode_stage, encode_stage = ("decode_wait", "encode_wait") if pipelined else ("decode", "encode")
+        batch_size = max(1, int(batch_size))
+        stop = False
+        # Read until the reader runs out of frames: an ffmpeg decoder closes at EOF while the frames it decoded
+        # last are still queued in the FrameReader
+        while not stop:
+            # Decode up to batch_size frames ahead
+            frames = []
+            while len(frames) < batch_size:
+                with timer(decode_stage):
+                    success, im0 = reader.read()
+                    # resize video to 480p
+                    if success and not pipelined and resize is not None:
+                        im0 = cv2.resize(im0, resize)
+                if not success:
+                    stop = True
+                    break
+                frames.append(im0)
+
+            if not frames:
+                break
+
+            # Process frames with AIGym to detect pose and calculate power
+            if batch_size == 1:
+                frames = [gym.monitor(frames[0], is_display, render)]
+            else:
+                frames = gym.monitor_batch(frames, is_display, render)
+            if render:
+                for im0 in frames:
+                    with timer(encode_stage):
+                        video_writer.write(im0)
+            if progress_callback is not None:
+                progress_callback(gym.frame_count, total_frames)
+
+            if cv2.waitKey(1) & 0xFF == ord('q'):
+                break
+
+        if render:
+            video_writer.release()
+        completed = True
+    finally:
+        # Stop the decode and encode threads and their subprocesses also when processing fails, so long-lived
+        # workers do not leak them
+        cv2.destroyAllWindows()
+        if reader is not cap:
+            reader.stop()
+        cap.release()
+        if video_writer is not None and not completed:
+            close_video_writer(video_writer)
+
+    # Report metrics of the main athlete
+    rep_count = 0
+    avg_power = 0
+    max_power = 0
+    athlete = gym.primary()
+    if athlete is not None:
+        rep_count = athlete.count
+        avg_power = athlete.avg_power
+        max_power = athlete.max_power
 
-        if cv2.waitKey(1) & 0xFF == ord('q'):
-            break
+    key = None
+    if keypoint_cache_dir is not None:
+        key = content_hash() if content_hash is not None else video_hash(video_path)
+        save_trajectories(keypoint_cache_dir, key, gym.trajectory, fps=fps, num_frames=gym.frame_count, kpts=gym.kpts)
 
-    cv2.destroyAllWindows()
-    video_writer.release()
-    cap.release()
+    observe("process_video", time.perf_counter() - started)
 
     return {
         'rep_count': rep_count,
@@ -102,7 +239,8 @@ def process_video(video_path: str, body_mass: float, exercise_mass: float, exerc
         'max_power': max_power,
         'avg_power_per_kg': avg_power / body_mass if body_mass > 0 else 0,
         'max_power_per_kg': max_power / body_mass if body_mass > 0 else 0,
-        'processed_video_path': output_path
+        'processed_video_path': output_path,
+        'video_hash': key
     }
 
 if __name__ == "__main__":
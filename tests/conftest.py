@@ -0,0 +1,37 @@
+import pytest
+from pathlib import Path
+import sys
+sys.path.append(str(Path(__file__).parent.parent))
+
+
+@pytest.fixture
+def mongo():
+    """Connects the models to a fresh in-memory MongoDB for one test."""
+    pytest.importorskip("flask_mongoengine", exc_type=ImportError)
+    mongomock = pytest.importorskip("mongomock")
+    from mongoengine import connect, disconnect
+    from leaderboard.database.mongodb import ensure_indexes
+
+    connect(db='aitrainer_test', host='mongodb://localhost', mongo_client_class=mongomock.MongoClient)
+    ensure_indexes()
+    yield
+    disconnect()
+
+
+@pytest.fixture
+def user(mongo):
+    from leaderboard.database.mongodb import User
+    return User(username='athlete', email='athlete@example.com').save()
+
+
+@pytest.fixture
+def make_workout(user):
+    """Returns a factory of unsaved workouts of `user`, with zero metrics unless given."""
+    from leaderboard.database.mongodb import Workout
+
+    def make(**fields):
+        fields = dict(dict(user=user, body_mass=70, exercise_mass=70, exercise_type='pullups', rep_count=0,
+                           avg_power=0, max_power=0, avg_power_per_kg=0, max_power_per_kg=0), **fields)
+        return Workout(**fields)
+
+    return make
@@ -0,0 +1,45 @@
+from pathlib import Path
+import numpy as np
+import pytest
+
+cv2 = pytest.importorskip("cv2")
+pytest.importorskip("ultralytics")
+from ultralytics.utils import ASSETS
+from src.model_pool import ModelPool
+from src.workout_monitoring import load_gym
+
+MODEL = Path(__file__).parent.parent / "model/yolo11n-pose.pt"
+
+pytestmark = pytest.mark.skipif(not MODEL.exists(), reason="pose model is not downloaded")
+
+
+def roi_trajectory(gym, frames):
+    gym.reset(roi=True, record_keypoints=True, keyframe_interval=1)
+    for im0 in frames:
+        gym.monitor(im0, render=False)
+    return gym.trajectory
+
+
+def test_roi_on_warmed_model_matches_fresh_model():
+    # A scene with people, so the crop path runs after the first full-frame detection
+    frames = [cv2.imread(str(ASSETS / "bus.jpg"))] * 4
+    fresh = load_gym(str(MODEL))
+    warmed = load_gym(str(MODEL))
+    ModelPool.warmup(warmed)
+
+    expected, actual = roi_trajectory(fresh, frames), roi_trajectory(warmed, frames)
+    assert len(expected) == len(frames)
+    assert [(f, t) for f, t, _ in actual] == [(f, t) for f, t, _ in expected]
+    for (_, _, k_actual), (_, _, k_expected) in zip(actual, expected):
+        np.testing.assert_allclose(k_actual, k_expected, atol=1e-3)
+
+
+def test_tracking_still_works_after_roi():
+    frames = [cv2.imread(str(ASSETS / "bus.jpg"))] * 2
+    gym = load_gym(str(MODEL))
+    ModelPool.warmup(gym)
+    roi_trajectory(gym, frames)
+
+    gym.reset(roi=False, record_keypoints=True)
+    gym.monitor(frames[0], render=False)
+    assert gym.trajectory, "the tracker callbacks must be restored after ROI inference"
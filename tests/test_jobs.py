@@ -0,0 +1,47 @@
+import pytest
+
+pytest.importorskip("cv2")
+pytest.importorskip("flask_mongoengine")
+from leaderboard.jobs import validate_payload, RESCORE_FIELDS
+
+VIDEO_HASH = "0" * 64
+
+
+def payload(**overrides):
+    data = {'workout_id': 'w1', 'video_url': 'gs://bucket/videos/v.mp4', 'body_mass': 70, 'exercise_mass': 20,
+            'exercise_type': 'pullups'}
+    data.update(overrides)
+    return data
+
+
+def test_valid_payloads():
+    assert validate_payload(payload()) is None
+    assert validate_payload(payload(body_mass="70.5", batch_size="8", segments=4, target_fps=0)) is None
+    assert validate_payload(payload(render="false", roi=True)) is None
+    rescore = {'video_hash': VIDEO_HASH, 'body_mass': 70, 'exercise_mass': 0, 'exercise_type': 'pullups'}
+    assert validate_payload(rescore, RESCORE_FIELDS) is None
+
+
+@pytest.mark.parametrize("overrides, error", [
+    ({'exercise_type': 'juggling'}, "Unknown exercise type"),
+    ({'body_mass': 'heavy'}, "body_mass"),
+    ({'body_mass': 0}, "body_mass"),
+    ({'body_mass': float('nan')}, "body_mass"),
+    ({'exercise_mass': None}, "exercise_mass"),
+    ({'render': 'false!'}, "render"),
+    ({'roi': 'no'}, "roi"),
+    ({'batch_size': 2.5}, "batch_size"),
+    ({'segments': 0}, "segments"),
+    ({'keyframe_interval': True}, "keyframe_interval"),
+    ({'target_fps': 'fast'}, "target_fps"),
+    ({'video_hash': '../../etc'}, "video_hash"),
+])
+def test_invalid_payloads(overrides, error):
+    assert error in validate_payload(payload(**overrides))
+
+
+def test_rescore_requires_a_valid_hash():
+    data = {'video_hash': '../cache', 'body_mass': 70, 'exercise_mass': 0, 'exercise_type': 'pullups'}
+    assert "video_hash" in validate_payload(data, RESCORE_FIELDS)
+    del data['video_hash']
+    assert "Missing required field: video_hash" == validate_payload(data, RESCORE_FIELDS)
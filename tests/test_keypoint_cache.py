@@ -0,0 +1,28 @@
+import hashlib
+import json
+import numpy as np
+import pytest
+from src.keypoint_cache import save_trajectories, load_trajectories, is_video_hash
+
+
+def test_round_trip(tmp_path):
+    key = hashlib.sha256(b"video").hexdigest()
+    keypoints = np.random.rand(17, 3).astype(np.float32)
+    save_trajectories(str(tmp_path), key, [(1, 3, keypoints)], fps=30, num_frames=1, kpts=[5, 7, 9])
+    cached = load_trajectories(str(tmp_path), key)
+    assert cached['fps'] == 30 and list(cached['frames']) == [1] and list(cached['track_ids']) == [3]
+    np.testing.assert_array_equal(cached['keypoints'][0], keypoints)
+
+
+@pytest.mark.parametrize("key", ["../../etc", "/etc", "A" * 64, "0" * 63, "0" * 64 + "/..", "", None, 123])
+def test_rejects_keys_that_are_not_hashes(tmp_path, key):
+    assert not is_video_hash(key)
+    with pytest.raises(ValueError):
+        load_trajectories(str(tmp_path / "cache"), key)
+
+
+def test_cannot_read_outside_cache(tmp_path):
+    # A meta.json outside the cache directory must not be reachable through the key
+    (tmp_path / "meta.json").write_text(json.dumps({'fps': 30}))
+    with pytest.raises(ValueError):
+        load_trajectories(str(tmp_path / "cache"), "..")
@@ -0,0 +1,29 @@
+import pytest
+
+pytest.importorskip("flask_mongoengine", exc_type=ImportError)
+pytest.importorskip("mongomock")
+from mongoengine import NotUniqueError
+from leaderboard.database.mongodb import Workout, ensure_indexes
+
+
+def test_one_workout_per_direct_upload(make_workout):
+    make_workout(upload_id='gs://bucket/videos/upload.mp4').save()
+    with pytest.raises(NotUniqueError):
+        make_workout(upload_id='gs://bucket/videos/upload.mp4').save()
+    assert Workout.objects(upload_id='gs://bucket/videos/upload.mp4').count() == 1
+
+
+def test_workouts_without_upload_share_source_video(make_workout):
+    # Form uploads of the same video share the stored original and have no upload_id
+    make_workout(source_video_path='gs://bucket/videos/sha256/a.mp4').save()
+    make_workout(source_video_path='gs://bucket/videos/sha256/a.mp4').save()
+    assert Workout.objects(source_video_path='gs://bucket/videos/sha256/a.mp4').count() == 2
+
+
+def test_ensure_indexes_drops_obsolete_indexes(mongo):
+    collection = Workout._get_collection()
+    collection.create_index([('is_public', 1), ('status', 1), ('exercise_type', 1)])
+    ensure_indexes()
+    indexes = collection.index_information()
+    assert 'is_public_1_status_1_exercise_type_1' not in indexes
+    assert 'is_public_1_status_1' in indexes
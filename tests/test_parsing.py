@@ -0,0 +1,16 @@
+import pytest
+from leaderboard.parsing import parse_bool
+
+
+@pytest.mark.parametrize("value, expected", [
+    (True, True), (False, False), ("true", True), ("False", False), (" TRUE ", True),
+    ("1", True), ("0", False), (1, True), (0, False),
+])
+def test_parse_bool(value, expected):
+    assert parse_bool(value) is expected
+
+
+@pytest.mark.parametrize("value", ["no", "yes", "", "2", 2, 1.0, None, [], {}])
+def test_parse_bool_rejects(value):
+    with pytest.raises(ValueError):
+        parse_bool(value)
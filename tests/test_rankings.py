@@ -0,0 +1,98 @@
+import pytest
+
+pytest.importorskip("flask_mongoengine", exc_type=ImportError)
+pytest.importorskip("mongomock")
+from leaderboard.database.mongodb import LeaderboardEntry
+from leaderboard.rankings import (RANKED_METRICS, ALL_EXERCISES, update_rankings, remove_rankings, ranking_page,
+                                  rebuild_rankings, verify_rankings, top_workouts)
+
+
+@pytest.fixture
+def ranked(make_workout):
+    """Returns a factory of saved, public, complete workouts with their rankings recorded."""
+    def make(power: float = 10.0, exercise_type: str = 'pullups', **fields):
+        workout = make_workout(exercise_type=exercise_type, max_power_per_kg=power, avg_power_per_kg=power / 2,
+                               rep_count=5, is_public=True, status='complete', **fields).save()
+        update_rankings(workout)
+        return workout
+    return make
+
+
+def entries(workout) -> dict:
+    return {(e.exercise_type, e.metric): e.value for e in LeaderboardEntry.objects(workout=workout.id)}
+
+
+def test_record_in_exercise_and_overall_rankings(ranked):
+    workout = ranked(power=12.5)
+    assert entries(workout) == {(exercise_type, metric): value
+                                for exercise_type in ('pullups', ALL_EXERCISES)
+                                for metric, value in zip(RANKED_METRICS, (12.5, 6.25, 5))}
+    assert verify_rankings() == []
+
+
+def test_update_moves_and_removes_entries(ranked):
+    workout = ranked()
+    workout.update(exercise_type='pushups', max_power_per_kg=20.0)
+    workout.reload()
+    update_rankings(workout)
+    assert {exercise_type for exercise_type, _ in entries(workout)} == {'pushups', ALL_EXERCISES}
+    assert entries(workout)[(ALL_EXERCISES, 'max_power_per_kg')] == 20.0
+
+    workout.update(is_public=False)
+    workout.reload()
+    update_rankings(workout)
+    assert entries(workout) == {}
+    assert verify_rankings() == []
+
+
+def test_unranked_workout_has_no_entries(make_workout):
+    workout = make_workout(is_public=True, status='processing').save()
+    update_rankings(workout)
+    assert entries(workout) == {}
+
+
+def test_remove_rankings(ranked):
+    kept, removed = ranked(power=5), ranked(power=8)
+    removed.delete()
+    remove_rankings(removed)
+    assert entries(removed) == {}
+    assert len(entries(kept)) == 2 * len(RANKED_METRICS)
+    assert verify_rankings() == []
+
+
+def test_rebuild_matches_incremental_updates(ranked):
+    workouts = [ranked(power=p, exercise_type=e) for p, e in ((3, 'pullups'), (7, 'pushups'), (5, 'pullups'))]
+    incremental = {w.id: entries(w) for w in workouts}
+    assert rebuild_rankings() == len(workouts) * 2 * len(RANKED_METRICS)
+    assert {w.id: entries(w) for w in workouts} == incremental
+
+
+def test_verify_reports_stale_entries(ranked):
+    workout = ranked(power=9)
+    LeaderboardEntry.objects(workout=workout.id, exercise_type='pullups', metric='max_power_per_kg').update_one(
+        set__value=1.0)
+    assert verify_rankings() == ["pullups/max_power_per_kg: 0 missing, 0 extra, 1 stale of 1 entries"]
+    rebuild_rankings()
+    assert verify_rankings() == []
+
+
+def test_pages_split_ties_on_workout_id(ranked):
+    # Ties on value are ordered by workout id, so a page boundary in the middle of a tie skips nothing
+    workouts = [ranked(power=p) for p in (9, 7, 7, 7, 7, 7, 3)]
+    expected = [workouts[0].id] + sorted(w.id for w in workouts[1:6]) + [workouts[6].id]
+
+    seen, ranks, cursor = [], [], None
+    while True:
+        page, first_rank, cursor = ranking_page('pullups', 'max_power_per_kg', 2, cursor)
+        seen += [w.id for w in page]
+        ranks.append(first_rank)
+        if cursor is None:
+            break
+    assert seen == expected
+    assert ranks == [1, 3, 5, 7]
+    assert [w.id for w in top_workouts('pullups', 'max_power_per_kg', 3)] == expected[:3]
+
+
+def test_invalid_cursor(mongo):
+    with pytest.raises(ValueError):
+        ranking_page('pullups', 'max_power_per_kg', 2, 'not-a-cursor')
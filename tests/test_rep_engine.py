@@ -0,0 +1,126 @@
+import numpy as np
+import pytest
+from src.config import exercise_settings
+from src.rep_counter import estimate_pose_angle
+from src.rep_engine import (check_parity, score_angles, replay_angles, pose_angles, angle_series, primary_index,
+                            REP_TRANSITIONS)
+
+EXERCISES = sorted(exercise_settings)
+
+
+def assert_parity(angles, frame_numbers, pose_type, up_angle, down_angle, **kwargs):
+    """Scores the series with the vectorized engine and the per-frame state machine and compares them."""
+    fast = score_angles(angles, frame_numbers, pose_type, up_angle, down_angle, **kwargs)
+    slow = replay_angles(angles, frame_numbers, pose_type, up_angle, down_angle, **kwargs)
+    np.testing.assert_array_equal(fast['count'], slow['count'])
+    np.testing.assert_allclose(fast['avg_power'], slow['avg_power'])
+    np.testing.assert_allclose(fast['max_power'], slow['max_power'])
+    for name in ('power_outputs', 'rep_durations'):
+        assert len(fast[name]) == len(slow[name])
+        for f, s in zip(fast[name], slow[name]):
+            np.testing.assert_allclose(f, s)
+    return fast
+
+
+def random_walk(rng, num_frames, num_persons, dropout):
+    angles = np.clip(120 + np.cumsum(rng.normal(0, 12, (num_frames, num_persons)), axis=0), 60, 180)
+    angles[rng.random(angles.shape) < dropout] = np.nan
+    frame_numbers = np.sort(rng.choice(np.arange(1, 2 * num_frames), num_frames, replace=False))
+    return angles, frame_numbers
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("pose_type", EXERCISES)
+def test_random_walk_parity(seed, pose_type):
+    rng = np.random.default_rng(seed)
+    angles, frame_numbers = random_walk(rng, 2000, 3, dropout=0.1)
+    params = exercise_settings[pose_type]
+    result = assert_parity(angles, frame_numbers, pose_type, params['up_angle'], params['down_angle'], fps=30.0,
+                           exercise_mass=80.0, displacement=0.5)
+    if pose_type in REP_TRANSITIONS:
+        assert result['count'].sum() > 0  # The walk crosses the thresholds, so reps are exercised
+
+
+@pytest.mark.parametrize("dropout", [0.0, 0.5, 0.95, 1.0])
+@pytest.mark.parametrize("pose_type", ['pullups', 'pushups'])
+def test_dropout_parity(dropout, pose_type):
+    rng = np.random.default_rng(1)
+    angles, frame_numbers = random_walk(rng, 1500, 2, dropout=dropout)
+    params = exercise_settings[pose_type]
+    assert_parity(angles, frame_numbers, pose_type, params['up_angle'], params['down_angle'])
+
+
+@pytest.mark.parametrize("num_persons", [1, 2, 7])
+def test_many_tracks_parity(num_persons):
+    rng = np.random.default_rng(num_persons)
+    angles, frame_numbers = random_walk(rng, 800, num_persons, dropout=0.2)
+    # Tracks that appear late and leave early
+    angles[:200, ::2] = np.nan
+    angles[600:, 1::2] = np.nan
+    for pose_type in ('pullups', 'pushups'):
+        params = exercise_settings[pose_type]
+        result = assert_parity(angles, frame_numbers, pose_type, params['up_angle'], params['down_angle'])
+        assert len(result['count']) == num_persons
+
+
+@pytest.mark.parametrize("pose_type", ['pullups', 'pushups'])
+def test_angles_on_the_thresholds(pose_type):
+    # Comparisons are strict, angles exactly on a threshold must not change the stage in either engine
+    params = exercise_settings[pose_type]
+    up, down = params['up_angle'], params['down_angle']
+    values = np.array([up - 1, up, up + 1, down - 1, down, down + 1], dtype=np.float64)
+    rng = np.random.default_rng(2)
+    angles = rng.choice(values, size=(3000, 3))
+    assert_parity(angles, np.arange(1, 3001), pose_type, up, down)
+
+
+def test_equal_pullup_thresholds():
+    rng = np.random.default_rng(3)
+    angles = rng.choice([134.0, 135.0, 136.0], size=(1000, 2))
+    assert_parity(angles, np.arange(1, 1001), 'pullups', 135, 135)
+
+
+def test_overlapping_pullup_thresholds_are_rejected():
+    with pytest.raises(ValueError):
+        score_angles(np.full((3, 1), 130.0), np.arange(1, 4), 'pullups', up_angle=150, down_angle=120)
+
+
+def test_known_pullup_series():
+    # down at frame 2, up at frame 5: one rep of 3 frames
+    angles = np.array([[130], [160], [140], [np.nan], [100], [110]], dtype=np.float64)
+    result = assert_parity(angles, np.arange(1, 7), 'pullups', 120, 150, fps=30.0, exercise_mass=70.0,
+                           displacement=0.6)
+    assert result['count'].tolist() == [1]
+    np.testing.assert_allclose(result['rep_durations'][0], [3 / 30])
+    np.testing.assert_allclose(result['power_outputs'][0], [70.0 * 9.81 * 0.6 / 0.1])
+
+
+@pytest.mark.parametrize("num_frames", [0, 1])
+def test_tiny_series(num_frames):
+    angles = np.full((num_frames, 1), 170.0)
+    result = assert_parity(angles, np.arange(1, num_frames + 1), 'pullups', 120, 150)
+    assert result['count'].tolist() == [0]
+
+
+def test_pose_angles_match_per_frame_formula():
+    rng = np.random.default_rng(4)
+    keypoints = rng.uniform(0, 640, (500, 3, 2))
+    expected = [estimate_pose_angle(*k) for k in keypoints]
+    np.testing.assert_allclose(pose_angles(keypoints[:, 0], keypoints[:, 1], keypoints[:, 2]), expected)
+
+
+def test_angle_series_and_primary_athlete():
+    rng = np.random.default_rng(5)
+    keypoints = rng.uniform(0, 640, (6, 17, 3))
+    frames = np.array([1, 1, 2, 3, 3, 4])
+    persons = np.array([7, 3, 7, 3, 7, 3])
+    frame_numbers, person_keys, angles = angle_series(frames, persons, keypoints, [5, 7, 9])
+    assert frame_numbers.tolist() == [1, 2, 3, 4] and person_keys.tolist() == [3, 7]
+    assert np.isnan(angles[1, 0]) and np.isnan(angles[3, 1])
+    # Same reps: the person seen first wins, then the lowest track ID
+    assert primary_index(np.array([0, 0]), angles, frame_numbers, person_keys) == 0
+    assert primary_index(np.array([0, 2]), angles, frame_numbers, person_keys) == 1
+
+
+def test_check_parity_script():
+    assert check_parity(num_frames=500, seed=7)
@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("cv2")
+pytest.importorskip("ultralytics")
+from src.segment_processing import plan_segments, stitch_segments
+
+
+def segment(frames, people: dict) -> dict:
+    """Detections of `people` ({track_id: x position}) on every frame of `frames` (global, 1-based)."""
+    rows = [(f, tid, x) for f in frames for tid, x in people.items()]
+    keypoints = np.zeros((len(rows), 17, 3), dtype=np.float32)
+    for i, (f, _, x) in enumerate(rows):
+        keypoints[i, :, 0] = x + np.arange(17)
+        keypoints[i, :, 1] = 200 + f  # Moves down slowly, the same in both segments
+        keypoints[i, :, 2] = 1
+    return {'frames': np.array([f for f, _, _ in rows], dtype=np.int64),
+            'track_ids': np.array([t for _, t, _ in rows], dtype=np.int64),
+            'keypoints': keypoints}
+
+
+def test_plan_segments_contiguous_with_overlap():
+    assert plan_segments(300, 3, 30) == [(0, 0, 100), (70, 100, 200), (170, 200, None)]
+
+
+@pytest.mark.parametrize("total_frames, num_segments, overlap", [(1000, 7, 30), (301, 4, 10), (50, 2, 0)])
+def test_plan_segments_cover_every_frame_once(total_frames, num_segments, overlap):
+    segments = plan_segments(total_frames, num_segments, overlap)
+    assert segments[0][:2] == (0, 0)
+    assert segments[-1][2] is None
+    for (_, _, end), (warmup_start, start, _) in zip(segments, segments[1:]):
+        assert start == end
+        assert warmup_start == max(0, start - overlap)
+
+
+def test_plan_segments_too_short_for_overlap():
+    # Segments shorter than twice the overlap would be mostly warm-up
+    assert plan_segments(100, 10, 30) == [(0, 0, None)]
+    assert len(plan_segments(100, 10, 10)) == 5
+
+
+def test_stitch_matches_tracks_across_the_seam():
+    segments = [(0, 0, 10), (5, 10, None)]
+    # The second segment's tracker numbers the same two people differently
+    results = [segment(range(1, 11), {1: 100, 2: 400}),
+               segment(range(6, 21), {7: 400, 3: 100})]
+    frames, track_ids, keypoints = stitch_segments(segments, results)
+
+    # Warm-up frames 6-10 of the second segment are dropped, every frame appears once per person
+    assert sorted(set(frames.tolist())) == list(range(1, 21))
+    assert len(frames) == 2 * 20
+    # Each person keeps one global ID over the whole video
+    for x in (100, 400):
+        ids = track_ids[keypoints[:, 0, 0] == x]
+        assert len(set(ids.tolist())) == 1
+    assert len(set(track_ids.tolist())) == 2
+
+
+def test_stitch_new_and_distant_people_get_new_ids():
+    segments = [(0, 0, 10), (5, 10, None)]
+    # Track 4 is far from anyone of the first segment, track 5 only appears after the seam
+    second, late = segment(range(6, 21), {2: 100, 4: 900}), segment(range(15, 21), {5: 600})
+    results = [segment(range(1, 11), {1: 100}),
+               {name: np.concatenate([second[name], late[name]]) for name in second}]
+    frames, track_ids, keypoints = stitch_segments(segments, results, max_distance=50.0)
+
+    by_x = {x: set(track_ids[keypoints[:, 0, 0] == x].tolist()) for x in (100, 900, 600)}
+    assert all(len(ids) == 1 for ids in by_x.values())
+    assert len(set.union(*by_x.values())) == 3
+    assert by_x[100] == {0}
+
+
+def test_stitch_single_segment_keeps_detections():
+    result = segment(range(1, 6), {3: 100, 8: 300})
+    frames, track_ids, _ = stitch_segments([(0, 0, None)], [result])
+    np.testing.assert_array_equal(frames, result['frames'])
+    assert sorted(set(track_ids.tolist())) == [0, 1]
@@ -0,0 +1,77 @@
+import pytest
+
+pytest.importorskip("flask_mongoengine", exc_type=ImportError)
+pytest.importorskip("mongomock")
+from leaderboard.database.mongodb import UserStats
+from leaderboard.user_stats import user_stats, record_created, record_completed, record_removed
+
+
+@pytest.fixture
+def complete(make_workout):
+    """Returns a factory of saved, complete workouts recorded in the rollup."""
+    def make(power: float, exercise_type: str = 'pullups', reps: int = 5):
+        workout = make_workout(exercise_type=exercise_type, max_power_per_kg=power, rep_count=reps,
+                               status='complete').save()
+        record_created(workout)
+        record_completed(workout)
+        return workout
+    return make
+
+
+def test_records_wait_for_the_first_read(user, complete):
+    # No rollup yet: the updates do nothing, and the first read builds it from every workout
+    complete(10)
+    complete(4, exercise_type='pushups')
+    assert UserStats.objects(user=user.id).first() is None
+
+    stats = user_stats(user.id)
+    assert (stats.workout_count, stats.total_reps, stats.best_power_per_kg) == (2, 10, 10)
+    assert stats.exercise_powers == {'pullups': 10, 'pushups': 4}
+
+
+def test_records_update_an_existing_rollup(user, make_workout, complete):
+    user_stats(user.id)
+    pending = make_workout(status='processing').save()
+    record_created(pending)
+    complete(7, reps=3)
+
+    stats = user_stats(user.id)
+    assert (stats.workout_count, stats.total_reps, stats.best_power_per_kg) == (2, 3, 7)
+
+
+def test_removing_the_best_workout_rebuilds_the_maximum(user, complete):
+    best = complete(10)
+    complete(6)
+    complete(8, exercise_type='pushups')
+    user_stats(user.id)
+
+    best.delete()
+    record_removed(best)
+
+    stats = user_stats(user.id)
+    assert (stats.workout_count, stats.total_reps) == (2, 10)
+    assert stats.exercise_powers == {'pullups': 6, 'pushups': 8}
+    assert stats.best_power_per_kg == 8
+
+
+def test_removing_another_workout_keeps_the_maximum(user, complete):
+    complete(10)
+    other = complete(6)
+    user_stats(user.id)
+
+    other.delete()
+    record_removed(other)
+
+    stats = user_stats(user.id)
+    assert (stats.workout_count, stats.total_reps, stats.best_power_per_kg) == (1, 5, 10)
+
+
+def test_reset_for_reprocessing_keeps_the_workout_count(user, complete):
+    workout = complete(10)
+    user_stats(user.id)
+
+    workout.update(status='processing')
+    record_removed(workout, deleted=False)
+
+    stats = user_stats(user.id)
+    assert (stats.workout_count, stats.total_reps, stats.best_power_per_kg) == (1, 0, 0)
@@ -0,0 +1,39 @@
+import os
+from leaderboard.database.video_cache import VideoCache
+
+
+def _fill(cache: VideoCache, url: str, data: bytes) -> str:
+    def fetch(path):
+        with open(path, 'wb') as f:
+            f.write(data)
+    return cache.get(url, fetch)
+
+
+def test_pinned_copy_survives_eviction(tmp_path):
+    cache = VideoCache(str(tmp_path / "cache"), max_bytes=10)
+    cached = _fill(cache, "gs://bucket/a.mp4", b"a" * 8)
+    pinned = str(tmp_path / "job" / "video.mp4")
+    os.makedirs(os.path.dirname(pinned))
+    cache.pin(cached, pinned)
+
+    # Filling another entry evicts the first one, the pinned copy stays readable
+    _fill(cache, "gs://bucket/b.mp4", b"b" * 8)
+    assert not os.path.exists(cached)
+    with open(pinned, 'rb') as f:
+        assert f.read() == b"a" * 8
+
+
+def test_pin_replaces_destination(tmp_path):
+    cache = VideoCache(str(tmp_path / "cache"), max_bytes=100)
+    cached = _fill(cache, "gs://bucket/a.mp4", b"new")
+    pinned = tmp_path / "video.mp4"
+    pinned.write_bytes(b"old")
+    cache.pin(cached, str(pinned))
+    assert pinned.read_bytes() == b"new"
+    assert sorted(os.listdir(tmp_path)) == ["cache", "video.mp4"]
+
+
+def test_merge_stats_of_processes_sharing_the_directory():
+    service = {'hits': 1, 'misses': 0, 'evictions': 0, 'bytes': 300}
+    worker = {'hits': 2, 'misses': 3, 'evictions': 1, 'bytes': 500}
+    assert VideoCache.merge_stats(service, worker) == {'hits': 3, 'misses': 3, 'evictions': 1, 'bytes': 500}
@@ -0,0 +1,67 @@
+import shutil
+import numpy as np
+import pytest
+
+pytest.importorskip("cv2")
+from src.video_pipeline import FFmpegReader, FFmpegWriter, FrameWriter
+
+requires_ffmpeg = pytest.mark.skipif(shutil.which('ffmpeg') is None, reason="ffmpeg is not installed")
+
+
+@requires_ffmpeg
+def test_corrupt_input_raises(tmp_path):
+    path = tmp_path / "corrupt.mp4"
+    path.write_bytes(b"\x00\x00\x00\x18ftypmp42" + b"not a video" * 1000)
+    reader = FFmpegReader(str(path), (64, 48))
+    try:
+        with pytest.raises(RuntimeError, match="ffmpeg failed to decode"):
+            reader.read()
+        assert not reader.isOpened()
+    finally:
+        reader.release()
+
+
+@requires_ffmpeg
+def test_missing_input_raises(tmp_path):
+    reader = FFmpegReader(str(tmp_path / "missing.mp4"), (64, 48))
+    try:
+        with pytest.raises(RuntimeError, match="missing.mp4"):
+            reader.read()
+    finally:
+        reader.release()
+
+
+@requires_ffmpeg
+def test_writer_close_is_idempotent(tmp_path):
+    writer = FFmpegWriter(str(tmp_path / "out.mp4"), 30, (64, 48))
+    writer.write(np.zeros((48, 64, 3), dtype=np.uint8))
+    writer.close()
+    writer.close()
+    writer.release()  # Already closed, does nothing
+    assert writer.process.returncode is not None
+
+
+class RecordingWriter:
+    def __init__(self):
+        self.frames = []
+        self.closed = 0
+
+    def write(self, im0):
+        self.frames.append(im0)
+
+    def release(self):
+        raise AssertionError("close must not finish the video")
+
+    def close(self):
+        self.closed += 1
+
+
+def test_frame_writer_close_stops_thread():
+    underlying = RecordingWriter()
+    writer = FrameWriter(underlying, queue_size=2)
+    writer.start()
+    writer.write(np.zeros((2, 2, 3), dtype=np.uint8))
+    writer.close()
+    writer.close()
+    assert not writer.is_alive()
+    assert underlying.closed == 2
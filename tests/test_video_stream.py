@@ -0,0 +1,73 @@
+import hashlib
+import io
+import os
+import pytest
+from leaderboard.database.video_cache import VideoCache
+from leaderboard.database.video_stream import VideoStream, STREAM_CHUNK_SIZE
+
+
+@pytest.fixture
+def video_bytes():
+    return os.urandom(8 * STREAM_CHUNK_SIZE + 123)
+
+
+def test_full_read_hash(video_bytes):
+    stream = VideoStream(io.BytesIO(video_bytes[100:]), head=video_bytes[:100])
+    try:
+        with open(stream.path, 'rb') as f:
+            assert f.read() == video_bytes
+        assert stream.content_hash() == hashlib.sha256(video_bytes).hexdigest()
+    finally:
+        stream.close()
+
+
+def test_hash_covers_unread_tail(video_bytes):
+    # The decoder stops partway, e.g. at trailing boxes after the last frame
+    stream = VideoStream(io.BytesIO(video_bytes))
+    try:
+        with open(stream.path, 'rb') as f:
+            assert f.read(STREAM_CHUNK_SIZE // 2)
+        assert stream.content_hash() == hashlib.sha256(video_bytes).hexdigest()
+        assert stream.bytes_streamed < len(video_bytes)
+    finally:
+        stream.close()
+
+
+def test_hash_after_close_without_reader(video_bytes):
+    # The decoder never opened the pipe, close() breaks it
+    stream = VideoStream(io.BytesIO(video_bytes))
+    stream.close()
+    assert stream.content_hash() == hashlib.sha256(video_bytes).hexdigest()
+
+
+class FailingReader(io.BytesIO):
+    def read(self, size=-1):
+        if self.tell() >= STREAM_CHUNK_SIZE:
+            raise ConnectionError("connection reset")
+        return super().read(size)
+
+
+def test_stream_fills_cache(tmp_path, video_bytes):
+    cache = VideoCache(str(tmp_path / "cache"), max_bytes=len(video_bytes) * 2)
+    url = "gs://bucket/videos/a.mp4"
+    # The decoder stops partway, the cache still gets the whole video
+    stream = VideoStream(io.BytesIO(video_bytes), fill=cache.open_fill(url))
+    try:
+        with open(stream.path, 'rb') as f:
+            assert f.read(STREAM_CHUNK_SIZE // 2)
+        stream.content_hash()
+    finally:
+        stream.close()
+    with open(cache.lookup(url), 'rb') as f:
+        assert f.read() == video_bytes
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_failed_stream_leaves_no_cache_entry(tmp_path, video_bytes):
+    cache = VideoCache(str(tmp_path / "cache"), max_bytes=len(video_bytes) * 2)
+    stream = VideoStream(FailingReader(video_bytes), fill=cache.open_fill("gs://bucket/videos/a.mp4"))
+    stream.close()
+    with pytest.raises(ConnectionError):
+        stream.content_hash()
+    assert cache.lookup("gs://bucket/videos/a.mp4") is None
+    assert os.listdir(cache.cache_dir) == []
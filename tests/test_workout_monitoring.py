@@ -0,0 +1,68 @@
+import time
+import numpy as np
+import pytest
+
+cv2 = pytest.importorskip("cv2")
+pytest.importorskip("ultralytics")
+from src import workout_monitoring
+
+
+class ClosingCapture:
+    """Capture that closes itself at EOF, like FFmpegReader once ffmpeg exits."""
+
+    def __init__(self, frames: int, size: tuple = (64, 48)):
+        self.frames = frames
+        self.size = size
+        self.decoded = 0
+        self.opened = True
+
+    def get(self, prop):
+        return {cv2.CAP_PROP_FRAME_WIDTH: self.size[0], cv2.CAP_PROP_FRAME_HEIGHT: self.size[1],
+                cv2.CAP_PROP_FPS: 30, cv2.CAP_PROP_FRAME_COUNT: self.frames}.get(prop, 0)
+
+    def read(self):
+        if self.decoded >= self.frames:
+            self.opened = False
+            return False, None
+        self.decoded += 1
+        return True, np.zeros((self.size[1], self.size[0], 3), dtype=np.uint8)
+
+    def isOpened(self):
+        return self.opened
+
+    def release(self):
+        self.opened = False
+
+
+class CountingGym:
+    """Stands in for a warm AIGym, counting the frames it is given."""
+
+    backend = "pytorch"
+
+    def __init__(self):
+        self.frame_count = 0
+
+    def reset(self, **kwargs):
+        self.frame_count = 0
+
+    def monitor(self, im0, is_display=False, render=True):
+        time.sleep(0.001)  # Slower than decoding, so frames are still queued at EOF
+        self.frame_count += 1
+        return im0
+
+    def monitor_batch(self, frames, is_display=False, render=True):
+        return [self.monitor(im0) for im0 in frames]
+
+    def primary(self):
+        return None
+
+
+@pytest.mark.parametrize("pipelined, batch_size", [(True, 1), (True, 4), (False, 1)])
+def test_processes_every_decoded_frame(monkeypatch, pipelined, batch_size):
+    cap = ClosingCapture(100)
+    monkeypatch.setattr(workout_monitoring.cv2, "VideoCapture", lambda path: cap)
+    gym = CountingGym()
+    workout_monitoring.process_video("workout.mp4", body_mass=70, exercise_mass=70, render=False, gym=gym,
+                                     pipelined=pipelined, batch_size=batch_size, decoder="opencv")
+    assert cap.decoded == 100
+    assert gym.frame_count == cap.decoded